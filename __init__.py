@@ -1 +1 @@
-# package init
+# package init
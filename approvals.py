@@ -0,0 +1,212 @@
+"""Approval rule evaluation.
+
+Each Expense carries running counters (steps_total, steps_pending,
+approvals_count, rejections_count, special_approvals) that are updated as
+decisions come in, so evaluating a company's ApprovalRule is O(1) and never
+re-reads the steps or decisions of the expense. Company rules are compiled
+once (CSV parsed, mode normalised) and cached per process for RULE_TTL
+seconds; `set_rule` drops them in every worker through the cache bus.
+`simulate` replays a window of past decisions under a candidate rule before
+an admin adopts it.
+"""
+import os
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, func, update
+from sqlmodel import select
+
+import bus
+from cache import TTLCache
+from models import ApprovalDecision, ApprovalRule, ApprovalStep, Expense
+
+RULE_TTL = float(os.environ.get("RULE_TTL", "300"))
+RULE_CACHE_SIZE = int(os.environ.get("RULE_CACHE_SIZE", "10000"))
+
+
+@dataclass(frozen=True)
+class CompiledRule:
+    percentage_threshold: Optional[int]
+    special_approver_ids: FrozenSet[int]
+    mode: str
+
+
+def compile_rule(rule: ApprovalRule) -> CompiledRule:
+    ids = frozenset(int(x) for x in (rule.special_approver_ids or '').split(',') if x.strip())
+    mode = 'and' if (rule.mode or '').lower() == 'and' else 'or'
+    return CompiledRule(rule.percentage_threshold, ids, mode)
+
+
+_rules = TTLCache(RULE_CACHE_SIZE, RULE_TTL)
+
+
+def get_rule(session, company_id: int) -> Optional[CompiledRule]:
+    cached = _rules.get(company_id)
+    if cached:
+        return cached
+    rule = session.exec(select(ApprovalRule).where(ApprovalRule.company_id == company_id)).first()
+    if not rule:
+        return None
+    compiled = compile_rule(rule)
+    _rules.put(company_id, compiled)
+    return compiled
+
+
+def invalidate_rule(company_id: Optional[int] = None):
+    """Drop the cached rule for one company, or all of them."""
+    if company_id is None:
+        _rules.clear()
+    else:
+        _rules.pop(company_id)
+
+
+def set_rule(session, company_id: int, percentage_threshold: Optional[int], special_approver_ids: Sequence[int],
+             mode: str) -> CompiledRule:
+    """Replace the company's rule in the caller's transaction.
+
+    special_approvals counts approvals by the special approvers of the rule in force when
+    they were made, so the pending expenses' counters are recounted from their decisions
+    under the new set; the rules job then settles any the new rule decides. Every worker
+    drops its cached copy when the transaction commits."""
+    rule = session.exec(select(ApprovalRule).where(ApprovalRule.company_id == company_id)).first() \
+        or ApprovalRule(company_id=company_id)
+    rule.percentage_threshold = percentage_threshold
+    rule.special_approver_ids = ','.join(str(i) for i in sorted(set(special_approver_ids)))
+    rule.mode = mode
+    session.add(rule)
+    compiled = compile_rule(rule)
+    dec, exp = ApprovalDecision.__table__, Expense.__table__
+    special = (select(func.count()).select_from(dec)
+               .where(and_(dec.c.expense_id == exp.c.id, dec.c.approved.is_(True),
+                           dec.c.approver_id.in_(sorted(compiled.special_approver_ids) or [-1])))
+               .scalar_subquery())
+    session.execute(update(exp).where(exp.c.company_id == company_id).where(exp.c.status == 'pending')
+                    .values(special_approvals=special, version=exp.c.version + 1))
+    bus.publish("rule", company_id, conn=session.connection())
+    return compiled
+
+
+def record_decision(expense: Expense, rule: Optional[CompiledRule], approver_id: int, approved: bool):
+    """Fold one decision on an open step into the expense counters."""
+    expense.steps_pending = max(expense.steps_pending - 1, 0)
+    if approved:
+        expense.approvals_count += 1
+        if rule and approver_id in rule.special_approver_ids:
+            expense.special_approvals += 1
+    else:
+        expense.rejections_count += 1
+
+
+def evaluate(expense: Expense, rule: Optional[CompiledRule]) -> Tuple[str, str]:
+    """Return (status, reason) for the expense given its current counters."""
+    conditions = []
+    if rule and rule.special_approver_ids:
+        conditions.append((expense.special_approvals > 0, "special approver approved"))
+    if rule and rule.percentage_threshold:
+        total = expense.steps_total
+        pct = (expense.approvals_count / total * 100) if total else 0
+        conditions.append((pct >= rule.percentage_threshold, f"{pct}% approvals >= {rule.percentage_threshold}%"))
+    if conditions:
+        if rule.mode == 'and':
+            if all(ok for ok, _ in conditions):
+                return 'approved', " and ".join(reason for _, reason in conditions)
+        else:
+            for ok, reason in conditions:
+                if ok:
+                    return 'approved', reason
+    if expense.steps_pending == 0:
+        # every step has decided: any rejection rejects, otherwise approve
+        return ('rejected' if expense.rejections_count else 'approved'), "finalized"
+    return 'pending', "moved to next approver"
+
+
+class _Counters:
+    """The counter fields of an Expense, for replaying decisions without ORM objects."""
+    __slots__ = ("steps_total", "steps_pending", "approvals_count", "rejections_count", "special_approvals")
+
+    def __init__(self, steps: int):
+        self.steps_total = self.steps_pending = steps
+        self.approvals_count = self.rejections_count = self.special_approvals = 0
+
+
+def replay(steps: int, decisions: Iterable[Tuple[int, bool]], rule: Optional[CompiledRule]) -> Tuple[str, str]:
+    """The (status, reason) an expense with `steps` steps reaches under `rule` when its
+    (approver_id, approved) decisions arrive in order, as make_decision and the rules
+    job would settle it. A settled status never changes: rule conditions only become
+    true as approvals accumulate, and finalising needs every step decided."""
+    counters = _Counters(steps)
+    for approver_id, approved in decisions:
+        record_decision(counters, rule, approver_id, approved)
+        status, reason = evaluate(counters, rule)
+        if status != 'pending':
+            return status, reason
+    return evaluate(counters, rule)
+
+
+def simulate(session, company_id: int, candidate: CompiledRule, date_from: Optional[date] = None,
+             date_to: Optional[date] = None, samples: int = 20) -> dict:
+    """Compare outcomes under `candidate` with the company's current rule for its expenses
+    dated in [date_from, date_to].
+
+    Three set-based reads (expenses, step counts, decisions in arrival order) are grouped
+    by expense in memory and every expense is replayed under both rules in one pass, so the
+    cost is a few index scans plus O(decisions). Both sides are replays, so only the rule
+    change shows up as a difference, not drift from earlier rules or manual fixes."""
+    started = time.perf_counter()
+    current = get_rule(session, company_id)
+    exp, step, dec = Expense.__table__, ApprovalStep.__table__, ApprovalDecision.__table__
+    window = [exp.c.company_id == company_id]
+    if date_from is not None:
+        window.append(exp.c.date >= date_from)
+    if date_to is not None:
+        window.append(exp.c.date <= date_to)
+
+    expenses = session.execute(
+        select(exp.c.id, exp.c.date, exp.c.submitter_id, exp.c.amount_company_currency, exp.c.status)
+        .where(*window).order_by(exp.c.id)).all()
+    steps = dict(session.execute(
+        select(step.c.expense_id, func.count()).join_from(step, exp, exp.c.id == step.c.expense_id)
+        .where(*window).group_by(step.c.expense_id)).all())
+    decisions: Dict[int, List[Tuple[int, bool]]] = {}
+    for expense_id, approver_id, approved in session.execute(
+            select(dec.c.expense_id, dec.c.approver_id, dec.c.approved).join_from(dec, exp, exp.c.id == dec.c.expense_id)
+            .where(*window).order_by(dec.c.expense_id, dec.c.id)).all():
+        decisions.setdefault(expense_id, []).append((approver_id, bool(approved)))
+
+    # a rule only sees whether each approver is one of its special approvers, so expenses
+    # with the same step count and (special under either rule, approved) sequence share
+    # an outcome: replay each distinct history once
+    specials = (current.special_approver_ids if current else frozenset(), candidate.special_approver_ids)
+    outcomes: Dict[tuple, Tuple[Tuple[str, str], Tuple[str, str]]] = {}
+    before, after, transitions, changed = Counter(), Counter(), Counter(), []
+    for expense_id, day, submitter_id, amount, stored in expenses:
+        n, history = steps.get(expense_id, 0), decisions.get(expense_id, ())
+        key = (n, tuple((a in specials[0], a in specials[1], ok) for a, ok in history))
+        outcome = outcomes.get(key)
+        if outcome is None:
+            outcome = outcomes[key] = (replay(n, history, current), replay(n, history, candidate))
+        (was, _), (now, reason) = outcome
+        before[was] += 1
+        after[now] += 1
+        if was != now:
+            transitions[f"{was}->{now}"] += 1
+            if len(changed) < samples:
+                changed.append({"expense_id": expense_id, "date": str(day) if day else None, "submitter_id": submitter_id,
+                                "amount_company_currency": amount, "status": stored, "current": was,
+                                "candidate": now, "reason": reason})
+    return {"expenses": len(expenses), "decisions": sum(len(d) for d in decisions.values()),
+            "changed": sum(transitions.values()), "transitions": dict(transitions),
+            "current": dict(before), "candidate": dict(after), "samples": changed,
+            "seconds": round(time.perf_counter() - started, 3)}
+
+
+def approval_chain(manager_ids: Sequence[int], approver_ids: Optional[Sequence[int]], admin_ids: Sequence[int]) -> List[int]:
+    """Approvers in sequence order: the explicit list if given, else managers (nearest first) then
+    company admins, skipping admins already in the chain as managers."""
+    if approver_ids:
+        return list(approver_ids)
+    chain = list(manager_ids)
+    return chain + [a for a in admin_ids if a not in chain]
@@ -0,0 +1,151 @@
+"""Bulk expense submission.
+
+Submitters and companies for a whole batch are resolved with a few IN
+queries, approval chains come from the cached org trees, each distinct currency pair is priced once, and expenses plus
+their approval steps are written in chunked transactions with batched
+inserts. A failing chunk is rolled back and its rows retried one at a time,
+so only the offending rows report an error.
+"""
+import json
+import math
+import os
+from datetime import date
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlmodel import select
+
+import money
+from db import get_session
+from models import ApprovalStep, Company, Expense, User
+from orgchart import get_tree
+from reports import apply_deltas, expense_deltas, merge
+
+BULK_MAX_ROWS = int(os.environ.get("BULK_MAX_ROWS", "50000"))
+BULK_CHUNK_SIZE = int(os.environ.get("BULK_CHUNK_SIZE", "1000"))
+# stay under SQLite's bound-parameter limit for IN lists
+IN_BATCH = 500
+
+
+def parse_rows(body: bytes, content_type: str = '') -> list:
+    """Accept a JSON array or NDJSON (one object per line)."""
+    text = body.decode('utf-8').strip()
+    if not text:
+        return []
+    if 'ndjson' in content_type or not text.startswith('['):
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    rows = json.loads(text)
+    if not isinstance(rows, list):
+        raise ValueError('expected a JSON array or NDJSON')
+    return rows
+
+
+def _fetch_in(session, column, ids: Iterable[int], *criteria) -> list:
+    ids = list(ids)
+    out = []
+    for i in range(0, len(ids), IN_BATCH):
+        q = select(column.class_).where(column.in_(ids[i:i + IN_BATCH]))
+        for c in criteria:
+            q = q.where(c)
+        out.extend(session.exec(q).all())
+    return out
+
+
+def _validate(row) -> dict:
+    if not isinstance(row, dict):
+        raise ValueError('row must be an object')
+    try:
+        submitter_id = int(row['submitter_id'])
+        amount = float(row['amount'])
+        currency = str(row['currency'])
+    except KeyError as e:
+        raise ValueError(f'missing field {e.args[0]}')
+    except (TypeError, ValueError):
+        raise ValueError('submitter_id, amount and currency must be valid')
+    if not math.isfinite(amount):
+        raise ValueError('amount must be a finite number')
+    d = date.fromisoformat(row['date_']) if row.get('date_') else date.today()
+    approver_ids = row.get('approver_ids') or None
+    if approver_ids is not None:
+        approver_ids = [int(a) for a in approver_ids]
+    return {"submitter_id": submitter_id, "amount": amount, "currency": currency, "date": d,
+            "category": row.get('category'), "description": row.get('description'), "approver_ids": approver_ids}
+
+
+def _insert(chunk: list):
+    """Write one chunk of (index, expense, chain) in a single transaction; sets each expense's id."""
+    with get_session() as s:
+        # copies: return_defaults writes ids into the mappings, which must not survive a rollback
+        mappings = [dict(e) for _, e, _ in chunk]
+        # return_defaults hands back the primary keys the steps need
+        s.bulk_insert_mappings(Expense, mappings, return_defaults=True)
+        steps = [{"expense_id": m["id"], "approver_id": aid, "sequence": seq, "completed": False}
+                 for m, (_, _, chain) in zip(mappings, chunk) for seq, aid in enumerate(chain, start=1)]
+        s.bulk_insert_mappings(ApprovalStep, steps)
+        apply_deltas(s, merge(d for e in mappings for d in expense_deltas(
+            e["company_id"], e["submitter_id"], e["category"], e["date"], e["status"], e["amount_company_currency"])))
+        s.commit()
+    for m, (_, e, _) in zip(mappings, chunk):
+        e["id"] = m["id"]
+
+
+def submit_batch(rows: list, get_quote: Callable[[str, str], Optional[Tuple[float, float]]], chunk_size: int = BULK_CHUNK_SIZE) -> List[dict]:
+    """Insert a batch of expenses and return one result per input row, in order."""
+    results: List[dict] = [None] * len(rows)
+    valid = []
+    for i, row in enumerate(rows):
+        try:
+            valid.append((i, _validate(row)))
+        except (ValueError, TypeError) as e:
+            results[i] = {"index": i, "error": str(e)}
+
+    with get_session() as s:
+        users = {u.id: u for u in _fetch_in(s, User.id, {v["submitter_id"] for _, v in valid})}
+        companies = {c.id: c for c in _fetch_in(s, Company.id, {u.company_id for u in users.values() if u.company_id})}
+        trees = {cid: get_tree(s, cid) for cid in companies}
+
+    quotes: Dict[tuple, Optional[Tuple[float, float]]] = {}
+    pending = []
+    for i, v in valid:
+        user = users.get(v["submitter_id"])
+        if not user:
+            results[i] = {"index": i, "error": 'submitter not found'}
+            continue
+        company = companies.get(user.company_id)
+        if not company:
+            results[i] = {"index": i, "error": 'company not found'}
+            continue
+        pair = (v["currency"], company.currency)
+        if pair not in quotes:
+            quotes[pair] = get_quote(*pair)
+        # unknown currencies fall back 1:1, same as submit_expense
+        try:
+            priced = money.price(v["amount"], v["currency"], company.currency, quotes[pair])
+        except ArithmeticError:
+            # decimal.InvalidOperation: too many digits for the minor-unit conversion
+            results[i] = {"index": i, "error": 'amount out of range'}
+            continue
+        chain = trees[company.id].approvers(user.id, priced["amount_company_currency"], v["approver_ids"], user.manager_id)
+        expense = {
+            "submitter_id": user.id, "company_id": company.id, "currency": v["currency"], **priced,
+            "category": v["category"], "description": v["description"], "date": v["date"], "status": "pending",
+            "steps_total": len(chain), "steps_pending": len(chain),
+        }
+        pending.append((i, expense, chain))
+
+    for start in range(0, len(pending), chunk_size):
+        chunk = pending[start:start + chunk_size]
+        try:
+            _insert(chunk)
+            written = chunk
+        except Exception:
+            # find the bad rows: retry the chunk one row per transaction
+            written = []
+            for item in chunk:
+                try:
+                    _insert([item])
+                    written.append(item)
+                except Exception as e:
+                    results[item[0]] = {"index": item[0], "error": f'insert failed: {e.__class__.__name__}'}
+        for i, e, _ in written:
+            results[i] = {"index": i, "id": e["id"], "amount_company_currency": e["amount_company_currency"], "status": "pending"}
+    return results
@@ -0,0 +1,129 @@
+"""Cache invalidation across worker processes.
+
+Each worker keeps its own in-memory caches (principals, org trees, compiled
+rules). `publish(topic, key)` drops the entry in this process
+at once and, with CACHE_BUS=db, appends a row to `cacheevent` that every
+other worker picks up within BUS_POLL seconds and applies the same way.
+The table lives in the application database, so this works for several
+workers on one host (SQLite) as well as several nodes (Postgres).
+CACHE_BUS=local (the default for a single process) skips the broadcast.
+Ids are handed out at insert but become visible at commit, so on Postgres an
+event can appear below ids already seen; each poll therefore also re-reads
+the last BUS_LAG seconds of events and skips the ones it has applied.
+Rate tables are not on the bus; they only expire after RATES_TTL.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import delete, func, insert, or_, select
+
+from db import engine
+from models import CacheEvent
+
+log = logging.getLogger(__name__)
+
+CACHE_BUS = os.environ.get("CACHE_BUS", "local")
+BUS_POLL = float(os.environ.get("BUS_POLL", "1"))
+# events older than this are pruned; a worker asleep longer than that should restart cold anyway
+BUS_RETENTION = float(os.environ.get("BUS_RETENTION", "3600"))
+# longer than any transaction that publishes; later commits than that are missed
+BUS_LAG = float(os.environ.get("BUS_LAG", "120"))
+
+ORIGIN = uuid.uuid4().hex[:12]
+_handlers: Dict[str, List[Callable[[Optional[str]], None]]] = defaultdict(list)
+_last_id: Optional[int] = None
+# ids applied (or skipped as our own) within the lag window -> created_at
+_seen: Dict[int, datetime] = {}
+_task: Optional[asyncio.Task] = None
+
+
+def subscribe(topic: str, handler: Callable[[Optional[str]], None]):
+    """Call `handler(key)` whenever `topic` is published, here or in another worker."""
+    _handlers[topic].append(handler)
+
+
+def _apply(topic: str, key: Optional[str]):
+    for handler in _handlers.get(topic, ()):
+        try:
+            handler(key)
+        except Exception:
+            log.exception("cache bus handler for %s failed", topic)
+
+
+def publish(topic: str, key=None, conn=None):
+    """Invalidate locally and broadcast; pass `conn` to publish inside the caller's transaction."""
+    key = None if key is None else str(key)
+    _apply(topic, key)
+    if CACHE_BUS != "db":
+        return
+    stmt = insert(CacheEvent.__table__).values(topic=topic, key=key, origin=ORIGIN, created_at=datetime.utcnow())
+    if conn is not None:
+        conn.execute(stmt)
+    else:
+        with engine.begin() as c:
+            c.execute(stmt)
+
+
+def poll(now: Optional[datetime] = None) -> int:
+    """Apply events published by other workers since the last poll; returns how many were applied."""
+    global _last_id
+    table = CacheEvent.__table__
+    window = (now or datetime.utcnow()) - timedelta(seconds=BUS_LAG)
+    with engine.begin() as conn:
+        if _last_id is None:
+            # start from now: a fresh process has nothing stale to drop
+            _last_id = conn.execute(select(func.max(table.c.id))).scalar() or 0
+            _seen.update(conn.execute(select(table.c.id, table.c.created_at).where(table.c.created_at >= window)).all())
+            return 0
+        rows = conn.execute(select(table.c.id, table.c.topic, table.c.key, table.c.origin, table.c.created_at)
+                            .where(or_(table.c.id > _last_id, table.c.created_at >= window)).order_by(table.c.id)).all()
+    applied = 0
+    for event_id, topic, key, origin, created_at in rows:
+        if event_id in _seen:
+            continue
+        _seen[event_id] = created_at
+        if origin != ORIGIN:
+            _apply(topic, key)
+            applied += 1
+        _last_id = max(_last_id, event_id)
+    for event_id in [e for e, at in _seen.items() if at < window]:
+        del _seen[event_id]
+    return applied
+
+
+def prune(now: Optional[datetime] = None) -> int:
+    cutoff = (now or datetime.utcnow()) - timedelta(seconds=BUS_RETENTION)
+    table = CacheEvent.__table__
+    with engine.begin() as conn:
+        return conn.execute(delete(table).where(table.c.created_at < cutoff)).rowcount
+
+
+async def _loop():
+    while True:
+        try:
+            await asyncio.to_thread(poll)
+        except Exception:
+            log.exception("cache bus poll failed")
+        await asyncio.sleep(BUS_POLL)
+
+
+def start():
+    global _task
+    if CACHE_BUS == "db" and _task is None:
+        _task = asyncio.get_running_loop().create_task(_loop())
+
+
+async def stop():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
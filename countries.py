@@ -0,0 +1,112 @@
+"""Country -> currency registry.
+
+The restcountries list is downloaded once, folded into a case-insensitive dict
+keyed by common/official names, alternate spellings and ISO codes, and cached
+to a JSON snapshot. Lookups never hit the network once the registry is warm;
+stale snapshots are refreshed in a background thread.
+"""
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional
+
+from http_client import get_client
+
+COUNTRIES_URL = 'https://restcountries.com/v3.1/all?fields=name,currencies,cca2,cca3,altSpellings'
+COUNTRIES_SNAPSHOT = os.environ.get("COUNTRIES_SNAPSHOT") or "./countries_snapshot.json"
+# refresh the snapshot in the background once it is older than this (seconds)
+COUNTRIES_MAX_AGE = int(os.environ.get("COUNTRIES_MAX_AGE", str(7 * 24 * 3600)))
+
+
+def fetch_countries() -> list:
+    resp = get_client().get(COUNTRIES_URL, timeout=30)
+    resp.raise_for_status()
+    return resp.json()
+
+
+def build_index(items: Iterable[dict]) -> Dict[str, str]:
+    index = {}
+    for item in items:
+        currencies = item.get('currencies') or {}
+        if not currencies:
+            continue
+        currency = next(iter(currencies))
+        name = item.get('name') or {}
+        keys = [name.get('common'), name.get('official'), item.get('cca2'), item.get('cca3')]
+        keys.extend(item.get('altSpellings') or [])
+        for key in keys:
+            if key:
+                # first writer wins so a common name is never shadowed by another country's alias
+                index.setdefault(key.casefold(), currency)
+    return index
+
+
+class CountryRegistry:
+    def __init__(self, fetch: Callable[[], list] = fetch_countries, snapshot_path: Optional[str] = None,
+                 max_age: int = COUNTRIES_MAX_AGE):
+        self.fetch = fetch
+        self.snapshot_path = snapshot_path
+        self.max_age = max_age
+        self._index: Optional[Dict[str, str]] = None
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _load_snapshot(self) -> bool:
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with open(self.snapshot_path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        self._index = data.get("index") or {}
+        self._fetched_at = data.get("fetched_at", 0.0)
+        return True
+
+    def _save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        tmp = self.snapshot_path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"fetched_at": self._fetched_at, "index": self._index}, f)
+            os.replace(tmp, self.snapshot_path)
+        except OSError:
+            pass
+
+    def refresh(self):
+        index = build_index(self.fetch())
+        # swap the whole dict so readers never see a half-built index
+        self._index, self._fetched_at = index, time.time()
+        self._save_snapshot()
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception:
+            # keep serving the old index; the next stale lookup will retry
+            pass
+        finally:
+            self._refreshing = False
+
+    def refresh_async(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_in_background, daemon=True).start()
+
+    def ensure_loaded(self):
+        if self._index is not None:
+            return
+        with self._lock:
+            if self._index is None and not self._load_snapshot():
+                self.refresh()
+
+    def currency_for(self, country: str, default: str = 'USD') -> str:
+        self.ensure_loaded()
+        if time.time() - self._fetched_at > self.max_age:
+            self.refresh_async()
+        return self._index.get(country.strip().casefold(), default)
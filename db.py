@@ -1,11 +1,105 @@
-from sqlmodel import SQLModel, create_engine, Session
-import os
-
-DATABASE_URL = os.environ.get("DATABASE_URL") or "sqlite:///./expenses.db"
-engine = create_engine(DATABASE_URL, echo=False)
-
-def init_db():
-    SQLModel.metadata.create_all(engine)
-
-def get_session():
-    return Session(engine)
+from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
+import os
+
+import metrics
+
+DATABASE_URL = os.environ.get("DATABASE_URL") or "sqlite:///./expenses.db"
+# optional read replica for GET endpoints; defaults to the primary
+DATABASE_READ_URL = os.environ.get("DATABASE_READ_URL") or DATABASE_URL
+
+# pool settings for server databases (ignored for SQLite)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "1") == "1"
+
+# SQLite connection tuning, applied to every new connection
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.environ.get("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+
+def is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def engine_options(url: str) -> dict:
+    if is_sqlite(url):
+        # the busy timeout is also set by PRAGMA; this covers the driver's own lock wait
+        return {"connect_args": {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def _sqlite_pragmas(dbapi_conn, _record):
+    # WAL lets readers run alongside the single writer; NORMAL sync is durable under WAL
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cur.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cur.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cur.close()
+
+
+def make_engine(url: str):
+    eng = create_engine(url, echo=False, **engine_options(url))
+    if is_sqlite(url):
+        event.listen(eng, "connect", _sqlite_pragmas)
+    metrics.instrument_engine(eng)
+    return eng
+
+
+engine = make_engine(DATABASE_URL)
+read_engine = engine if DATABASE_READ_URL == DATABASE_URL else make_engine(DATABASE_READ_URL)
+
+# async drivers for the same database; override with ASYNC_DATABASE_URL
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg", "postgres": "postgresql+asyncpg"}
+
+def to_async_url(url: str) -> str:
+    scheme, sep, rest = url.partition("://")
+    driver = ASYNC_DRIVERS.get(scheme.split("+")[0])
+    return f"{driver}{sep}{rest}" if driver else url
+
+ASYNC_DATABASE_URL = os.environ.get("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+ASYNC_DATABASE_READ_URL = os.environ.get("ASYNC_DATABASE_READ_URL") or to_async_url(DATABASE_READ_URL)
+_async_engines = {}
+
+def get_async_engine(url: str = None):
+    # created on first use so sync-only tools never need the async driver installed
+    url = url or ASYNC_DATABASE_URL
+    if url not in _async_engines:
+        eng = create_async_engine(url, echo=False, **engine_options(url))
+        if is_sqlite(url):
+            event.listen(eng.sync_engine, "connect", _sqlite_pragmas)
+        metrics.instrument_engine(eng.sync_engine)
+        _async_engines[url] = eng
+    return _async_engines[url]
+
+def init_db(force: bool = False) -> bool:
+    """Bring the schema up to date; a no-op lookup when its stamp is current (see migrations.ensure_schema)."""
+    import models  # noqa: F401  registers the tables
+    from migrations import ensure_schema
+    return ensure_schema(engine, SQLModel.metadata, force)
+
+def get_session():
+    return Session(engine)
+
+def get_read_session():
+    return Session(read_engine)
+
+def get_async_session():
+    # attributes stay loaded after commit; lazy loads are not possible outside a greenlet
+    return AsyncSession(get_async_engine(), expire_on_commit=False)
+
+def get_async_read_session():
+    return AsyncSession(get_async_engine(ASYNC_DATABASE_READ_URL), expire_on_commit=False)
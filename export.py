@@ -0,0 +1,204 @@
+"""Incremental warehouse export.
+
+Streams Expense, ApprovalStep and ApprovalDecision out of the database in
+id-ordered chunks and writes column-typed Parquet (pyarrow) or gzipped CSV
+(fallback when pyarrow is not installed), partitioned Hive-style by company
+and expense month:
+
+    OUT/expense/company_id=1/month=2024-05/part-<run>.parquet
+
+A watermark per table (highest exported id, and the run's start time for
+tables with updated_at) is kept in OUT/_state.json, so each run only reads
+rows added or changed since the previous one. updated_at is set when a row is
+flushed, which can be well before its transaction commits (bulk and revalue
+chunks), so the change scan starts EXPORT_LAG seconds before the stored time
+and rows near the boundary are exported twice. Changed rows are written again
+into the current run's files; consumers keep the latest row per id.
+
+    python export.py OUT_DIR [--full] [--format parquet|csv] [--chunk N]
+"""
+import csv
+import gzip
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, func, select
+
+from db import get_read_session
+from models import ApprovalDecision, ApprovalStep, Expense
+from pagination import keyset_after
+
+EXPORT_CHUNK = int(os.environ.get("EXPORT_CHUNK", "5000"))
+# longest expected write transaction; rows changed this long before the last run are re-read
+EXPORT_LAG = float(os.environ.get("EXPORT_LAG", "300"))
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional; CSV is written instead
+    pa = pq = None
+
+# table name -> (model, columns to export); company_id and the expense date
+# come from Expense so every table can be partitioned the same way
+TABLES = {
+    "expense": (Expense, [Expense.id, Expense.company_id, Expense.date, Expense.submitter_id, Expense.amount,
+                          Expense.currency, Expense.amount_company_currency, Expense.category, Expense.description,
+                          Expense.status, Expense.updated_at, Expense.amount_minor, Expense.amount_company_minor,
+                          Expense.fx_rate, Expense.fx_as_of]),
+    "approvalstep": (ApprovalStep, [ApprovalStep.id, Expense.company_id, Expense.date, ApprovalStep.expense_id,
+                                    ApprovalStep.approver_id, ApprovalStep.sequence, ApprovalStep.completed,
+                                    ApprovalStep.updated_at]),
+    "approvaldecision": (ApprovalDecision, [ApprovalDecision.id, Expense.company_id, Expense.date,
+                                            ApprovalDecision.expense_id, ApprovalDecision.approver_id,
+                                            ApprovalDecision.approved, ApprovalDecision.comment]),
+}
+
+
+def _arrow_type(col):
+    t = col.type
+    if isinstance(t, Boolean):
+        return pa.bool_()
+    if isinstance(t, Integer):
+        return pa.int64()
+    if isinstance(t, Float):
+        return pa.float64()
+    if isinstance(t, DateTime):
+        return pa.timestamp("us")
+    if isinstance(t, Date):
+        return pa.date32()
+    return pa.string()
+
+
+class PartitionWriter:
+    """Lazily opens one output file per (company, month) partition for a run."""
+
+    def __init__(self, root: str, table: str, columns: list, fmt: str, run_id: str):
+        self.root, self.table, self.fmt, self.run_id = root, table, fmt, run_id
+        self.names = [c.key for c in columns]
+        self.schema = pa.schema([(c.key, _arrow_type(c)) for c in columns]) if fmt == "parquet" else None
+        self._open: Dict[Tuple[int, str], object] = {}
+        self.rows = 0
+
+    def _path(self, company_id, month) -> str:
+        d = os.path.join(self.root, self.table, f"company_id={company_id}", f"month={month or 'unknown'}")
+        os.makedirs(d, exist_ok=True)
+        ext = "parquet" if self.fmt == "parquet" else "csv.gz"
+        return os.path.join(d, f"part-{self.run_id}.{ext}")
+
+    def _writer(self, key):
+        w = self._open.get(key)
+        if w is None:
+            path = self._path(*key)
+            if self.fmt == "parquet":
+                w = pq.ParquetWriter(path, self.schema, compression="zstd")
+            else:
+                f = gzip.open(path, "wt", newline="")
+                w = (f, csv.writer(f))
+                w[1].writerow(self.names)
+            self._open[key] = w
+        return w
+
+    def write(self, rows: list):
+        groups: Dict[Tuple[int, str], list] = {}
+        for r in rows:
+            d = r[2]
+            groups.setdefault((r[1], d.strftime("%Y-%m") if d else None), []).append(r)
+        for key, part in groups.items():
+            w = self._writer(key)
+            if self.fmt == "parquet":
+                # exact decimals (fx_rate) go out as strings
+                cols = {n: [str(r[i]) if isinstance(r[i], Decimal) else r[i] for r in part] for i, n in enumerate(self.names)}
+                w.write_table(pa.Table.from_pydict(cols, schema=self.schema))
+            else:
+                w[1].writerows([[v.isoformat() if isinstance(v, (date, datetime)) else v for v in r] for r in part])
+        self.rows += len(rows)
+
+    def close(self):
+        for w in self._open.values():
+            if self.fmt == "parquet":
+                w.close()
+            else:
+                w[0].close()
+        self._open.clear()
+
+
+def _chunks(session, base, order_cols: list, chunk: int):
+    """Yield lists of rows from `base` in keyset order, `chunk` rows per query."""
+    after = None
+    while True:
+        q = base
+        if after is not None:
+            q = q.where(keyset_after(tuple(order_cols), after))
+        rows = session.execute(q.order_by(*order_cols).limit(chunk)).all()
+        if not rows:
+            return
+        yield rows
+        last = rows[-1]._mapping
+        after = [last[c] for c in order_cols]
+
+
+def export_table(session, name: str, writer: PartitionWriter, state: dict, full: bool, chunk: int,
+                 lag: float = EXPORT_LAG) -> dict:
+    model, columns = TABLES[name]
+    tracked = hasattr(model, "updated_at")
+    prev = {} if full else state.get(name, {})
+    hw_id = prev.get("id", 0)
+    hw_ts = datetime.fromisoformat(prev["ts"]) if prev.get("ts") else None
+    # snapshot the bounds up front so rows landing mid-run are picked up next run
+    new_hw_id = session.execute(select(func.max(model.id))).scalar() or hw_id
+    new_ts = datetime.utcnow()
+    base = select(*columns).join_from(model, Expense, Expense.id == model.expense_id) if model is not Expense else select(*columns)
+
+    added = base.where(model.id > hw_id).where(model.id <= new_hw_id)
+    for rows in _chunks(session, added, [model.id], chunk):
+        writer.write(rows)
+    if tracked and hw_ts is not None:
+        since = hw_ts - timedelta(seconds=lag)
+        changed = base.where(model.id <= hw_id).where(model.updated_at > since).where(model.updated_at <= new_ts)
+        for rows in _chunks(session, changed, [model.updated_at, model.id], chunk):
+            writer.write(rows)
+    return {"id": new_hw_id, "ts": new_ts.isoformat() if tracked else None}
+
+
+def run(out_dir: str, full: bool = False, fmt: Optional[str] = None, chunk: int = EXPORT_CHUNK, lag: float = EXPORT_LAG) -> dict:
+    """Export every table; returns {table: rows written}. The watermark only advances on success."""
+    fmt = fmt or ("parquet" if pa else "csv")
+    if fmt == "parquet" and pa is None:
+        raise RuntimeError("parquet export needs pyarrow; pip install pyarrow or use --format csv")
+    os.makedirs(out_dir, exist_ok=True)
+    state_path = os.path.join(out_dir, "_state.json")
+    state = {}
+    if os.path.exists(state_path) and not full:
+        with open(state_path) as f:
+            state = json.load(f)
+    run_id = time.strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:8]
+    counts, new_state = {}, dict(state)
+    with get_read_session() as s:
+        for name, (_, columns) in TABLES.items():
+            writer = PartitionWriter(out_dir, name, columns, fmt, run_id)
+            try:
+                new_state[name] = export_table(s, name, writer, state, full, chunk, lag)
+            finally:
+                writer.close()
+            counts[name] = writer.rows
+    tmp = state_path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(new_state, f)
+    os.replace(tmp, state_path)
+    return counts
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if not args or args[0].startswith("-"):
+        sys.exit(__doc__)
+    fmt = args[args.index("--format") + 1] if "--format" in args else None
+    chunk = int(args[args.index("--chunk") + 1]) if "--chunk" in args else EXPORT_CHUNK
+    for table, n in run(args[0], full="--full" in args, fmt=fmt, chunk=chunk).items():
+        print(f"{table}: {n} rows")
@@ -0,0 +1,39 @@
+"""Production launcher: `gunicorn -c gunicorn.conf.py main:app`.
+
+One uvicorn worker per core by default (WEB_CONCURRENCY overrides). bcrypt
+and OCR already run in their own process pools, so more workers than cores
+only adds contention. The app is not preloaded: engines, pools and caches are
+created per worker after the fork. Workers share cache invalidations through
+the database (CACHE_BUS=db) and elect one scheduler leader. The schema and
+sample data are set up once, before the first fork (`on_starting`).
+
+/metrics is per worker: each scrape is answered by whichever worker takes
+the connection, and every series carries a `worker` label (the pid) so
+counters from different workers are not read as resets.
+"""
+import multiprocessing
+import os
+import subprocess
+import sys
+
+os.environ.setdefault("CACHE_BUS", "db")
+os.environ.setdefault("METRICS_WORKER_LABEL", "1")
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# async workers: a stuck request is bounded by HTTP_TIMEOUT and the DB pool timeout, not by killing the worker
+timeout = int(os.environ.get("WORKER_TIMEOUT", "60"))
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.environ.get("KEEPALIVE", "5"))
+# recycle workers periodically to bound slow leaks; jitter keeps them from restarting together
+max_requests = int(os.environ.get("MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.environ.get("MAX_REQUESTS_JITTER", "1000"))
+preload_app = False
+accesslog = os.environ.get("ACCESS_LOG", "-")
+
+
+def on_starting(server):
+    # workers racing create_all and the migrations on an empty database fail on tables that
+    # already exist; a child process keeps engines and metrics out of the master before the fork
+    subprocess.run([sys.executable, "-c", "import main; main.init_db(); main.seed_default()"], check=True)
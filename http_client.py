@@ -0,0 +1,56 @@
+"""Shared outbound HTTP clients.
+
+One pooled httpx client per process for sync callers (background refreshes)
+and one for async handlers, both with explicit timeouts so a slow upstream
+cannot hold a worker indefinitely. Every call is timed into the outbound
+latency histogram served at /metrics. httpx itself is imported on first use,
+so processes that never call out (mocked rates, no webhooks) do not load it.
+"""
+import os
+from typing import TYPE_CHECKING, Optional
+
+import metrics
+
+if TYPE_CHECKING:
+    import httpx
+
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "10"))
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "20"))
+
+_client: Optional["httpx.Client"] = None
+_async_client: Optional["httpx.AsyncClient"] = None
+
+
+def _options(asynchronous: bool = False) -> dict:
+    import httpx
+    return {
+        "event_hooks": metrics.httpx_hooks(asynchronous),
+        "timeout": httpx.Timeout(HTTP_TIMEOUT, connect=min(HTTP_TIMEOUT, 5.0)),
+        "limits": httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS),
+    }
+
+
+def get_client() -> "httpx.Client":
+    global _client
+    if _client is None:
+        import httpx
+        _client = httpx.Client(**_options())
+    return _client
+
+
+def get_async_client() -> "httpx.AsyncClient":
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        import httpx
+        _async_client = httpx.AsyncClient(**_options(asynchronous=True))
+    return _async_client
+
+
+async def aclose():
+    global _client, _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    if _client is not None:
+        _client.close()
+        _client = None
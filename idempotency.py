@@ -0,0 +1,153 @@
+"""Idempotency-Key support for writes.
+
+A client retrying a POST (or PUT/PATCH/DELETE) sends the same
+`Idempotency-Key` header; the first request's status and body are stored
+and replayed for every retry, so a retried expense submission or approval
+decision never inserts twice. Keys are scoped to the caller (token subject)
+and bound to the request body: reusing a key for a different request is a
+422, and a retry that arrives while the original is still running is a 409.
+Server errors and the retryable statuses (409 conflicts, 429 and the like)
+are not stored, so a retry with the same key runs again. Keys expire after
+IDEMPOTENCY_TTL seconds. A key still in progress is only held for
+IDEMPOTENCY_LEASE seconds, so one left behind by a worker that died can be
+claimed again by a retry.
+"""
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from db import engine, get_async_engine
+from models import IdempotencyKey
+
+HEADER = b"idempotency-key"
+IDEMPOTENCY_TTL = float(os.environ.get("IDEMPOTENCY_TTL", str(24 * 3600)))
+# longer than any request can run (HTTP_TIMEOUT, DB_POOL_TIMEOUT, WORKER_TIMEOUT)
+IDEMPOTENCY_LEASE = float(os.environ.get("IDEMPOTENCY_LEASE", "120"))
+# responses larger than this are passed through but not stored
+IDEMPOTENCY_MAX_BODY = int(os.environ.get("IDEMPOTENCY_MAX_BODY", str(256 * 1024)))
+METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+# answers that tell the client to try again; replaying them would make that retry fail forever
+RETRYABLE = {408, 409, 425, 429}
+
+
+def _caller(headers: dict) -> str:
+    auth = headers.get(b"authorization", b"").decode()
+    if auth.lower().startswith("bearer "):
+        from auth import decode_token
+        payload = decode_token(auth[7:])
+        if payload and payload.get("user_id") is not None:
+            return f"user:{payload['user_id']}"
+    return "anon"
+
+
+async def _send_json(send, status: int, body: dict):
+    raw = json.dumps(body).encode()
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(raw)).encode())]})
+    await send({"type": "http.response.body", "body": raw})
+
+
+async def _send_stored(send, status: int, content_type: Optional[str], raw: bytes):
+    headers = [(b"content-length", str(len(raw)).encode()), (b"idempotent-replayed", b"true")]
+    if content_type:
+        headers.append((b"content-type", content_type.encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": raw})
+
+
+async def _lookup(scoped_key: str, now: datetime):
+    table = IdempotencyKey.__table__
+    async with get_async_engine().begin() as conn:
+        row = (await conn.execute(select(table).where(table.c.key == scoped_key))).first()
+        if row is not None and row.expires_at < now:
+            await conn.execute(delete(table).where(table.c.key == scoped_key))
+            row = None
+    return row
+
+
+class IdempotencyMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in METHODS:
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        key = headers.get(HEADER)
+        if not key:
+            return await self.app(scope, receive, send)
+
+        # read the body once to fingerprint it, then replay it to the app
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        body = b"".join(chunks)
+        fingerprint = hashlib.sha256(b"\n".join([scope["method"].encode(), scope["path"].encode(), body])).hexdigest()
+        scoped_key = f"{_caller(headers)}:{key.decode()[:200]}"
+        table = IdempotencyKey.__table__
+        now = datetime.utcnow()
+
+        row = await _lookup(scoped_key, now)
+        if row is None:
+            try:
+                async with get_async_engine().begin() as conn:
+                    await conn.execute(insert(table).values(key=scoped_key, fingerprint=fingerprint, created_at=now,
+                                                            expires_at=now + timedelta(seconds=IDEMPOTENCY_LEASE)))
+            except IntegrityError:
+                # a concurrent retry claimed the key first
+                row = await _lookup(scoped_key, now)
+        if row is not None:
+            if row.fingerprint != fingerprint:
+                return await _send_json(send, 422, {"detail": "Idempotency-Key was used for a different request"})
+            if row.status_code is None:
+                return await _send_json(send, 409, {"detail": "a request with this Idempotency-Key is in progress"})
+            return await _send_stored(send, row.status_code, row.content_type, row.response_body or b"")
+
+        sent_body = False
+
+        async def replay():
+            nonlocal sent_body
+            if not sent_body:
+                sent_body = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        status, content_type, out = [500], [None], []
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                content_type[0] = dict(message.get("headers", [])).get(b"content-type")
+            elif message["type"] == "http.response.body":
+                out.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, replay, capture)
+        finally:
+            raw = b"".join(out)
+            # only our own claim: past its lease a retry may have taken the key over
+            ours = (table.c.key == scoped_key) & (table.c.created_at == now)
+            async with get_async_engine().begin() as conn:
+                if status[0] >= 500 or status[0] in RETRYABLE or len(raw) > IDEMPOTENCY_MAX_BODY:
+                    # not replayable: free the key so the client can retry
+                    await conn.execute(delete(table).where(ours))
+                else:
+                    await conn.execute(update(table).where(ours).values(
+                        status_code=status[0], content_type=content_type[0].decode() if content_type[0] else None,
+                        response_body=raw, expires_at=datetime.utcnow() + timedelta(seconds=IDEMPOTENCY_TTL)))
+
+
+def prune(now: Optional[datetime] = None) -> int:
+    """Delete expired keys; run by the scheduler."""
+    table = IdempotencyKey.__table__
+    with engine.begin() as conn:
+        return conn.execute(delete(table).where(table.c.expires_at < (now or datetime.utcnow()))).rowcount
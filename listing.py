@@ -0,0 +1,98 @@
+"""Expense listing queries.
+
+Filters and projection are pushed into SQL and rows come back as plain
+column tuples rather than ORM objects. Pages are keyset-paginated on
+(date, id), newest first; exports iterate the DB cursor in `yield_per`
+batches so memory stays flat regardless of history size.
+"""
+import csv
+import io
+import json
+from datetime import date
+from decimal import Decimal
+from typing import Iterator, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+from sqlmodel import select
+
+from db import get_read_session
+from models import Expense
+from pagination import cursor_values
+
+EXPORT_BATCH = 1000
+# every scalar column of Expense may be requested with ?fields=
+EXPENSE_FIELDS = [c.name for c in Expense.__table__.columns]
+
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    if not fields:
+        return list(EXPENSE_FIELDS)
+    wanted = [f.strip() for f in fields.split(',') if f.strip()]
+    unknown = [f for f in wanted if f not in EXPENSE_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"unknown fields: {', '.join(unknown)}")
+    return wanted
+
+
+def expense_query(user_id: int, fields: List[str], status: Optional[str] = None, category: Optional[str] = None,
+                  date_from: Optional[date] = None, date_to: Optional[date] = None):
+    # id and date are always selected: they form the cursor
+    columns = list(dict.fromkeys(["id", "date"] + fields))
+    q = select(*[getattr(Expense, c) for c in columns]).where(Expense.submitter_id == user_id)
+    if status is not None:
+        q = q.where(Expense.status == status)
+    if category is not None:
+        q = q.where(Expense.category == category)
+    if date_from is not None:
+        q = q.where(Expense.date >= date_from)
+    if date_to is not None:
+        q = q.where(Expense.date <= date_to)
+    return q.order_by(Expense.date.desc().nullslast(), Expense.id.desc()), columns
+
+
+def after_cursor(q, cursor: list):
+    """Rows after (date, id) in newest-first order; undated rows sort last."""
+    d, last_id = cursor_values((Expense.date, Expense.id), cursor)
+    if last_id is None:
+        raise HTTPException(status_code=400, detail='invalid cursor')
+    if d is None:
+        return q.where(and_(Expense.date.is_(None), Expense.id < last_id))
+    return q.where(or_(Expense.date < d, and_(Expense.date == d, Expense.id < last_id), Expense.date.is_(None)))
+
+
+def row_dict(row, columns: List[str], fields: List[str]) -> dict:
+    values = dict(zip(columns, row))
+    # exact decimals (fx_rate) stay exact as strings
+    return {f: str(values[f]) if isinstance(values[f], Decimal) else values[f] for f in fields}
+
+
+def iter_rows(q) -> Iterator[tuple]:
+    with get_read_session() as s:
+        # stream_results keeps server-side cursors on Postgres; yield_per bounds the ORM buffer
+        result = s.exec(q.execution_options(stream_results=True, yield_per=EXPORT_BATCH))
+        for row in result:
+            yield row
+
+
+def _jsonable(v):
+    return v.isoformat() if isinstance(v, date) else v
+
+
+def ndjson_lines(q, columns: List[str], fields: List[str]) -> Iterator[str]:
+    for row in iter_rows(q):
+        yield json.dumps({k: _jsonable(v) for k, v in row_dict(row, columns, fields).items()}) + "\n"
+
+
+def csv_lines(q, columns: List[str], fields: List[str]) -> Iterator[str]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(fields)
+    for i, row in enumerate(iter_rows(q), start=1):
+        values = row_dict(row, columns, fields)
+        writer.writerow([_jsonable(values[f]) for f in fields])
+        if i % EXPORT_BATCH == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
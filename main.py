@@ -1,322 +1,557 @@
-import os
-from fastapi import FastAPI, HTTPException, Body, Depends
-from typing import List, Optional
-from sqlmodel import select
-from db import init_db, get_session
-from models import Company, User, Expense, ApprovalStep, ApprovalDecision, ApprovalRule
-from auth import create_access_token, get_password_hash, verify_password, get_current_user
-from fastapi.security import OAuth2PasswordRequestForm
-from datetime import date
-import requests
-from fastapi import UploadFile, File
-
-app = FastAPI()
-
-
-@app.get("/")
-def root():
-    """Health endpoint - returns a small status JSON and link to API docs."""
-    return {"status": "ok", "service": "expense-app", "docs": "/docs"}
-
-USE_EXTERNAL = os.environ.get("USE_EXTERNAL") == "1"
-
-# Helpers for country/currency and exchange rates. Mocked when USE_EXTERNAL is False.
-def get_currency_for_country(country_name: str) -> str:
-    if not USE_EXTERNAL:
-        # simple mock: if name contains 'United' -> USD, if 'India' -> INR else EUR
-        if 'India' in country_name:
-            return 'INR'
-        if 'United' in country_name:
-            return 'USD'
-        return 'EUR'
-    resp = requests.get('https://restcountries.com/v3.1/all?fields=name,currencies')
-    resp.raise_for_status()
-    data = resp.json()
-    for item in data:
-        name = item.get('name', {}).get('common')
-        if not name:
-            continue
-        if name.lower() == country_name.lower():
-            currencies = item.get('currencies', {})
-            if currencies:
-                return list(currencies.keys())[0]
-    # fallback
-    return 'USD'
-
-def get_exchange_rates(base: str) -> dict:
-    if not USE_EXTERNAL:
-        # mock rates
-        return {base: 1.0, 'USD': 1.0, 'EUR': 0.9, 'INR': 82.0}
-    url = f'https://api.exchangerate-api.com/v4/latest/{base}'
-    resp = requests.get(url)
-    resp.raise_for_status()
-    return resp.json().get('rates', {})
-
-@app.on_event("startup")
-def on_startup():
-    init_db()
-
-
-@app.on_event("startup")
-def seed_default():
-    """If no company exists, create a sample company and an admin with password 'admin'.
-    This makes it easy to run the app and have an admin user ready: email=admin@sample, password=admin
-    """
-    from sqlmodel import select
-    from models import Company, User, ApprovalRule
-    with get_session() as s:
-        any_company = s.exec(select(Company)).first()
-        if not any_company:
-            company = Company(name="SampleCo", country="India", currency=get_currency_for_country("India"))
-            s.add(company)
-            s.commit()
-            s.refresh(company)
-            admin = User(name="Administrator", email="admin@sample", role="admin", company_id=company.id, password_hash=get_password_hash('admin'))
-            s.add(admin)
-            s.commit()
-            # default approval rule
-            rule = ApprovalRule(company_id=company.id, percentage_threshold=50, special_approver_ids='')
-            s.add(rule)
-            s.commit()
-
-
-@app.get('/')
-def root():
-    return {"status": "ok", "message": "Expense app running", "sample_admin": {"email": "admin@sample", "password": "admin"}}
-
-# ensure tables exist when importing the module for tests
-init_db()
-
-@app.post('/signup')
-def signup(company_name: str = Body(...), country: str = Body(...), admin_name: str = Body(...), admin_email: str = Body(...)):
-    currency = get_currency_for_country(country)
-    with get_session() as s:
-        company = Company(name=company_name, country=country, currency=currency)
-        s.add(company)
-        s.commit()
-        s.refresh(company)
-        # default admin password = 'admin' in prototype (hashed)
-        admin = User(name=admin_name, email=admin_email, role='admin', company_id=company.id, password_hash=get_password_hash('admin'))
-        s.add(admin)
-        s.commit()
-        s.refresh(admin)
-        # default approval rule: 50% threshold
-        rule = ApprovalRule(company_id=company.id, percentage_threshold=50, special_approver_ids='')
-        s.add(rule)
-        s.commit()
-        # capture ids to return after session closes
-        company_id = company.id
-        admin_id = admin.id
-    return {"company_id": company_id, "admin_id": admin_id, "currency": currency}
-
-@app.post('/users')
-def create_user(name: str = Body(...), email: str = Body(...), role: str = Body('employee'), company_id: int = Body(...), manager_id: Optional[int] = Body(None), password: Optional[str] = Body(None), current=Depends(get_current_user)):
-    # require admin role to create users
-    if not current or current.get('role') != 'admin':
-        raise HTTPException(status_code=403, detail='admin role required')
-    with get_session() as s:
-        # if a user with this email already exists, update it instead of creating duplicate
-        existing = s.exec(select(User).where(User.email == email)).first()
-        if existing:
-            existing.name = name
-            existing.role = role
-            existing.company_id = company_id
-            existing.manager_id = manager_id
-            if password:
-                existing.password_hash = get_password_hash(password)
-            s.add(existing)
-            s.commit()
-            s.refresh(existing)
-            return existing
-
-        pwd_hash = None
-        if password:
-            pwd_hash = get_password_hash(password)
-        user = User(name=name, email=email, role=role, company_id=company_id, manager_id=manager_id, password_hash=pwd_hash)
-        s.add(user)
-        s.commit()
-        s.refresh(user)
-        return user
-
-
-@app.post('/token')
-def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    with get_session() as s:
-        user = s.exec(select(User).where(User.email == form_data.username)).first()
-        if not user or not user.password_hash:
-            raise HTTPException(status_code=400, detail='Incorrect username or password')
-        if not verify_password(form_data.password, user.password_hash):
-            raise HTTPException(status_code=400, detail='Incorrect username or password')
-        token = create_access_token({"sub": user.email, "user_id": user.id, "role": user.role})
-        return {"access_token": token, "token_type": "bearer"}
-
-@app.post('/expenses')
-def submit_expense(submitter_id: int = Body(...), amount: float = Body(...), currency: str = Body(...), category: Optional[str] = Body(None), description: Optional[str] = Body(None), date_: Optional[str] = Body(None), approver_ids: Optional[List[int]] = Body(None), current=Depends(get_current_user)):
-    if date_:
-        d = date.fromisoformat(date_)
-    else:
-        d = date.today()
-    with get_session() as s:
-        submitter = s.get(User, submitter_id)
-        if not submitter:
-            raise HTTPException(status_code=404, detail='submitter not found')
-        company = s.get(Company, submitter.company_id)
-        if not company:
-            raise HTTPException(status_code=404, detail='company not found')
-        rates = get_exchange_rates(currency)
-        company_rates = get_exchange_rates(company.currency)
-        # naive conversion: convert amount -> USD -> company currency via rates dict
-        # if rates missing, fallback 1:1
-        try:
-            rate_to_base = rates.get(company.currency) or 1.0
-        except Exception:
-            rate_to_base = 1.0
-        # better approach: get rates with base currency provided by external API; here we just mock
-        amount_company = amount
-        if currency != company.currency:
-            # If we have rates mapping with company.currency key, use it
-            rates_for_currency = get_exchange_rates(currency)
-            comp_rate = rates_for_currency.get(company.currency)
-            if comp_rate:
-                amount_company = amount * comp_rate
-        expense = Expense(submitter_id=submitter_id, company_id=company.id, amount=amount, currency=currency, amount_company_currency=amount_company, category=category, description=description, date=d)
-        s.add(expense)
-        s.commit()
-        s.refresh(expense)
-        # determine approval steps: if approver_ids provided, use them, else default to manager chain
-        steps = []
-        if approver_ids:
-            seq = 1
-            for aid in approver_ids:
-                step = ApprovalStep(expense_id=expense.id, approver_id=aid, sequence=seq)
-                s.add(step)
-                seq += 1
-        else:
-            # default: manager -> company admin(s)
-            seq = 1
-            if submitter.manager_id:
-                step = ApprovalStep(expense_id=expense.id, approver_id=submitter.manager_id, sequence=seq)
-                s.add(step)
-                seq += 1
-            # add all admins in company
-            admins = s.exec(select(User).where(User.company_id == company.id).where(User.role == 'admin')).all()
-            for a in admins:
-                step = ApprovalStep(expense_id=expense.id, approver_id=a.id, sequence=seq)
-                s.add(step)
-                seq += 1
-        s.commit()
-        # capture fields while attached to session
-        result = {
-            "id": expense.id,
-            "submitter_id": expense.submitter_id,
-            "company_id": expense.company_id,
-            "amount": expense.amount,
-            "currency": expense.currency,
-            "amount_company_currency": expense.amount_company_currency,
-            "category": expense.category,
-            "description": expense.description,
-            "date": expense.date.isoformat() if expense.date else None,
-            "status": expense.status,
-        }
-    # return the captured result
-    return result
-
-@app.get('/expenses/user/{user_id}')
-def list_user_expenses(user_id: int):
-    with get_session() as s:
-        expenses = s.exec(select(Expense).where(Expense.submitter_id == user_id)).all()
-    return expenses
-
-@app.get('/approvals/user/{user_id}/pending')
-def pending_for_user(user_id: int):
-    with get_session() as s:
-        # find approval steps assigned to user and not completed where expense still pending
-        rows = s.exec(select(ApprovalStep).where(ApprovalStep.approver_id == user_id).where(ApprovalStep.completed == False)).all()
-        pending = []
-        for r in rows:
-            exp = s.get(Expense, r.expense_id)
-            if exp and exp.status == 'pending':
-                pending.append({"expense": exp, "step_id": r.id, "sequence": r.sequence})
-    return pending
-
-@app.post('/approvals/{expense_id}/decision')
-def make_decision(expense_id: int, approver_id: int = Body(...), approved: bool = Body(...), comment: Optional[str] = Body(None), current=Depends(get_current_user)):
-    with get_session() as s:
-        expense = s.get(Expense, expense_id)
-        if not expense:
-            raise HTTPException(status_code=404, detail='expense not found')
-        # require that the caller is either the approver themselves or an admin
-        if not current:
-            raise HTTPException(status_code=401, detail='authentication required')
-        if current.get('role') != 'admin' and current.get('user_id') != approver_id:
-            raise HTTPException(status_code=403, detail='only the approver or admin can make decisions')
-
-        # find current active step for this approver
-        step = s.exec(select(ApprovalStep).where(ApprovalStep.expense_id == expense_id).where(ApprovalStep.approver_id == approver_id).where(ApprovalStep.completed == False)).first()
-        if not step:
-            raise HTTPException(status_code=400, detail='no pending approval step for this approver')
-        # record decision
-        dec = ApprovalDecision(expense_id=expense_id, approver_id=approver_id, approved=approved, comment=comment)
-        s.add(dec)
-        # mark step complete
-        step.completed = True
-        s.add(step)
-        s.commit()
-        # evaluate rules for company
-        rule = s.exec(select(ApprovalRule).where(ApprovalRule.company_id == expense.company_id)).first()
-        # gather decisions for expense
-        decisions = s.exec(select(ApprovalDecision).where(ApprovalDecision.expense_id == expense_id)).all()
-        # check special approver
-        special_ok = False
-        if rule and rule.special_approver_ids:
-            ids = [int(x) for x in rule.special_approver_ids.split(',') if x.strip()]
-            for d in decisions:
-                if d.approved and d.approver_id in ids:
-                    special_ok = True
-        if special_ok:
-            expense.status = 'approved'
-            s.add(expense); s.commit()
-            return {"status": "approved", "reason": "special approver approved"}
-        # percentage rule
-        if rule and rule.percentage_threshold:
-            # count total approvers for this expense
-            total = s.exec(select(ApprovalStep).where(ApprovalStep.expense_id == expense_id)).all()
-            total_count = len(total)
-            approve_count = len([d for d in decisions if d.approved])
-            pct = (approve_count / total_count * 100) if total_count else 0
-            if pct >= rule.percentage_threshold:
-                expense.status = 'approved'
-                s.add(expense); s.commit()
-                return {"status": "approved", "reason": f"{pct}% approvals >= {rule.percentage_threshold}%"}
-        # else, if any pending steps remain in sequence, move on; if none -> rejected
-        pending_steps = s.exec(select(ApprovalStep).where(ApprovalStep.expense_id == expense_id).where(ApprovalStep.completed == False)).all()
-        if not pending_steps:
-            # if any decision was rejection, mark rejected, else approved
-            if any(not d.approved for d in decisions):
-                expense.status = 'rejected'
-            else:
-                expense.status = 'approved'
-            s.add(expense); s.commit()
-            return {"status": expense.status, "reason": "finalized"}
-        else:
-            # still pending
-            s.commit()
-            return {"status": "pending", "reason": "moved to next approver"}
-
-
-@app.post('/ocr/receipt')
-def ocr_receipt(file: UploadFile = File(...)):
-    """
-    OCR stub: accepts a receipt image and returns a mocked parsed expense.
-    To enable real OCR, install Tesseract and pytesseract and replace the body with actual parsing.
-    """
-    # For prototype return a mocked parsed result
-    return {
-        "amount": 42.50,
-        "currency": "USD",
-        "date": date.today().isoformat(),
-        "description": "Mocked OCR parsed receipt",
-        "lines": [
-            {"label": "Lunch", "amount": 42.50}
-        ]
-    }
+import math
+import os
+import time
+# startup phases in /metrics (app_startup_seconds) are measured from here
+_import_started = time.perf_counter()
+from fastapi import FastAPI, HTTPException, Body, Depends, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from typing import List, Optional
+from sqlmodel import select
+from sqlalchemy import exists, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.orm import aliased
+from db import init_db, get_session, get_async_session, get_async_read_session, get_read_session
+from models import Company, User, Expense, ApprovalStep, ApprovalDecision, ApprovalRule, ReceiptJob
+from approvals import CompiledRule, evaluate, get_rule, invalidate_rule, record_decision, set_rule, simulate
+from auth import create_access_token, get_password_hash, get_current_user
+from bulk import BULK_MAX_ROWS, parse_rows, submit_batch
+from listing import after_cursor, csv_lines, expense_query, ndjson_lines, parse_fields, row_dict
+from countries import CountryRegistry, COUNTRIES_SNAPSHOT
+import passwords
+import receipts
+from passwords import PasswordBusy, averify_password
+from pagination import MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, cursor_values, decode_cursor, encode_cursor, keyset_after
+from principals import aget_company, aget_user, invalidate_company, invalidate_user
+from reports import apply_deltas, company_report, expense_deltas, status_deltas
+from search import search_expenses
+from idempotency import IdempotencyMiddleware
+from rates import RateProvider, RATES_SNAPSHOT, afetch_rates, amock_rates, fetch_rates, mock_rates
+import bus
+import http_client
+import metrics
+import money
+import orgchart
+import scheduler
+from fastapi.security import OAuth2PasswordRequestForm
+from datetime import date
+import threading
+from fastapi import UploadFile, File, Form
+
+app = FastAPI()
+metrics.boot_started(_import_started)
+# metrics is added last so it is outermost and also times replayed responses
+app.add_middleware(IdempotencyMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+
+
+@app.get("/")
+def root():
+    """Health endpoint - returns a small status JSON and link to API docs."""
+    return {"status": "ok", "service": "expense-app", "docs": "/docs"}
+
+USE_EXTERNAL = os.environ.get("USE_EXTERNAL") == "1"
+
+# Helpers for country/currency and exchange rates. Mocked when USE_EXTERNAL is False.
+country_registry = CountryRegistry(snapshot_path=COUNTRIES_SNAPSHOT)
+
+def get_currency_for_country(country_name: str) -> str:
+    if not USE_EXTERNAL:
+        # simple mock: if name contains 'United' -> USD, if 'India' -> INR else EUR
+        if 'India' in country_name:
+            return 'INR'
+        if 'United' in country_name:
+            return 'USD'
+        return 'EUR'
+    return country_registry.currency_for(country_name)
+
+# one provider per process; only the real API is worth snapshotting to disk
+rate_provider = RateProvider(fetch=fetch_rates if USE_EXTERNAL else mock_rates,
+                             afetch=afetch_rates if USE_EXTERNAL else amock_rates,
+                             snapshot_path=RATES_SNAPSHOT if USE_EXTERNAL else None)
+
+def get_exchange_rates(base: str) -> dict:
+    return rate_provider.table(base)
+
+# per-process caches, kept consistent across workers by the invalidation bus
+bus.subscribe("user", lambda key: invalidate_user(int(key)))
+bus.subscribe("company", lambda key: invalidate_company(int(key)))
+bus.subscribe("org", lambda key: orgchart.invalidate_company(int(key)))
+bus.subscribe("rule", lambda key: invalidate_rule(int(key) if key else None))
+# rate tables are not on the bus: nothing here writes them, each worker refetches after RATES_TTL
+
+@app.on_event("startup")
+def on_startup():
+    init_db()
+    seed_default()
+    if USE_EXTERNAL:
+        # warm the country index off the request path
+        threading.Thread(target=country_registry.ensure_loaded, daemon=True).start()
+    receipts.resume_pending()
+
+
+# background escalation, reminders and rule settlement; one leader across workers
+job_scheduler = scheduler.Scheduler()
+
+
+@app.on_event("startup")
+async def start_scheduler():
+    bus.start()
+    if scheduler.SCHEDULER_ENABLED:
+        job_scheduler.start()
+    # last startup hook: the app is ready to serve
+    metrics.boot_phase("ready")
+
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    await job_scheduler.stop()
+    await bus.stop()
+    await http_client.aclose()
+    passwords.shutdown()
+    receipts.shutdown()
+
+
+@app.exception_handler(PasswordBusy)
+async def password_busy(request: Request, exc: PasswordBusy):
+    return JSONResponse(status_code=503, content={"detail": "server busy, retry shortly"}, headers={"Retry-After": "1"})
+
+
+# bcrypt of 'admin' at the default cost, so an empty database seeds without hashing on the boot path;
+# the hash is upgraded on first login if BCRYPT_ROUNDS differs
+SAMPLE_ADMIN_HASH = "$2b$12$1RQYB7eMifzSjS7FQ9gZYeiykz.NdlC8MeppzxEwWewbmhMgY3IH."
+
+
+def seed_default():
+    """If no company exists, create a sample company and an admin with password 'admin'.
+    This makes it easy to run the app and have an admin user ready: email=admin@sample, password=admin
+    Safe to race: when another process seeds first, this one's insert fails on the admin's email and is rolled back.
+    """
+    with get_session() as s:
+        if s.exec(select(Company.id).limit(1)).first() is not None:
+            return
+        # India's currency directly: with USE_EXTERNAL a lookup here would download the country list at boot
+        company = Company(name="SampleCo", country="India", currency="INR")
+        s.add(company)
+        s.flush()
+        s.add(User(name="Administrator", email="admin@sample", role="admin", company_id=company.id, password_hash=SAMPLE_ADMIN_HASH))
+        # default approval rule
+        s.add(ApprovalRule(company_id=company.id, percentage_threshold=50, special_approver_ids=''))
+        try:
+            s.commit()
+        except IntegrityError:
+            s.rollback()
+
+
+@app.get('/')
+def root():
+    return {"status": "ok", "message": "Expense app running", "sample_admin": {"email": "admin@sample", "password": "admin"}}
+
+@app.get('/metrics', include_in_schema=False)
+def prometheus_metrics():
+    """Prometheus scrape endpoint: route latency, queries per request, DB and outbound HTTP time."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.post('/signup')
+def signup(company_name: str = Body(...), country: str = Body(...), admin_name: str = Body(...), admin_email: str = Body(...)):
+    currency = get_currency_for_country(country)
+    with get_session() as s:
+        if s.exec(select(User).where(User.email == admin_email)).first():
+            raise HTTPException(status_code=400, detail='email already registered')
+        company = Company(name=company_name, country=country, currency=currency)
+        s.add(company)
+        s.commit()
+        s.refresh(company)
+        # default admin password = 'admin' in prototype (hashed)
+        admin = User(name=admin_name, email=admin_email, role='admin', company_id=company.id, password_hash=get_password_hash('admin'))
+        s.add(admin)
+        s.commit()
+        s.refresh(admin)
+        # default approval rule: 50% threshold
+        rule = ApprovalRule(company_id=company.id, percentage_threshold=50, special_approver_ids='')
+        s.add(rule)
+        s.commit()
+        # capture ids to return after session closes
+        company_id = company.id
+        admin_id = admin.id
+    return {"company_id": company_id, "admin_id": admin_id, "currency": currency}
+
+@app.post('/users')
+def create_user(name: str = Body(...), email: str = Body(...), role: str = Body('employee'), company_id: int = Body(...), manager_id: Optional[int] = Body(None), password: Optional[str] = Body(None), current=Depends(get_current_user)):
+    # require admin role to create users
+    if not current or current.get('role') != 'admin':
+        raise HTTPException(status_code=403, detail='admin role required')
+    with get_session() as s:
+        # if a user with this email already exists, update it instead of creating duplicate
+        existing = s.exec(select(User).where(User.email == email)).first()
+        if existing:
+            old_company_id = existing.company_id
+            existing.name = name
+            existing.role = role
+            existing.company_id = company_id
+            existing.manager_id = manager_id
+            if password:
+                existing.password_hash = get_password_hash(password)
+            s.add(existing)
+            s.commit()
+            s.refresh(existing)
+            bus.publish("user", existing.id)
+            # reporting lines, role or membership may have changed: rebuild both org trees
+            for cid in {old_company_id, company_id} - {None}:
+                bus.publish("org", cid)
+            return existing
+
+        pwd_hash = None
+        if password:
+            pwd_hash = get_password_hash(password)
+        user = User(name=name, email=email, role=role, company_id=company_id, manager_id=manager_id, password_hash=pwd_hash)
+        s.add(user)
+        s.commit()
+        s.refresh(user)
+        bus.publish("org", company_id)
+        return user
+
+
+@app.post('/token')
+async def login(form_data: OAuth2PasswordRequestForm = Depends()):
+    async with get_async_session() as s:
+        user = (await s.exec(select(User).where(User.email == form_data.username))).first()
+    if not user or not user.password_hash:
+        raise HTTPException(status_code=400, detail='Incorrect username or password')
+    # bcrypt runs on the password pool, off the event loop
+    valid, new_hash = await averify_password(form_data.password, user.password_hash)
+    if not valid:
+        raise HTTPException(status_code=400, detail='Incorrect username or password')
+    if new_hash:
+        # stored hash predates the current BCRYPT_ROUNDS; upgrade it now that we know the password
+        async with get_async_session() as s:
+            user.password_hash = new_hash
+            s.add(user)
+            await s.commit()
+    token = create_access_token({"sub": user.email, "user_id": user.id, "role": user.role})
+    return {"access_token": token, "token_type": "bearer"}
+
+@app.post('/expenses')
+async def submit_expense(submitter_id: int = Body(...), amount: float = Body(...), currency: str = Body(...), category: Optional[str] = Body(None), description: Optional[str] = Body(None), date_: Optional[str] = Body(None), approver_ids: Optional[List[int]] = Body(None), current=Depends(get_current_user)):
+    if not math.isfinite(amount):
+        raise HTTPException(status_code=422, detail='amount must be a finite number')
+    if date_:
+        d = date.fromisoformat(date_)
+    else:
+        d = date.today()
+    async with get_async_session() as s:
+        # short-TTL cached records; no SELECT on a warm cache
+        submitter = await aget_user(s, submitter_id)
+        if not submitter:
+            raise HTTPException(status_code=404, detail='submitter not found')
+        company = await aget_company(s, submitter.company_id) if submitter.company_id else None
+        if not company:
+            raise HTTPException(status_code=404, detail='company not found')
+        # single cross-rate lookup; falls back 1:1 when a currency is unknown
+        try:
+            priced = money.price(amount, currency, company.currency, await rate_provider.aquote(currency, company.currency))
+        except ArithmeticError:
+            raise HTTPException(status_code=422, detail='amount out of range')
+        amount_company = priced["amount_company_currency"]
+        expense = Expense(submitter_id=submitter_id, company_id=company.id, currency=currency, category=category, description=description, date=d, **priced)
+        s.add(expense)
+        # flush for the id; expense and steps commit together below
+        await s.flush()
+        # approval steps: approver_ids if provided, else the manager chain and admins from the cached org tree
+        tree = await s.run_sync(orgchart.get_tree, company.id)
+        chain = tree.approvers(submitter_id, amount_company, approver_ids, submitter.manager_id)
+        for seq, aid in enumerate(chain, start=1):
+            s.add(ApprovalStep(expense_id=expense.id, approver_id=aid, sequence=seq))
+        expense.steps_total = expense.steps_pending = len(chain)
+        s.add(expense)
+        await s.run_sync(apply_deltas, expense_deltas(company.id, submitter_id, category, d, expense.status, amount_company))
+        await s.commit()
+        # capture fields while attached to session
+        result = {
+            "id": expense.id,
+            "submitter_id": expense.submitter_id,
+            "company_id": expense.company_id,
+            "amount": expense.amount,
+            "currency": expense.currency,
+            "amount_company_currency": expense.amount_company_currency,
+            "fx_rate": str(expense.fx_rate),
+            "fx_as_of": expense.fx_as_of.isoformat() if expense.fx_as_of else None,
+            "category": expense.category,
+            "description": expense.description,
+            "date": expense.date.isoformat() if expense.date else None,
+            "status": expense.status,
+        }
+    # return the captured result
+    return result
+
+@app.post('/expenses/bulk')
+async def submit_expenses_bulk(request: Request, current=Depends(get_current_user)):
+    """Submit many expenses at once from a JSON array or NDJSON body.
+
+    Returns one result per input row, in order: {"index", "id", ...} on success
+    or {"index", "error"} when the row was rejected.
+    """
+    try:
+        rows = parse_rows(await request.body(), request.headers.get('content-type', ''))
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail='body must be a JSON array or NDJSON')
+    if len(rows) > BULK_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f'at most {BULK_MAX_ROWS} rows per request')
+    results = await run_in_threadpool(submit_batch, rows, rate_provider.quote)
+    return {"submitted": sum(1 for r in results if "id" in r), "failed": sum(1 for r in results if "error" in r), "results": results}
+
+@app.get('/expenses/user/{user_id}')
+def list_user_expenses(user_id: int, response: Response, limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[str] = None, status: Optional[str] = None, category: Optional[str] = None, date_from: Optional[date] = None, date_to: Optional[date] = None, fields: Optional[str] = None):
+    """A page of the user's expenses, newest first; next cursor in X-Next-Cursor.
+
+    `fields` is a comma-separated projection, e.g. `fields=id,amount,status`.
+    """
+    wanted = parse_fields(fields)
+    q, columns = expense_query(user_id, wanted, status, category, date_from, date_to)
+    after = decode_cursor(cursor, 2)
+    if after:
+        q = after_cursor(q, after)
+    with get_read_session() as s:
+        rows = s.exec(q.limit(limit + 1)).all()
+    page = rows[:limit]
+    if len(rows) > limit:
+        last = dict(zip(columns, page[-1]))
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor([last["date"], last["id"]])
+    return [row_dict(r, columns, wanted) for r in page]
+
+@app.get('/expenses/user/{user_id}/export')
+async def export_user_expenses(user_id: int, format: str = Query('ndjson', regex='^(ndjson|csv)$'), status: Optional[str] = None, category: Optional[str] = None, date_from: Optional[date] = None, date_to: Optional[date] = None, fields: Optional[str] = None, current=Depends(get_current_user)):
+    """Stream the user's full (filtered) history as NDJSON or CSV; for that user or an admin of their company."""
+    async with get_async_read_session() as s:
+        caller = await aget_user(s, current.get('user_id')) if current.get('user_id') else None
+        owner = await aget_user(s, user_id)
+    allowed = caller and (caller.id == user_id or (caller.role == 'admin' and owner and owner.company_id == caller.company_id))
+    if not allowed:
+        raise HTTPException(status_code=403, detail='only the user or a company admin may export')
+    wanted = parse_fields(fields)
+    q, columns = expense_query(user_id, wanted, status, category, date_from, date_to)
+    if format == 'csv':
+        return StreamingResponse(csv_lines(q, columns, wanted), media_type='text/csv',
+                                 headers={"Content-Disposition": f'attachment; filename="expenses-{user_id}.csv"'})
+    return StreamingResponse(ndjson_lines(q, columns, wanted), media_type='application/x-ndjson')
+
+@app.get('/companies/{company_id}/reports')
+async def company_reports(company_id: int, current=Depends(get_current_user)):
+    """Expense counts and totals (company currency) by category, month, status and submitter."""
+    async with get_async_read_session() as s:
+        caller = await aget_user(s, current.get('user_id')) if current.get('user_id') else None
+        if not caller or caller.role != 'admin' or caller.company_id != company_id:
+            raise HTTPException(status_code=403, detail='company admin role required')
+        company = await aget_company(s, company_id)
+        if not company:
+            raise HTTPException(status_code=404, detail='company not found')
+        report = await s.run_sync(company_report, company_id)
+    return {"company_id": company_id, "currency": company.currency, **report}
+
+@app.get('/companies/{company_id}/expenses/search')
+async def search_company_expenses(company_id: int, response: Response, q: Optional[str] = None, limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[str] = None, status: Optional[str] = None, currency: Optional[str] = None, category: Optional[str] = None, min_amount: Optional[float] = None, max_amount: Optional[float] = None, date_from: Optional[date] = None, date_to: Optional[date] = None, facets: bool = True, current=Depends(get_current_user)):
+    """Full-text search over description and category plus filters, ranked by relevance when `q` is given.
+
+    Facet counts (status, currency, category) cover every match, not just the page; the
+    next page's cursor is returned in the body and the X-Next-Cursor header.
+    """
+    async with get_async_read_session() as s:
+        caller = await aget_user(s, current.get('user_id')) if current.get('user_id') else None
+        if not caller or caller.role != 'admin' or caller.company_id != company_id:
+            raise HTTPException(status_code=403, detail='company admin role required')
+        # (rank, id) with text, (id,) without
+        after = decode_cursor(cursor, 2 if q and q.strip() else 1)
+        found = await s.run_sync(search_expenses, company_id, q, limit, after, facets and not cursor, status=status,
+                                 currency=currency, category=category, min_amount=min_amount, max_amount=max_amount,
+                                 date_from=date_from, date_to=date_to)
+    nxt = encode_cursor(found.pop("next")) if found["next"] else None
+    if nxt:
+        response.headers[NEXT_CURSOR_HEADER] = nxt
+    return {**found, "next_cursor": nxt}
+
+@app.put('/companies/{company_id}/rule')
+async def update_rule(company_id: int, percentage_threshold: Optional[int] = Body(None, ge=0, le=100),
+                      special_approver_ids: List[int] = Body([]), mode: str = Body('or', regex='^(?i:and|or)$'),
+                      current=Depends(get_current_user)):
+    """Replace the company's approval rule. Pending expenses are re-checked by the rules job."""
+    async with get_async_session() as s:
+        caller = await aget_user(s, current.get('user_id')) if current.get('user_id') else None
+        if not caller or caller.role != 'admin' or caller.company_id != company_id:
+            raise HTTPException(status_code=403, detail='company admin role required')
+        rule = await s.run_sync(set_rule, company_id, percentage_threshold, special_approver_ids, mode.lower())
+        await s.commit()
+    # publish dropped this worker's copy before the commit; drop anything re-read since
+    invalidate_rule(company_id)
+    return {"company_id": company_id, "percentage_threshold": rule.percentage_threshold,
+            "special_approver_ids": sorted(rule.special_approver_ids), "mode": rule.mode}
+
+@app.post('/companies/{company_id}/rules/simulate')
+async def simulate_rule(company_id: int, percentage_threshold: Optional[int] = Body(None, ge=0, le=100),
+                        special_approver_ids: List[int] = Body([]), mode: str = Body('or', regex='^(?i:and|or)$'),
+                        date_from: Optional[date] = Body(None), date_to: Optional[date] = Body(None),
+                        samples: int = Body(20, ge=0, le=200), current=Depends(get_current_user)):
+    """Replay the company's decisions in the date window under a candidate approval rule and
+    report which outcomes would differ from the current rule's. Nothing is written."""
+    async with get_async_read_session() as s:
+        caller = await aget_user(s, current.get('user_id')) if current.get('user_id') else None
+        if not caller or caller.role != 'admin' or caller.company_id != company_id:
+            raise HTTPException(status_code=403, detail='company admin role required')
+    candidate = CompiledRule(percentage_threshold, frozenset(special_approver_ids), mode.lower())
+
+    def run():
+        with get_read_session() as s:
+            return simulate(s, company_id, candidate, date_from, date_to, samples)
+    # one pass over the whole window; keep it off the event loop
+    result = await run_in_threadpool(run)
+    return {"company_id": company_id, "rule": {"percentage_threshold": percentage_threshold,
+            "special_approver_ids": sorted(candidate.special_approver_ids), "mode": candidate.mode}, **result}
+
+# sort keys for the approvals inbox; each ends with the step id so keysets are unique
+PENDING_SORTS = {
+    'queue': (ApprovalStep.id,),
+    'amount': (Expense.amount_company_currency, ApprovalStep.id),
+}
+
+@app.get('/approvals/user/{user_id}/pending')
+async def pending_for_user(user_id: int, response: Response, limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[str] = None, sort: str = Query('queue', regex='^(queue|amount)$'), order: str = Query('asc', regex='^(asc|desc)$'), category: Optional[str] = None, min_amount: Optional[float] = None, max_amount: Optional[float] = None):
+    """Expenses waiting on this approver, one joined query per page.
+
+    Only steps whose turn has come are listed: a step is hidden while an earlier
+    step (lower sequence) of the same expense is still open. The next page's
+    cursor is returned in the X-Next-Cursor header.
+    """
+    keys = PENDING_SORTS[sort]
+    earlier = aliased(ApprovalStep)
+    waiting_on_earlier = exists().where(earlier.expense_id == ApprovalStep.expense_id).where(earlier.completed == False).where(earlier.sequence < ApprovalStep.sequence)
+    q = (select(ApprovalStep, Expense)
+         .join(Expense, Expense.id == ApprovalStep.expense_id)
+         .where(ApprovalStep.approver_id == user_id)
+         .where(ApprovalStep.completed == False)
+         .where(Expense.status == 'pending')
+         .where(~waiting_on_earlier))
+    if category is not None:
+        q = q.where(Expense.category == category)
+    if min_amount is not None:
+        q = q.where(Expense.amount_company_currency >= min_amount)
+    if max_amount is not None:
+        q = q.where(Expense.amount_company_currency <= max_amount)
+    after = decode_cursor(cursor, len(keys))
+    if after:
+        q = q.where(keyset_after(keys, cursor_values(keys, after), order == 'desc'))
+    q = q.order_by(*[k.desc() if order == 'desc' else k.asc() for k in keys]).limit(limit + 1)
+    async with get_async_read_session() as s:
+        rows = (await s.exec(q)).all()
+    page = rows[:limit]
+    if len(rows) > limit:
+        last_step, last_exp = page[-1]
+        last = {'queue': [last_step.id], 'amount': [last_exp.amount_company_currency, last_step.id]}[sort]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last)
+    return [{"expense": exp, "step_id": step.id, "sequence": step.sequence} for step, exp in page]
+
+@app.post('/approvals/{expense_id}/decision')
+async def make_decision(expense_id: int, approver_id: int = Body(...), approved: bool = Body(...), comment: Optional[str] = Body(None), current=Depends(get_current_user)):
+    async with get_async_session() as s:
+        expense = await s.get(Expense, expense_id)
+        if not expense:
+            raise HTTPException(status_code=404, detail='expense not found')
+        # require that the caller is either the approver themselves or an admin
+        if not current:
+            raise HTTPException(status_code=401, detail='authentication required')
+        if current.get('role') != 'admin' and current.get('user_id') != approver_id:
+            raise HTTPException(status_code=403, detail='only the approver or admin can make decisions')
+
+        # find current active step for this approver
+        step = (await s.exec(select(ApprovalStep).where(ApprovalStep.expense_id == expense_id).where(ApprovalStep.approver_id == approver_id).where(ApprovalStep.completed == False))).first()
+        if not step:
+            raise HTTPException(status_code=400, detail='no pending approval step for this approver')
+        rule = await s.run_sync(get_rule, expense.company_id)
+        s.add(ApprovalDecision(expense_id=expense_id, approver_id=approver_id, approved=approved, comment=comment))
+        step.completed = True
+        s.add(step)
+        # counters make the rule check O(1); decision, step and status commit together
+        record_decision(expense, rule, approver_id, approved)
+        status, reason = evaluate(expense, rule)
+        if status != 'pending' and status != expense.status:
+            await s.run_sync(apply_deltas, status_deltas(expense.company_id, expense.status, status, expense.amount_company_currency))
+            expense.status = status
+        s.add(expense)
+        try:
+            await s.commit()
+        except StaleDataError:
+            # another decision on this expense committed first (version mismatch); nothing was written
+            raise HTTPException(status_code=409, detail='expense was updated concurrently, retry the decision')
+    return {"status": status, "reason": reason}
+
+
+@app.post('/ocr/receipt', status_code=202)
+async def ocr_receipt(file: UploadFile = File(...), callback_url: Optional[str] = Form(None), current=Depends(get_current_user)):
+    """Queue a receipt image for OCR and return its job. Poll GET /ocr/jobs/{id}, or pass
+    callback_url to have the finished job POSTed there. Re-uploading the same file returns
+    the existing job, with its result if already parsed, and retries it if it failed."""
+    async with get_async_read_session() as s:
+        caller = await aget_user(s, current.get('user_id')) if current.get('user_id') else None
+    if not caller or not caller.company_id:
+        raise HTTPException(status_code=403, detail='company user required')
+    wait = receipts.upload_wait(current.get('user_id'))
+    if wait:
+        raise HTTPException(status_code=429, detail='too many receipt uploads', headers={"Retry-After": str(int(wait) + 1)})
+    if callback_url:
+        try:
+            await run_in_threadpool(receipts.check_callback, callback_url)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+
+    def chunks():
+        while True:
+            chunk = file.file.read(64 * 1024)
+            if not chunk:
+                return
+            yield chunk
+    try:
+        sha, _, _ = await run_in_threadpool(receipts.store_upload, chunks())
+    except ValueError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    # deduplicated per company: another company's upload of the same bytes is a separate job
+    owned = select(ReceiptJob).where(ReceiptJob.company_id == caller.company_id).where(ReceiptJob.sha256 == sha)
+    async with get_async_session() as s:
+        job = (await s.exec(owned)).first()
+        if job and job.status == 'failed':
+            # conditional, so concurrent re-uploads queue it once
+            retried = await s.execute(update(ReceiptJob).where(ReceiptJob.id == job.id).where(ReceiptJob.status == 'failed')
+                                      .values(status='running', lease_until=receipts.lease_until(), error=None, result=None, finished_at=None,
+                                              callback_url=callback_url or job.callback_url))
+            await s.commit()
+            await s.refresh(job)
+            if retried.rowcount:
+                receipts.enqueue(job.id, sha)
+            return receipts.job_view(job)
+        if job:
+            return receipts.job_view(job)
+        # claimed by this process from the start; enqueued below
+        job = ReceiptJob(company_id=caller.company_id, sha256=sha, filename=file.filename, callback_url=callback_url,
+                         status='running', lease_until=receipts.lease_until())
+        s.add(job)
+        try:
+            await s.commit()
+        except IntegrityError:
+            # the same file was uploaded concurrently; hand back that job
+            await s.rollback()
+            job = (await s.exec(owned)).one()
+            return receipts.job_view(job)
+    receipts.enqueue(job.id, sha)
+    return receipts.job_view(job)
+
+
+@app.get('/ocr/jobs/{job_id}')
+async def ocr_job(job_id: int, current=Depends(get_current_user)):
+    async with get_async_read_session() as s:
+        caller = await aget_user(s, current.get('user_id')) if current.get('user_id') else None
+        job = await s.get(ReceiptJob, job_id)
+    # another company's job looks the same as a missing one
+    if not job or not caller or job.company_id is None or job.company_id != caller.company_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return receipts.job_view(job)
+
+
+metrics.boot_phase("import")
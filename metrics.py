@@ -0,0 +1,306 @@
+"""Request instrumentation and Prometheus metrics.
+
+MetricsMiddleware times every request into a per-route latency histogram and
+opens a RequestStats for it; engine hooks (instrument_engine) add each SQL
+statement's count and time to the current request, and requests issuing more
+than METRICS_QUERY_BUDGET statements are logged. Outbound httpx calls are
+timed per host through event hooks. Startup milestones (app imported, startup
+hooks done, first response sent) are recorded once per process, counted from
+`boot_started()`. `render()` serves it all in the
+Prometheus text format at /metrics.
+
+Metrics are per process. Under several workers a scrape sees only the worker
+that answered it; METRICS_WORKER_LABEL=1 (set by gunicorn.conf.py) adds a
+`worker` label with the pid so each worker's series stay apart.
+
+Setting PROFILE_SLOW_MS enables a sampling profiler: once a request has run
+that long, its threads' stacks are sampled every PROFILE_INTERVAL_MS until
+it finishes and the hottest stacks are logged.
+"""
+import contextvars
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Set, Tuple
+
+from sqlalchemy import event
+
+log = logging.getLogger(__name__)
+
+METRICS_QUERY_BUDGET = int(os.environ.get("METRICS_QUERY_BUDGET", "25"))
+METRICS_WORKER_LABEL = os.environ.get("METRICS_WORKER_LABEL", "0") == "1"
+# 0 disables the slow-request profiler
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", "0"))
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "5"))
+PROFILE_TOP = int(os.environ.get("PROFILE_TOP", "5"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250)
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if METRICS_WORKER_LABEL:
+        parts.append(f'worker="{os.getpid()}"')
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, doc: str, labels: Tuple[str, ...] = ()):
+        self.name, self.doc, self.labels = name, doc, labels
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, v in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, key)} {v:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name, self.doc, self.labels, self.buckets = name, doc, labels, tuple(buckets)
+        # per label set: [bucket counts..., sum, count]
+        self._values: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            slot = self._values.get(labels)
+            if slot is None:
+                slot = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    slot[i] += 1
+            slot[-2] += value
+            slot[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, slot in sorted(self._values.items()):
+                for b, n in zip(self.buckets, slot):
+                    le = 'le="%g"' % b
+                    lines.append(f"{self.name}_bucket{_labels(self.labels, key, le)} {n}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, le)} {slot[-1]}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, key)} {slot[-2]:g}")
+                lines.append(f"{self.name}_count{_labels(self.labels, key)} {slot[-1]}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, doc: str, labels: Tuple[str, ...] = ()):
+        self.name, self.doc, self.labels = name, doc, labels
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def get(self, *labels) -> Optional[float]:
+        return self._values.get(labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, v in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, key)} {v:g}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Request latency by route.", ("method", "route", "status"))
+REQUEST_QUERIES = Histogram("http_request_db_queries", "SQL statements issued per request.", ("route",), COUNT_BUCKETS)
+DB_SECONDS = Counter("db_query_seconds_total", "Time spent executing SQL, by route.", ("route",))
+BUDGET_EXCEEDED = Counter("db_query_budget_exceeded_total", "Requests issuing more than METRICS_QUERY_BUDGET statements.", ("route",))
+OUTBOUND_SECONDS = Histogram("http_client_request_duration_seconds", "Outbound HTTP latency by host.", ("host", "status"))
+STARTUP_SECONDS = Gauge("app_startup_seconds", "Seconds from the app starting to import until each startup phase.", ("phase",))
+REGISTRY = [REQUEST_SECONDS, REQUEST_QUERIES, DB_SECONDS, BUDGET_EXCEEDED, OUTBOUND_SECONDS, STARTUP_SECONDS]
+
+
+def render() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+_boot: Optional[float] = None
+
+
+def boot_started(at: float):
+    """Set the perf_counter() reading that startup phases are measured from."""
+    global _boot
+    _boot = at
+
+
+def boot_phase(phase: str) -> Optional[float]:
+    """Record `phase` as reached now (first time only); returns seconds since boot_started()."""
+    if _boot is None or STARTUP_SECONDS.get(phase) is not None:
+        return None
+    elapsed = time.perf_counter() - _boot
+    STARTUP_SECONDS.set(elapsed, phase)
+    log.info("startup: %s after %.0f ms", phase, elapsed * 1000)
+    return elapsed
+
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    db_seconds: float = 0.0
+    # threads that ran work for this request, for the profiler
+    threads: Set[int] = field(default_factory=set)
+
+
+# mutable holder, so threadpool and greenlet copies of the context share it
+current: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("request_stats", default=None)
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _record(started: float):
+    stats = current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += time.perf_counter() - started
+        stats.threads.add(threading.get_ident())
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    _record(conn.info["query_start"].pop())
+
+
+def _handle_error(ctx):
+    # after_cursor_execute does not fire for a failed statement; pop its start here instead,
+    # or it stays on the pooled connection for good
+    conn = ctx.connection
+    starts = conn.info.get("query_start") if conn is not None else None
+    if starts:
+        _record(starts.pop())
+
+
+def instrument_engine(engine):
+    """Count statements and DB time per request on a sync Engine (or an AsyncEngine's sync_engine)."""
+    if not event.contains(engine, "before_cursor_execute", _before_execute):
+        event.listen(engine, "before_cursor_execute", _before_execute)
+        event.listen(engine, "after_cursor_execute", _after_execute)
+        event.listen(engine, "handle_error", _handle_error)
+
+
+def _host(request) -> str:
+    return request.url.host or "unknown"
+
+
+def _on_request(request):
+    request.extensions["metrics_start"] = time.perf_counter()
+
+
+def _on_response(response):
+    started = response.request.extensions.get("metrics_start")
+    if started is not None:
+        OUTBOUND_SECONDS.observe(time.perf_counter() - started, _host(response.request), response.status_code)
+
+
+async def _aon_request(request):
+    _on_request(request)
+
+
+async def _aon_response(response):
+    _on_response(response)
+
+
+def httpx_hooks(asynchronous: bool = False) -> dict:
+    """event_hooks for an httpx client; times headers-received latency per host."""
+    if asynchronous:
+        return {"request": [_aon_request], "response": [_aon_response]}
+    return {"request": [_on_request], "response": [_on_response]}
+
+
+class _Sampler:
+    """Samples the stacks of a slow request's threads until it finishes."""
+
+    def __init__(self, stats: RequestStats, label: str):
+        self.stats, self.label = stats, label
+        self.done = threading.Event()
+        self.samples: _Tally = _Tally()
+        self.timer = threading.Timer(PROFILE_SLOW_MS / 1000, self._run)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def _run(self):
+        interval = PROFILE_INTERVAL_MS / 1000
+        while not self.done.wait(interval):
+            frames = sys._current_frames()
+            for tid in list(self.stats.threads):
+                frame = frames.get(tid)
+                stack = []
+                while frame is not None and len(stack) < 12:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                if stack:
+                    self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self, elapsed: float):
+        self.timer.cancel()
+        self.done.set()
+        if self.samples:
+            total = sum(self.samples.values())
+            top = "\n".join(f"  {n / total:5.1%} {stack}" for stack, n in self.samples.most_common(PROFILE_TOP))
+            log.warning("slow request %s took %.0f ms (%d samples):\n%s", self.label, elapsed * 1000, total, top)
+
+
+class MetricsMiddleware:
+    """ASGI middleware: latency, query count and DB time per route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats(threads={threading.get_ident()})
+        token = current.set(stats)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        sampler = _Sampler(stats, f"{scope['method']} {scope['path']}") if PROFILE_SLOW_MS > 0 else None
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            current.reset(token)
+            route = scope.get("route")
+            # the route template keeps label cardinality bounded; unmatched paths share one label
+            path = getattr(route, "path", None) or "unmatched"
+            REQUEST_SECONDS.observe(elapsed, scope["method"], path, status[0])
+            REQUEST_QUERIES.observe(stats.queries, path)
+            DB_SECONDS.inc(path, amount=stats.db_seconds)
+            if stats.queries > METRICS_QUERY_BUDGET:
+                BUDGET_EXCEEDED.inc(path)
+                log.warning("%s %s issued %d queries (budget %d, %.1f ms in DB)", scope["method"], path,
+                            stats.queries, METRICS_QUERY_BUDGET, stats.db_seconds * 1000)
+            if sampler:
+                sampler.stop(elapsed)
+            boot_phase("first_request")
@@ -0,0 +1,312 @@
+"""Versioned schema migrations.
+
+`create_all` only creates missing tables, so anything that changes an existing
+table (indexes, columns) is a numbered step in MIGRATIONS. The highest applied
+step is recorded in the `schemaversion` table and each step runs in its own
+transaction. Steps must be safe to run against a database that `create_all`
+has just built from the current models.
+
+`ensure_schema` (what `init_db()` runs at startup) fingerprints the models and
+the step list and stores the result in `schemastamp`; while the stamp matches,
+a boot costs one lookup instead of `create_all`'s per-table reflection.
+
+Run `python migrations.py --check` to migrate and verify the hot query plans.
+"""
+import hashlib
+import logging
+import sys
+
+from sqlalchemy import inspect, text
+
+log = logging.getLogger(__name__)
+
+
+def _create_index(conn, name, table, columns, unique=False):
+    # spelled out rather than taken from the models, so old steps keep working as models change
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    conn.execute(text(f'CREATE {kind} IF NOT EXISTS {name} ON "{table}" ({", ".join(columns)})'))
+
+
+def _v1_hot_path_indexes(conn):
+    dupes = conn.execute(text('SELECT COUNT(*) FROM (SELECT email FROM "user" GROUP BY email HAVING COUNT(*) > 1) d')).scalar()
+    if dupes:
+        # cannot enforce uniqueness until the duplicates are merged by hand; still index the lookup
+        log.warning("%d duplicate user emails found; creating ix_user_email as non-unique", dupes)
+    _create_index(conn, "ix_user_email", "user", ["email"], unique=not dupes)
+    _create_index(conn, "ix_expense_submitter", "expense", ["submitter_id"])
+    _create_index(conn, "ix_approvalstep_approver_completed", "approvalstep", ["approver_id", "completed"])
+    _create_index(conn, "ix_approvalstep_expense_completed", "approvalstep", ["expense_id", "completed"])
+    _create_index(conn, "ix_approvaldecision_expense", "approvaldecision", ["expense_id"])
+    _create_index(conn, "ix_approvalrule_company", "approvalrule", ["company_id"])
+
+
+def _add_column(conn, table, name, ddl):
+    if name not in {c["name"] for c in inspect(conn).get_columns(table)}:
+        conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {name} {ddl}'))
+
+
+def _v2_approval_counters(conn):
+    for name in ("steps_total", "steps_pending", "approvals_count", "rejections_count", "special_approvals"):
+        _add_column(conn, "expense", name, "INTEGER NOT NULL DEFAULT 0")
+    conn.execute(text(
+        "UPDATE expense SET "
+        "steps_total = (SELECT COUNT(*) FROM approvalstep s WHERE s.expense_id = expense.id), "
+        "steps_pending = (SELECT COUNT(*) FROM approvalstep s WHERE s.expense_id = expense.id AND s.completed = :f), "
+        "approvals_count = (SELECT COUNT(*) FROM approvaldecision d WHERE d.expense_id = expense.id AND d.approved = :t), "
+        "rejections_count = (SELECT COUNT(*) FROM approvaldecision d WHERE d.expense_id = expense.id AND d.approved = :f)"
+    ), {"t": True, "f": False})
+    rules = conn.execute(text("SELECT company_id, special_approver_ids FROM approvalrule")).fetchall()
+    for company_id, csv in rules:
+        ids = [int(x) for x in (csv or '').split(',') if x.strip()]
+        if not ids:
+            continue
+        placeholders = ", ".join(f":a{i}" for i in range(len(ids)))
+        params = {f"a{i}": v for i, v in enumerate(ids)}
+        params.update({"c": company_id, "t": True})
+        conn.execute(text(
+            "UPDATE expense SET special_approvals = (SELECT COUNT(*) FROM approvaldecision d "
+            f"WHERE d.expense_id = expense.id AND d.approved = :t AND d.approver_id IN ({placeholders})) "
+            "WHERE company_id = :c"
+        ), params)
+
+
+def _v3_expense_listing_index(conn):
+    # (submitter_id, date, id) serves both the plain submitter lookup and the paginated listing
+    _create_index(conn, "ix_expense_submitter_date", "expense", ["submitter_id", "date", "id"])
+    conn.execute(text("DROP INDEX IF EXISTS ix_expense_submitter"))
+
+
+def _v4_expense_summary(conn):
+    # the table itself comes from create_all; this backfills it from existing expenses,
+    # one (count, total) row per company and category, month (YYYY-MM), status and submitter
+    groups = {"category": "COALESCE(category, '')", "month": "COALESCE(SUBSTR(CAST(date AS VARCHAR(10)), 1, 7), '')",
+              "status": "COALESCE(status, '')", "submitter": "COALESCE(CAST(submitter_id AS VARCHAR(20)), '')"}
+    conn.execute(text("DELETE FROM expensesummary"))
+    for dimension, key in groups.items():
+        conn.execute(text(
+            f'INSERT INTO expensesummary (company_id, dimension, "key", "count", total) '
+            f"SELECT company_id, '{dimension}', {key}, COUNT(*), COALESCE(SUM(amount_company_currency), 0) "
+            f"FROM expense WHERE company_id IS NOT NULL GROUP BY company_id, {key}"))
+
+
+def _v5_updated_at(conn):
+    for table in ("expense", "approvalstep"):
+        _add_column(conn, table, "updated_at", "TIMESTAMP")
+        _create_index(conn, f"ix_{table}_updated_at", table, ["updated_at"])
+
+
+def _v6_scheduler(conn):
+    _add_column(conn, "approvalstep", "escalation_level", "INTEGER NOT NULL DEFAULT 0")
+    # lets the scheduler page through pending expenses without a table scan
+    _create_index(conn, "ix_expense_status", "expense", ["status", "id"])
+
+
+def _v7_expense_search(conn):
+    _create_index(conn, "ix_expense_company", "expense", ["company_id", "id"])
+    # full-text index over description and category, kept current by the database (see search.py)
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(
+            "ALTER TABLE expense ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS "
+            "(to_tsvector('simple', coalesce(description, '') || ' ' || coalesce(category, ''))) STORED"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_expense_search ON expense USING GIN (search_vector)"))
+        return
+    conn.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS expense_fts USING fts5("
+        "description, category, content='expense', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS expense_fts_ai AFTER INSERT ON expense BEGIN "
+        "INSERT INTO expense_fts(rowid, description, category) VALUES (new.id, new.description, new.category); END"))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS expense_fts_ad AFTER DELETE ON expense BEGIN "
+        "INSERT INTO expense_fts(expense_fts, rowid, description, category) "
+        "VALUES ('delete', old.id, old.description, old.category); END"))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS expense_fts_au AFTER UPDATE OF description, category ON expense BEGIN "
+        "INSERT INTO expense_fts(expense_fts, rowid, description, category) "
+        "VALUES ('delete', old.id, old.description, old.category); "
+        "INSERT INTO expense_fts(rowid, description, category) VALUES (new.id, new.description, new.category); END"))
+    # index whatever was written before the triggers existed
+    conn.execute(text("INSERT INTO expense_fts(expense_fts) VALUES ('rebuild')"))
+
+
+def _v8_expense_version(conn):
+    _add_column(conn, "expense", "version", "INTEGER NOT NULL DEFAULT 1")
+
+
+# currencies without two decimal places, as money.MINOR_UNITS listed them at version 9
+_V9_MINOR_UNITS = {
+    "BIF": 0, "CLP": 0, "DJF": 0, "GNF": 0, "ISK": 0, "JPY": 0, "KMF": 0, "KRW": 0, "PYG": 0,
+    "RWF": 0, "UGX": 0, "UYI": 0, "VND": 0, "VUV": 0, "XAF": 0, "XOF": 0, "XPF": 0,
+    "BHD": 3, "IQD": 3, "JOD": 3, "KWD": 3, "LYD": 3, "OMR": 3, "TND": 3,
+}
+
+
+def _v9_exact_money(conn):
+    for name in ("amount_minor", "amount_company_minor"):
+        _add_column(conn, "expense", name, "BIGINT")
+    _add_column(conn, "expense", "fx_rate", "VARCHAR(40)")
+    _add_column(conn, "expense", "fx_as_of", "DATE")
+    # backfill minor units from the floats; rates were never recorded, so fx_rate stays NULL
+    # (revalue.py --missing prices those rows)
+    def scale(currency_col):
+        cases = " ".join(f"WHEN '{cur}' THEN {10 ** exp}" for cur, exp in sorted(_V9_MINOR_UNITS.items()))
+        return f"CASE {currency_col} {cases} ELSE 100 END"
+    conn.execute(text(
+        f"UPDATE expense SET amount_minor = CAST(ROUND(amount * {scale('currency')}) AS BIGINT), "
+        "amount_company_minor = CAST(ROUND(amount_company_currency * "
+        f"(SELECT {scale('company.currency')} FROM company WHERE company.id = expense.company_id)) AS BIGINT) "
+        "WHERE amount_minor IS NULL"))
+
+
+def _v10_backfill_updated_at(conn):
+    # v5 left older rows without a change time, invisible to the export's change scan and the
+    # escalation SLA: expenses count as changed now (the next export re-sends them once), and
+    # steps date from their expense, so stale ones escalate on the next run
+    # SQLite keeps timestamps as text, and the ORM reads only 'YYYY-MM-DD HH:MM:SS'
+    opened = "DATETIME(e.date)" if conn.dialect.name == "sqlite" else "CAST(e.date AS TIMESTAMP)"
+    conn.execute(text("UPDATE expense SET updated_at = CURRENT_TIMESTAMP WHERE updated_at IS NULL"))
+    conn.execute(text(
+        f"UPDATE approvalstep SET updated_at = COALESCE((SELECT {opened} FROM expense e WHERE e.id = approvalstep.expense_id), "
+        "CURRENT_TIMESTAMP) WHERE updated_at IS NULL"))
+
+
+def _v11_open_step_indexes(conn):
+    _create_index(conn, "ix_approvalstep_open_age", "approvalstep", ["completed", "updated_at"])
+    # replaces (approver_id, completed): same equality lookups, plus an approver range over open steps
+    _create_index(conn, "ix_approvalstep_open_approver", "approvalstep", ["completed", "approver_id"])
+    conn.execute(text("DROP INDEX IF EXISTS ix_approvalstep_approver_completed"))
+
+
+def _v12_receipt_job_owner(conn):
+    # jobs from before this step have no owner and are no longer readable through the API
+    _add_column(conn, "receiptjob", "company_id", "INTEGER")
+    _create_index(conn, "ux_receiptjob_company_sha256", "receiptjob", ["company_id", "sha256"], unique=True)
+    conn.execute(text("DROP INDEX IF EXISTS ux_receiptjob_sha256"))
+
+
+def _v13_receipt_job_lease(conn):
+    _add_column(conn, "receiptjob", "lease_until", "TIMESTAMP")
+
+
+# (version, description, step) in ascending order; never renumber or edit an applied step
+MIGRATIONS = [
+    (1, "indexes for hot query predicates", _v1_hot_path_indexes),
+    (2, "running approval counters on expense", _v2_approval_counters),
+    (3, "expense listing index on (submitter_id, date, id)", _v3_expense_listing_index),
+    (4, "backfill expense summary", _v4_expense_summary),
+    (5, "updated_at change tracking on expense and approvalstep", _v5_updated_at),
+    (6, "escalation level on approvalstep, expense status index", _v6_scheduler),
+    (7, "full-text search index on expense description and category", _v7_expense_search),
+    (8, "optimistic version column on expense", _v8_expense_version),
+    (9, "exact minor-unit amounts, applied rate and as-of date on expense", _v9_exact_money),
+    (10, "backfill updated_at on expense and approvalstep", _v10_backfill_updated_at),
+    (11, "open approval step indexes for the scheduler", _v11_open_step_indexes),
+    (12, "owning company on receipt jobs", _v12_receipt_job_owner),
+    (13, "lease on running receipt jobs", _v13_receipt_job_lease),
+]
+
+
+def current_version(conn) -> int:
+    conn.execute(text("CREATE TABLE IF NOT EXISTS schemaversion (version INTEGER NOT NULL)"))
+    return conn.execute(text("SELECT MAX(version) FROM schemaversion")).scalar() or 0
+
+
+def migrate(engine) -> int:
+    """Apply pending steps and return the resulting schema version."""
+    with engine.begin() as conn:
+        version = current_version(conn)
+    for number, description, step in MIGRATIONS:
+        if number <= version:
+            continue
+        with engine.begin() as conn:
+            step(conn)
+            conn.execute(text("INSERT INTO schemaversion (version) VALUES (:v)"), {"v": number})
+        log.info("applied migration %d: %s", number, description)
+        version = number
+    return version
+
+
+def schema_stamp(metadata) -> str:
+    """Fingerprint of the tables, columns and indexes in `metadata` plus the latest migration."""
+    h = hashlib.sha256(f"migration:{MIGRATIONS[-1][0]}".encode())
+    for name, table in sorted(metadata.tables.items()):
+        h.update(f"table:{name}".encode())
+        for col in table.columns:
+            h.update(f"column:{col.name}:{type(col.type).__name__}:{col.nullable}:{col.primary_key}".encode())
+        for index in sorted(table.indexes, key=lambda i: i.name or ""):
+            h.update(f"index:{index.name}:{','.join(c.name for c in index.columns)}:{index.unique}".encode())
+    return h.hexdigest()[:16]
+
+
+def ensure_schema(engine, metadata, force: bool = False) -> bool:
+    """Create missing tables and apply pending steps unless the stored stamp is current.
+
+    Returns True when the schema was (re)checked, False when the stamp matched.
+    """
+    stamp = schema_stamp(metadata)
+    with engine.connect() as conn:
+        if not force and inspect(conn).has_table("schemastamp") and conn.execute(text("SELECT stamp FROM schemastamp")).scalar() == stamp:
+            return False
+    metadata.create_all(engine)
+    migrate(engine)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE IF NOT EXISTS schemastamp (stamp VARCHAR(64) NOT NULL)"))
+        conn.execute(text("DELETE FROM schemastamp"))
+        conn.execute(text("INSERT INTO schemastamp (stamp) VALUES (:s)"), {"s": stamp})
+    log.info("schema checked, stamp %s", stamp)
+    return True
+
+
+# query shapes issued by the API, and the index each one must use
+HOT_QUERIES = {
+    "user_by_email": ('SELECT id FROM "user" WHERE email = :p', "ix_user_email"),
+    "expenses_by_submitter": ("SELECT id FROM expense WHERE submitter_id = :p ORDER BY date DESC, id DESC",
+                              "ix_expense_submitter_date"),
+    "steps_by_approver": ("SELECT id FROM approvalstep WHERE approver_id = :p AND completed = :f",
+                          "ix_approvalstep_open_approver"),
+    "steps_by_expense": ("SELECT id FROM approvalstep WHERE expense_id = :p AND completed = :f",
+                         "ix_approvalstep_expense_completed"),
+    "decisions_by_expense": ("SELECT id FROM approvaldecision WHERE expense_id = :p", "ix_approvaldecision_expense"),
+    "rule_by_company": ("SELECT id FROM approvalrule WHERE company_id = :p", "ix_approvalrule_company"),
+    "pending_expenses": ("SELECT id FROM expense WHERE status = :p AND id > 0 ORDER BY id LIMIT 100", "ix_expense_status"),
+    "overdue_steps": ("SELECT id FROM approvalstep WHERE completed = :f AND updated_at < :p ORDER BY updated_at, id LIMIT 100",
+                      "ix_approvalstep_open_age"),
+    "approvers_with_open_steps": ("SELECT approver_id FROM approvalstep WHERE approver_id > :p AND completed = :f "
+                                  "GROUP BY approver_id ORDER BY approver_id LIMIT 100", "ix_approvalstep_open_approver"),
+}
+
+
+def explain(conn, sql: str, params: dict) -> str:
+    if conn.dialect.name == "sqlite":
+        rows = conn.execute(text("EXPLAIN QUERY PLAN " + sql), params).fetchall()
+        return "\n".join(str(r[-1]) for r in rows)
+    rows = conn.execute(text("EXPLAIN " + sql), params).fetchall()
+    return "\n".join(str(r[0]) for r in rows)
+
+
+def check_query_plans(engine) -> list:
+    """Return (query name, expected index, plan) for every hot query that misses its index."""
+    failures = []
+    with engine.connect() as conn:
+        if conn.dialect.name == "postgresql":
+            # small tables make seq scans cheaper; we only care that the index is usable
+            conn.execute(text("SET enable_seqscan = off"))
+        for name, (sql, index) in HOT_QUERIES.items():
+            plan = explain(conn, sql, {"p": 1, "f": False})
+            if index not in plan:
+                failures.append((name, index, plan))
+    return failures
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    import models  # noqa: F401  registers the tables for create_all
+    from db import engine, init_db
+    init_db(force=True)
+    with engine.connect() as conn:
+        print("schema version", current_version(conn))
+    if "--check" in sys.argv:
+        failures = check_query_plans(engine)
+        for name, index, plan in failures:
+            print(f"{name}: expected {index}, got: {plan}")
+        sys.exit(1 if failures else 0)
@@ -1,69 +1,181 @@
-from typing import Optional, List
-from sqlmodel import SQLModel, Field, Relationship
-from datetime import date as dt_date
-from sqlalchemy import Column
-from sqlalchemy.sql.sqltypes import Date
-
-class Company(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    name: str
-    country: str
-    currency: str
-
-    users: List["User"] = Relationship(back_populates="company")
-    expenses: List["Expense"] = Relationship(back_populates="company")
-
-class User(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    name: str
-    email: str
-    role: str = "employee"  # admin, manager, employee
-    password_hash: Optional[str] = None
-    manager_id: Optional[int] = Field(default=None, foreign_key="user.id")
-    company_id: Optional[int] = Field(default=None, foreign_key="company.id")
-
-    company: Optional[Company] = Relationship(back_populates="users")
-
-class Expense(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    submitter_id: int = Field(foreign_key="user.id")
-    company_id: int = Field(foreign_key="company.id")
-    amount: float
-    currency: str
-    amount_company_currency: float
-    category: Optional[str] = None
-    description: Optional[str] = None
-    date: Optional[dt_date] = Field(default=None, sa_column=Column(Date))
-    status: str = Field(default="pending")  # pending, approved, rejected
-
-    approvals: List["ApprovalStep"] = Relationship(back_populates="expense")
-    decisions: List["ApprovalDecision"] = Relationship(back_populates="expense")
-    company: Optional[Company] = Relationship(back_populates="expenses")
-
-class ApprovalStep(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    expense_id: int = Field(foreign_key="expense.id")
-    approver_id: int = Field(foreign_key="user.id")
-    sequence: int = 0
-    completed: bool = False
-
-    expense: Optional[Expense] = Relationship(back_populates="approvals")
-
-class ApprovalDecision(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    expense_id: int = Field(foreign_key="expense.id")
-    approver_id: int = Field(foreign_key="user.id")
-    approved: bool
-    comment: Optional[str] = None
-
-    expense: Optional[Expense] = Relationship(back_populates="decisions")
-
-class ApprovalRule(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    company_id: int = Field(foreign_key="company.id")
-    # percentage threshold as integer 0-100, nullable
-    percentage_threshold: Optional[int] = None
-    # list of special approver user ids serialized as CSV for simplicity
-    special_approver_ids: Optional[str] = None
-    # behavior: 'and' or 'or' between rules (not fully fleshed out in prototype)
-    mode: Optional[str] = 'or'
+from typing import Optional, List
+from sqlmodel import SQLModel, Field, Relationship
+from datetime import date as dt_date, datetime
+from decimal import Decimal
+from sqlalchemy import BigInteger, Column, Index, Integer, LargeBinary, text
+from sqlalchemy.sql.sqltypes import Date
+
+from money import DecimalText
+
+class Company(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    name: str
+    country: str
+    currency: str
+
+    users: List["User"] = Relationship(back_populates="company")
+    expenses: List["Expense"] = Relationship(back_populates="company")
+
+class User(SQLModel, table=True):
+    __table_args__ = (Index("ix_user_email", "email", unique=True),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    name: str
+    email: str
+    role: str = "employee"  # admin, manager, employee
+    password_hash: Optional[str] = None
+    manager_id: Optional[int] = Field(default=None, foreign_key="user.id")
+    company_id: Optional[int] = Field(default=None, foreign_key="company.id")
+
+    company: Optional[Company] = Relationship(back_populates="users")
+
+# optimistic lock: the ORM bumps it on every UPDATE and fails a flush whose row changed underneath
+_expense_version = Column("version", Integer, nullable=False, server_default=text("1"))
+
+class Expense(SQLModel, table=True):
+    __mapper_args__ = {"version_id_col": _expense_version}
+    __table_args__ = (
+        Index("ix_expense_submitter_date", "submitter_id", "date", "id"),
+        Index("ix_expense_updated_at", "updated_at"),
+        Index("ix_expense_status", "status", "id"),
+        Index("ix_expense_company", "company_id", "id"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    submitter_id: int = Field(foreign_key="user.id")
+    company_id: int = Field(foreign_key="company.id")
+    # exact amounts in minor units (see money.py); the floats mirror them for filters and the JSON API
+    amount: float
+    currency: str
+    amount_company_currency: float
+    amount_minor: Optional[int] = Field(default=None, sa_column=Column(BigInteger))
+    amount_company_minor: Optional[int] = Field(default=None, sa_column=Column(BigInteger))
+    # rate applied (company currency per unit of `currency`) and the date of the rate table; NULL before migration 9
+    fx_rate: Optional[Decimal] = Field(default=None, sa_column=Column(DecimalText(40)))
+    fx_as_of: Optional[dt_date] = Field(default=None, sa_column=Column(Date))
+    category: Optional[str] = None
+    description: Optional[str] = None
+    date: Optional[dt_date] = Field(default=None, sa_column=Column(Date))
+    status: str = Field(default="pending")  # pending, approved, rejected
+    # running approval counters maintained by approvals.record_decision
+    steps_total: int = 0
+    steps_pending: int = 0
+    approvals_count: int = 0
+    rejections_count: int = 0
+    special_approvals: int = 0
+    # set on every insert/update; lets exports pick up changed rows
+    updated_at: Optional[datetime] = Field(default=None, sa_column_kwargs={"default": datetime.utcnow, "onupdate": datetime.utcnow})
+    version: Optional[int] = Field(default=None, sa_column=_expense_version)
+
+    approvals: List["ApprovalStep"] = Relationship(back_populates="expense")
+    decisions: List["ApprovalDecision"] = Relationship(back_populates="expense")
+    company: Optional[Company] = Relationship(back_populates="expenses")
+
+class ApprovalStep(SQLModel, table=True):
+    __table_args__ = (
+        # completed first: serves the inbox lookups and the scheduler's range over open steps' approvers
+        Index("ix_approvalstep_open_approver", "completed", "approver_id"),
+        Index("ix_approvalstep_expense_completed", "expense_id", "completed"),
+        Index("ix_approvalstep_updated_at", "updated_at"),
+        # open steps by age, for the scheduler's escalation scan
+        Index("ix_approvalstep_open_age", "completed", "updated_at"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    expense_id: int = Field(foreign_key="expense.id")
+    approver_id: int = Field(foreign_key="user.id")
+    sequence: int = 0
+    completed: bool = False
+    # times the scheduler has moved this step up the org chart for sitting past the SLA
+    escalation_level: int = 0
+    updated_at: Optional[datetime] = Field(default=None, sa_column_kwargs={"default": datetime.utcnow, "onupdate": datetime.utcnow})
+
+    expense: Optional[Expense] = Relationship(back_populates="approvals")
+
+class ApprovalDecision(SQLModel, table=True):
+    __table_args__ = (Index("ix_approvaldecision_expense", "expense_id"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    expense_id: int = Field(foreign_key="expense.id")
+    approver_id: int = Field(foreign_key="user.id")
+    approved: bool
+    comment: Optional[str] = None
+
+    expense: Optional[Expense] = Relationship(back_populates="decisions")
+
+class ApprovalRule(SQLModel, table=True):
+    __table_args__ = (Index("ix_approvalrule_company", "company_id"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    company_id: int = Field(foreign_key="company.id")
+    # percentage threshold as integer 0-100, nullable
+    percentage_threshold: Optional[int] = None
+    # list of special approver user ids serialized as CSV for simplicity
+    special_approver_ids: Optional[str] = None
+    # behavior: 'and' or 'or' between rules (not fully fleshed out in prototype)
+    mode: Optional[str] = 'or'
+
+class ExpenseSummary(SQLModel, table=True):
+    """Per-company running totals for reporting, kept in step with Expense by reports.py."""
+    __table_args__ = (Index("ux_expensesummary_key", "company_id", "dimension", "key", unique=True),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    company_id: int = Field(foreign_key="company.id")
+    # category, month (YYYY-MM), status or submitter (user id)
+    dimension: str
+    key: str
+    count: int = 0
+    # sum of amount_company_currency
+    total: float = 0.0
+
+class ReceiptJob(SQLModel, table=True):
+    """One uploaded receipt image and its OCR result; see receipts.py."""
+    __table_args__ = (Index("ux_receiptjob_company_sha256", "company_id", "sha256", unique=True),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    # the uploader's company; only its users see the job
+    company_id: Optional[int] = None
+    # content hash of the upload; identical files within a company share one job
+    sha256: str
+    filename: Optional[str] = None
+    status: str = "queued"  # queued, running, done, failed
+    # a running job belongs to the process that claimed it until then; see receipts.claim
+    # parse_receipt_text output as JSON
+    result: Optional[str] = None
+    error: Optional[str] = None
+    callback_url: Optional[str] = None
+    created_at: Optional[datetime] = Field(default=None, sa_column_kwargs={"default": datetime.utcnow})
+    finished_at: Optional[datetime] = None
+    lease_until: Optional[datetime] = None
+
+class SchedulerLock(SQLModel, table=True):
+    """Leader lease for background jobs; one row per lock name, see scheduler.py."""
+    name: str = Field(primary_key=True)
+    owner: str
+    expires_at: datetime
+
+class CacheEvent(SQLModel, table=True):
+    """Cache invalidation broadcast between workers; see bus.py."""
+    __table_args__ = (Index("ix_cacheevent_created_at", "created_at"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    topic: str
+    key: Optional[str] = None
+    # publishing process, which has already applied the event
+    origin: str
+    created_at: datetime
+
+class IdempotencyKey(SQLModel, table=True):
+    """Stored response for a write sent with an Idempotency-Key header; see idempotency.py."""
+    __table_args__ = (Index("ix_idempotencykey_expires_at", "expires_at"),)
+
+    # caller scope + client key
+    key: str = Field(primary_key=True)
+    # hash of method, path and body of the first request
+    fingerprint: str
+    # null while the first request is still running
+    status_code: Optional[int] = None
+    content_type: Optional[str] = None
+    response_body: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary))
+    created_at: datetime
+    expires_at: datetime
@@ -0,0 +1,82 @@
+"""Exact money arithmetic.
+
+Expense amounts are stored as integers in the currency's minor unit (cents,
+paise; yen have none) and the applied exchange rate as a decimal string, so
+totals and conversions are exact and repeatable. A conversion rounds once,
+half away from zero, into the target currency's minor unit; `convert` and the
+vectorised path in revalue.py must agree on that.
+"""
+from datetime import date
+from decimal import ROUND_HALF_UP, Context, Decimal
+from typing import Optional, Tuple
+
+from sqlalchemy import String
+from sqlalchemy.types import TypeDecorator
+
+# ISO 4217 minor-unit exponents other than the usual 2
+MINOR_UNITS = {
+    "BIF": 0, "CLP": 0, "DJF": 0, "GNF": 0, "ISK": 0, "JPY": 0, "KMF": 0, "KRW": 0, "PYG": 0,
+    "RWF": 0, "UGX": 0, "UYI": 0, "VND": 0, "VUV": 0, "XAF": 0, "XOF": 0, "XPF": 0,
+    "BHD": 3, "IQD": 3, "JOD": 3, "KWD": 3, "LYD": 3, "OMR": 3, "TND": 3,
+}
+# significant digits kept from an upstream (float) rate
+RATE_DIGITS = 12
+_rate_context = Context(prec=RATE_DIGITS)
+ONE = Decimal(1)
+
+
+def exponent(currency: str) -> int:
+    return MINOR_UNITS.get((currency or '').upper(), 2)
+
+
+def to_minor(amount, currency: str) -> int:
+    """A major-unit amount (float, str or Decimal) as an integer count of minor units."""
+    value = amount if isinstance(amount, Decimal) else Decimal(str(amount))
+    return int(value.scaleb(exponent(currency)).quantize(ONE, rounding=ROUND_HALF_UP))
+
+
+def from_minor(minor: int, currency: str) -> Decimal:
+    return Decimal(minor).scaleb(-exponent(currency))
+
+
+def to_float(minor: Optional[int], currency: str) -> Optional[float]:
+    """Major units as a float, for the JSON API and the float mirror columns."""
+    return None if minor is None else float(from_minor(minor, currency))
+
+
+def rate_decimal(rate) -> Decimal:
+    """An upstream rate as a Decimal of at most RATE_DIGITS significant digits."""
+    return rate if isinstance(rate, Decimal) else _rate_context.create_decimal(repr(float(rate)))
+
+
+def convert(minor: int, rate: Decimal, source: str, target: str) -> int:
+    """Convert minor units of `source` at `rate` (target per source) into minor units of `target`."""
+    value = (Decimal(minor) * rate).scaleb(exponent(target) - exponent(source))
+    return int(value.quantize(ONE, rounding=ROUND_HALF_UP))
+
+
+def price(amount, currency: str, company_currency: str, quote: Optional[Tuple[float, float]]) -> dict:
+    """The money columns of an expense of `amount` `currency` for a company reporting in
+    `company_currency`; `quote` is (rate, as-of epoch seconds) from RateProvider.quote, or
+    None for an unknown currency, which converts 1:1 as it always has."""
+    amount_minor = to_minor(amount, currency)
+    if quote is None:
+        rate, as_of = ONE, None
+    else:
+        rate, as_of = rate_decimal(quote[0]), date.fromtimestamp(quote[1])
+    company_minor = convert(amount_minor, rate, currency, company_currency)
+    return {"amount": to_float(amount_minor, currency), "amount_minor": amount_minor,
+            "amount_company_currency": to_float(company_minor, company_currency), "amount_company_minor": company_minor,
+            "fx_rate": rate, "fx_as_of": as_of}
+
+
+class DecimalText(TypeDecorator):
+    """Decimal stored as text: exact on every backend, SQLite included."""
+    impl = String
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else str(rate_decimal(value))
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else Decimal(value)
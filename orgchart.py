@@ -0,0 +1,94 @@
+"""Org hierarchy cache for approver routing.
+
+Each company's reporting lines (user -> manager) and its admin set are loaded
+with one query into an immutable OrgTree and kept per process, so building an
+expense's approval chain is a walk up the tree in memory: O(depth), no DB
+round-trips. create_user drops the company's tree whenever it changes a
+user's manager, role or company; the TTL bounds staleness across workers.
+
+How far up the chain an expense goes depends on its amount in company
+currency: ORG_CHAIN_LEVELS managers by default, more for amounts at or above
+the ORG_ESCALATION thresholds ("amount:levels,...", e.g. "1000:2,10000:3").
+"""
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlmodel import select
+
+from approvals import approval_chain
+from cache import TTLCache
+from models import User
+
+ORG_TTL = float(os.environ.get("ORG_TTL", "300"))
+ORG_CACHE_SIZE = int(os.environ.get("ORG_CACHE_SIZE", "1000"))
+ORG_CHAIN_LEVELS = int(os.environ.get("ORG_CHAIN_LEVELS", "1"))
+
+
+def parse_escalation(spec: str) -> Tuple[Tuple[float, int], ...]:
+    """'1000:2,10000:3' -> ((10000.0, 3), (1000.0, 2)), highest threshold first."""
+    steps = []
+    for part in (spec or '').split(','):
+        if part.strip():
+            amount, levels = part.split(':')
+            steps.append((float(amount), int(levels)))
+    return tuple(sorted(steps, reverse=True))
+
+
+ORG_ESCALATION = parse_escalation(os.environ.get("ORG_ESCALATION", ""))
+
+
+@dataclass(frozen=True)
+class OrgTree:
+    company_id: int
+    managers: Dict[int, Optional[int]]
+    # ordered by id, the order admins are appended to a chain
+    admins: Tuple[int, ...]
+
+    def managers_above(self, user_id: int, levels: int, manager_id: Optional[int] = None) -> List[int]:
+        """Up to `levels` managers above the user, nearest first; `manager_id` is used
+        when the user is newer than the cached tree."""
+        chain: List[int] = []
+        current = self.managers.get(user_id, manager_id)
+        while current and len(chain) < levels and current not in chain and current != user_id:
+            chain.append(current)
+            current = self.managers.get(current)
+        return chain
+
+    def approvers(self, user_id: int, amount: float = 0.0, approver_ids: Optional[Sequence[int]] = None,
+                  manager_id: Optional[int] = None) -> List[int]:
+        """Approval chain for an expense: explicit approvers if given, else the
+        manager levels the amount calls for followed by the company admins."""
+        if approver_ids:
+            return list(approver_ids)
+        return approval_chain(self.managers_above(user_id, levels_for(amount), manager_id), None, self.admins)
+
+
+def levels_for(amount: float) -> int:
+    for threshold, levels in ORG_ESCALATION:
+        if amount >= threshold:
+            return max(levels, ORG_CHAIN_LEVELS)
+    return ORG_CHAIN_LEVELS
+
+
+trees = TTLCache(ORG_CACHE_SIZE, ORG_TTL)
+
+
+def load_tree(session, company_id: int) -> OrgTree:
+    rows = session.exec(select(User.id, User.manager_id, User.role).where(User.company_id == company_id).order_by(User.id)).all()
+    return OrgTree(company_id, {uid: mid for uid, mid, _ in rows}, tuple(uid for uid, _, role in rows if role == 'admin'))
+
+
+def get_tree(session, company_id: int) -> OrgTree:
+    """Cached tree for a company; takes a sync Session (use AsyncSession.run_sync from async code)."""
+    tree = trees.get(company_id)
+    if tree is None:
+        tree = load_tree(session, company_id)
+        trees.put(company_id, tree)
+    return tree
+
+
+def invalidate_company(*company_ids: Optional[int]):
+    for company_id in company_ids:
+        if company_id is not None:
+            trees.pop(company_id)
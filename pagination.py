@@ -0,0 +1,75 @@
+"""Opaque keyset cursors.
+
+A cursor is the sort key of the last row on a page, JSON-encoded and
+base64url-wrapped so clients treat it as a token. Pages are returned as plain
+lists with the next cursor in the X-Next-Cursor response header. A cursor
+comes back from the client, so `cursor_values` checks each value against its
+sort column before it reaches SQL.
+"""
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(values: list) -> str:
+    raw = json.dumps(values, separators=(",", ":"), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], size: int) -> Optional[list]:
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        values = None
+    if not isinstance(values, list) or len(values) != size or any(isinstance(v, (list, dict)) for v in values):
+        raise HTTPException(status_code=400, detail='invalid cursor')
+    return values
+
+
+def _cursor_value(column, value):
+    if value is None:
+        return None
+    try:
+        kind = column.type.python_type
+    except NotImplementedError:  # untyped expressions, e.g. a raw rank function
+        kind = None
+    if isinstance(value, bool):
+        pass
+    elif kind in (date, datetime) and isinstance(value, str):
+        try:
+            return kind.fromisoformat(value)
+        except ValueError:
+            pass
+    elif kind is int and isinstance(value, int):
+        return value
+    elif kind in (float, Decimal) and isinstance(value, (int, float)):
+        return value
+    elif kind is str and isinstance(value, str):
+        return value
+    raise HTTPException(status_code=400, detail='invalid cursor')
+
+
+def cursor_values(columns: tuple, values: list) -> list:
+    """Decoded cursor `values` as the Python types of their sort `columns`; 400 when one does not fit.
+    None passes through (nullable sort keys)."""
+    return [_cursor_value(c, v) for c, v in zip(columns, values)]
+
+
+def keyset_after(columns: tuple, values: list, descending: bool = False):
+    """WHERE clause selecting rows strictly after `values` in (columns...) order; pass client
+    cursors through cursor_values first."""
+    clauses = []
+    for i, col in enumerate(columns):
+        beyond = col < values[i] if descending else col > values[i]
+        clauses.append(and_(*[columns[j] == values[j] for j in range(i)], beyond))
+    return or_(*clauses)
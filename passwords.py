@@ -0,0 +1,111 @@
+"""Password hashing service.
+
+bcrypt runs on a small process pool so hashing scales across cores instead of
+holding the GIL on a request thread, and a concurrency limiter caps how many
+hashes may be queued at once so a login storm is turned away with 503 rather
+than starving every other endpoint. The cost factor comes from BCRYPT_ROUNDS;
+hashes made at another cost are flagged on login so the caller can store the
+upgraded hash.
+"""
+import asyncio
+import os
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+# 0 runs hashing in threads of this process instead of a process pool
+PASSWORD_WORKERS = int(os.environ.get("PASSWORD_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_CONCURRENCY = int(os.environ.get("PASSWORD_CONCURRENCY", str(max(PASSWORD_WORKERS, 1) * 4)))
+# seconds a caller may wait for a hashing slot before being told to retry
+PASSWORD_QUEUE_TIMEOUT = float(os.environ.get("PASSWORD_QUEUE_TIMEOUT", "5"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+class PasswordBusy(Exception):
+    """Too many hashes in flight; the request should be retried later."""
+
+
+# module-level so the process pool can pickle them by reference
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(password: str, hashed: str) -> bool:
+    return pwd_context.verify(password, hashed)
+
+
+def _verify_and_update(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(password, hashed)
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+_sync_slots = threading.BoundedSemaphore(PASSWORD_CONCURRENCY)
+_async_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def _pool() -> Optional[ProcessPoolExecutor]:
+    global _executor
+    if PASSWORD_WORKERS <= 0:
+        return None
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(max_workers=PASSWORD_WORKERS)
+    return _executor
+
+
+def _run(fn, *args):
+    if not _sync_slots.acquire(timeout=PASSWORD_QUEUE_TIMEOUT):
+        raise PasswordBusy()
+    try:
+        pool = _pool()
+        return pool.submit(fn, *args).result() if pool else fn(*args)
+    finally:
+        _sync_slots.release()
+
+
+async def _arun(fn, *args):
+    loop = asyncio.get_running_loop()
+    slots = _async_slots.get(loop)
+    if slots is None:
+        slots = _async_slots.setdefault(loop, asyncio.Semaphore(PASSWORD_CONCURRENCY))
+    try:
+        await asyncio.wait_for(slots.acquire(), PASSWORD_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise PasswordBusy()
+    try:
+        # None falls back to the loop's default thread executor
+        return await loop.run_in_executor(_pool(), fn, *args)
+    finally:
+        slots.release()
+
+
+def hash_password(password: str) -> str:
+    return _run(_hash, password)
+
+
+def verify_password(password: str, hashed: str) -> bool:
+    return _run(_verify, password, hashed)
+
+
+async def ahash_password(password: str) -> str:
+    return await _arun(_hash, password)
+
+
+async def averify_password(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    """Return (valid, new_hash); new_hash is set when the stored hash uses an outdated cost."""
+    return await _arun(_verify_and_update, password, hashed)
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
@@ -0,0 +1,63 @@
+"""Short-TTL cache of the user and company records handlers need on every
+request (role, manager, company currency), so they come from memory rather
+than a fresh SELECT. Entries are immutable snapshots; create_user drops the
+user's entry when it changes the row."""
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from cache import TTLCache
+from models import Company, User
+
+PRINCIPAL_TTL = float(os.environ.get("PRINCIPAL_TTL", "30"))
+PRINCIPAL_CACHE_SIZE = int(os.environ.get("PRINCIPAL_CACHE_SIZE", "10000"))
+
+
+@dataclass(frozen=True)
+class UserRecord:
+    id: int
+    email: str
+    role: str
+    company_id: Optional[int]
+    manager_id: Optional[int]
+
+
+@dataclass(frozen=True)
+class CompanyRecord:
+    id: int
+    name: str
+    currency: str
+
+
+users = TTLCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_TTL)
+companies = TTLCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_TTL)
+
+
+async def aget_user(session, user_id: int) -> Optional[UserRecord]:
+    record = users.get(user_id)
+    if record is None:
+        row = await session.get(User, user_id)
+        if not row:
+            return None
+        record = UserRecord(row.id, row.email, row.role, row.company_id, row.manager_id)
+        users.put(user_id, record)
+    return record
+
+
+async def aget_company(session, company_id: int) -> Optional[CompanyRecord]:
+    record = companies.get(company_id)
+    if record is None:
+        row = await session.get(Company, company_id)
+        if not row:
+            return None
+        record = CompanyRecord(row.id, row.name, row.currency)
+        companies.put(company_id, record)
+    return record
+
+
+def invalidate_user(user_id: int):
+    users.pop(user_id)
+
+
+def invalidate_company(company_id: int):
+    companies.pop(company_id)
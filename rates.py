@@ -0,0 +1,221 @@
+"""Exchange-rate provider.
+
+Keeps one rate table per base currency in process, refreshed at most once per
+TTL window. Concurrent misses for the same base share a single upstream fetch,
+and the last good tables are written to a JSON snapshot so a cold start or an
+upstream outage still converts at a known as-of rate. A failed fetch is not
+retried for RATES_RETRY seconds: until then every caller gets the last good
+table (or the same error) without going upstream.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from http_client import get_async_client, get_client
+
+RATES_URL = 'https://api.exchangerate-api.com/v4/latest/{base}'
+RATES_TTL = int(os.environ.get("RATES_TTL", "3600"))
+# seconds between upstream attempts once a fetch has failed
+RATES_RETRY = float(os.environ.get("RATES_RETRY", "60"))
+RATES_SNAPSHOT = os.environ.get("RATES_SNAPSHOT") or "./rates_snapshot.json"
+# tables are fetched against this currency and re-based by cross-rate
+RATES_PIVOT = os.environ.get("RATES_PIVOT", "USD")
+
+# units of each currency per 1 USD, used when USE_EXTERNAL is off
+MOCK_RATES = {'USD': 1.0, 'EUR': 0.9, 'INR': 82.0}
+
+
+def fetch_rates(base: str) -> dict:
+    resp = get_client().get(RATES_URL.format(base=base))
+    resp.raise_for_status()
+    return resp.json().get('rates', {})
+
+
+async def afetch_rates(base: str) -> dict:
+    resp = await get_async_client().get(RATES_URL.format(base=base))
+    resp.raise_for_status()
+    return resp.json().get('rates', {})
+
+
+def mock_rates(base: str) -> dict:
+    return rebase(MOCK_RATES, base) or dict(MOCK_RATES, **{base: 1.0})
+
+
+async def amock_rates(base: str) -> dict:
+    return mock_rates(base)
+
+
+def rebase(table: dict, base: str) -> Optional[dict]:
+    """Re-express a rate table against `base`; None if `base` is not in it."""
+    pivot = table.get(base)
+    if not pivot:
+        return None
+    return {cur: r / pivot for cur, r in table.items()}
+
+
+class RateProvider:
+    def __init__(self, fetch: Callable[[str], dict] = fetch_rates, ttl: int = RATES_TTL,
+                 snapshot_path: Optional[str] = None, pivot: str = RATES_PIVOT,
+                 afetch: Optional[Callable[[str], Awaitable[dict]]] = None, retry: float = RATES_RETRY):
+        self.fetch = fetch
+        # async handlers use afetch; without one the sync fetch runs in the threadpool
+        self.afetch = afetch
+        self.ttl = ttl
+        self.retry = retry
+        self.snapshot_path = snapshot_path
+        self.pivot = pivot
+        # base -> {"as_of": epoch seconds, "rates": {quote: rate}}
+        self._tables: Dict[str, dict] = {}
+        # base -> (retry after, epoch seconds; the error) for a fetch that failed
+        self._failures: Dict[str, Tuple[float, Exception]] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._alocks: Dict[str, asyncio.Lock] = {}
+        self._guard = threading.Lock()
+        self._snapshot_loaded = False
+
+    def _fresh(self, base: str) -> Optional[dict]:
+        entry = self._tables.get(base)
+        if entry and time.time() - entry["as_of"] < self.ttl:
+            return entry
+        return None
+
+    def _lock_for(self, base: str) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault(base, threading.Lock())
+
+    def _load_snapshot(self):
+        self._snapshot_loaded = True
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path) as f:
+                tables = json.load(f).get("tables", {})
+        except (OSError, ValueError):
+            return
+        for base, entry in tables.items():
+            self._tables.setdefault(base, entry)
+
+    def _save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        tmp = self.snapshot_path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"tables": self._tables}, f)
+            os.replace(tmp, self.snapshot_path)
+        except OSError:
+            pass
+
+    def _cached(self, base: str) -> Optional[dict]:
+        entry = self._fresh(base)
+        if not entry and not self._snapshot_loaded:
+            self._load_snapshot()
+            entry = self._fresh(base)
+        return entry["rates"] if entry else None
+
+    def _store(self, base: str, rates: dict) -> dict:
+        self._tables[base] = {"as_of": time.time(), "rates": rates}
+        self._failures.pop(base, None)
+        self._save_snapshot()
+        return rates
+
+    def _stale(self, base: str, exc: Exception) -> dict:
+        # upstream down: serve the last good table, however old
+        stale = self._tables.get(base)
+        if not stale:
+            raise exc
+        return stale["rates"]
+
+    def _failed(self, base: str, exc: Exception) -> dict:
+        self._failures[base] = (time.time() + self.retry, exc)
+        return self._stale(base, exc)
+
+    def _backing_off(self, base: str) -> Optional[Exception]:
+        """The last fetch error while it is too soon to try upstream again, else None."""
+        failure = self._failures.get(base)
+        return failure[1] if failure and time.time() < failure[0] else None
+
+    def table(self, base: str) -> dict:
+        """Return the rate table for `base`, fetching at most once per TTL."""
+        entry = self._fresh(base)
+        if entry:
+            return entry["rates"]
+        with self._lock_for(base):
+            # another thread may have refreshed, or failed to, while we waited
+            rates = self._cached(base)
+            if rates is not None:
+                return rates
+            exc = self._backing_off(base)
+            if exc:
+                return self._stale(base, exc)
+            try:
+                return self._store(base, self.fetch(base))
+            except Exception as exc:
+                return self._failed(base, exc)
+
+    async def atable(self, base: str) -> dict:
+        """Async table(): concurrent misses on the event loop share one fetch."""
+        entry = self._fresh(base)
+        if entry:
+            return entry["rates"]
+        lock = self._alocks.setdefault(base, asyncio.Lock())
+        async with lock:
+            rates = self._cached(base)
+            if rates is not None:
+                return rates
+            exc = self._backing_off(base)
+            if exc:
+                return self._stale(base, exc)
+            try:
+                if self.afetch:
+                    fetched = await self.afetch(base)
+                else:
+                    fetched = await run_in_threadpool(self.fetch, base)
+                return self._store(base, fetched)
+            except Exception as exc:
+                return self._failed(base, exc)
+
+    def as_of(self, base: str) -> Optional[float]:
+        entry = self._tables.get(base)
+        return entry["as_of"] if entry else None
+
+    def _cross(self, base: str, quote: str) -> Optional[Tuple[float, float]]:
+        for cached in (base, quote, self.pivot):
+            entry = self._fresh(cached)
+            if entry and base in entry["rates"] and quote in entry["rates"]:
+                return entry["rates"][quote] / entry["rates"][base], entry["as_of"]
+        return None
+
+    def _pivot_quote(self, table: dict, base: str, quote: str) -> Optional[Tuple[float, float]]:
+        if base not in table or quote not in table:
+            return None
+        return table[quote] / table[base], self.as_of(self.pivot)
+
+    def quote(self, base: str, quote: str) -> Optional[Tuple[float, float]]:
+        """(units of `quote` per 1 `base`, as-of epoch seconds of the table it came from)."""
+        if base == quote:
+            return 1.0, time.time()
+        return self._cross(base, quote) or self._pivot_quote(self.table(self.pivot), base, quote)
+
+    async def aquote(self, base: str, quote: str) -> Optional[Tuple[float, float]]:
+        if base == quote:
+            return 1.0, time.time()
+        return self._cross(base, quote) or self._pivot_quote(await self.atable(self.pivot), base, quote)
+
+    def get_rate(self, base: str, quote: str) -> Optional[float]:
+        """Units of `quote` per 1 `base`, cross-computed from a single table."""
+        q = self.quote(base, quote)
+        return q[0] if q else None
+
+    async def aget_rate(self, base: str, quote: str) -> Optional[float]:
+        q = await self.aquote(base, quote)
+        return q[0] if q else None
+
+    def clear(self):
+        self._tables.clear()
+        self._failures.clear()
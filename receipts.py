@@ -0,0 +1,316 @@
+"""Receipt OCR pipeline.
+
+Uploads are stored once under RECEIPTS_DIR, addressed by their SHA-256, and
+tracked as ReceiptJob rows owned by the uploader's company; re-uploading the
+same bytes within that company returns the existing job and its cached parse,
+and other companies never see it. Parsing runs on a process pool so a slow OCR pass
+never blocks a request worker: the endpoint answers with a job id to poll
+(or POSTs the result to a callback URL when the job finishes). Uploads need
+a login and are capped per user; callbacks only go to OCR_CALLBACK_HOSTS or,
+without that list, to hosts resolving to public addresses. A failed job is
+retried when the same file is uploaded again. A process runs a job only after
+claiming it (status "running" with a lease of OCR_JOB_LEASE seconds), so
+workers resuming jobs at startup never run one twice; a job whose process
+died is picked up again once its lease runs out.
+
+OCR engines are pluggable (OCR_ENGINE): `mock` returns a fixed receipt and
+`tesseract` downscales and cleans the image with Pillow before running
+pytesseract. Both feed their text through parse_receipt_text, whose amount,
+currency and date become a ready-to-submit expense draft.
+"""
+import hashlib
+import ipaddress
+import json
+import logging
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Deque, Dict, Optional
+from urllib.parse import urlsplit
+
+from sqlalchemy import or_, update
+from sqlmodel import select
+
+from db import get_session
+from models import ReceiptJob
+
+log = logging.getLogger(__name__)
+
+RECEIPTS_DIR = os.environ.get("RECEIPTS_DIR") or "./receipts"
+OCR_ENGINE = os.environ.get("OCR_ENGINE", "mock")
+# 0 runs jobs on a single background thread instead of a process pool
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", "2"))
+OCR_MAX_BYTES = int(os.environ.get("OCR_MAX_BYTES", str(10 * 1024 * 1024)))
+# longest image side fed to OCR; larger scans are downscaled first
+OCR_MAX_SIDE = int(os.environ.get("OCR_MAX_SIDE", "2000"))
+# uploads per user per minute, per process
+OCR_UPLOADS_PER_MINUTE = int(os.environ.get("OCR_UPLOADS_PER_MINUTE", "30"))
+# how long a claimed job may take, queueing on the pool included, before another process may run it
+OCR_JOB_LEASE = float(os.environ.get("OCR_JOB_LEASE", "900"))
+# comma-separated hosts callbacks may go to; when empty, any host with only public addresses
+OCR_CALLBACK_HOSTS = {h.strip().lower() for h in os.environ.get("OCR_CALLBACK_HOSTS", "").split(",") if h.strip()}
+
+
+class OcrEngine:
+    name = "base"
+
+    def extract_text(self, path: str) -> str:
+        raise NotImplementedError
+
+
+class MockEngine(OcrEngine):
+    name = "mock"
+
+    def extract_text(self, path: str) -> str:
+        return f"Lunch 42.50\nTOTAL USD 42.50\n{date.today().isoformat()}\n"
+
+
+class TesseractEngine(OcrEngine):
+    name = "tesseract"
+
+    def preprocess(self, path: str):
+        from PIL import Image, ImageOps
+        img = Image.open(path)
+        img = ImageOps.exif_transpose(img).convert("L")
+        if max(img.size) > OCR_MAX_SIDE:
+            img.thumbnail((OCR_MAX_SIDE, OCR_MAX_SIDE))
+        return ImageOps.autocontrast(img)
+
+    def extract_text(self, path: str) -> str:
+        import pytesseract
+        return pytesseract.image_to_string(self.preprocess(path))
+
+
+ENGINES: Dict[str, type] = {"mock": MockEngine, "tesseract": TesseractEngine}
+
+CURRENCY_SYMBOLS = {"$": "USD", "€": "EUR", "£": "GBP", "₹": "INR", "¥": "JPY"}
+CURRENCY_CODES = {"USD", "EUR", "GBP", "INR", "JPY", "AUD", "CAD", "CHF", "SGD", "AED"}
+_MONEY = r"(\d{1,3}(?:[,\s]\d{3})*(?:[.,]\d{2})|\d+[.,]\d{2})"
+_TOTAL_RE = re.compile(r"(?i)\b(?:grand\s+)?total\b[^\d\n]*" + _MONEY)
+_LINE_RE = re.compile(r"^\s*([A-Za-z][^\d\n]*?)\s+[^\d\n]*?" + _MONEY + r"\s*$")
+_ISO_DATE_RE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+_DMY_DATE_RE = re.compile(r"\b(\d{1,2})[/.-](\d{1,2})[/.-](\d{2,4})\b")
+
+
+def _money(s: str) -> float:
+    s = s.replace(" ", "")
+    # "1,234.56" or "1.234,56": the last separator is the decimal point
+    if "," in s and s.rfind(",") > s.rfind("."):
+        s = s.replace(".", "").replace(",", ".")
+    return float(s.replace(",", ""))
+
+
+def _date(text: str) -> Optional[str]:
+    m = _ISO_DATE_RE.search(text)
+    if m:
+        try:
+            return date(int(m[1]), int(m[2]), int(m[3])).isoformat()
+        except ValueError:
+            pass
+    m = _DMY_DATE_RE.search(text)
+    if m:
+        a, b, y = int(m[1]), int(m[2]), int(m[3])
+        y += 2000 if y < 100 else 0
+        # day-first unless that is impossible
+        for d, mo in ((a, b), (b, a)):
+            try:
+                return date(y, mo, d).isoformat()
+            except ValueError:
+                continue
+    return None
+
+
+def parse_receipt_text(text: str) -> dict:
+    lines = []
+    for raw in text.splitlines():
+        m = _LINE_RE.match(raw)
+        if m and not re.match(r"(?i)\s*(grand\s+)?(sub)?total\b", m[1]):
+            lines.append({"label": m[1].strip(), "amount": _money(m[2])})
+    total = _TOTAL_RE.search(text)
+    if total:
+        amount = _money(total[1])
+    else:
+        amounts = [_money(a) for a in re.findall(_MONEY, text)]
+        amount = max(amounts) if amounts else None
+    currency = next((code for sym, code in CURRENCY_SYMBOLS.items() if sym in text), None)
+    if not currency:
+        currency = next((c for c in re.findall(r"\b[A-Z]{3}\b", text) if c in CURRENCY_CODES), None)
+    return {"amount": amount, "currency": currency, "date": _date(text), "lines": lines}
+
+
+def run_ocr(engine_name: str, path: str) -> dict:
+    """Worker entry point: OCR one stored image and parse it."""
+    return parse_receipt_text(ENGINES[engine_name]().extract_text(path))
+
+
+def expense_draft(parsed: dict) -> dict:
+    """Body for POST /expenses pre-filled from a parse; the client adds submitter_id."""
+    return {
+        "amount": parsed.get("amount"),
+        "currency": parsed.get("currency"),
+        "date_": parsed.get("date"),
+        "description": ", ".join(l["label"] for l in parsed.get("lines", [])) or None,
+    }
+
+
+def store_upload(chunks) -> tuple:
+    """Write an upload to content-addressed storage; returns (sha256, path, size)."""
+    os.makedirs(RECEIPTS_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=RECEIPTS_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                size += len(chunk)
+                if size > OCR_MAX_BYTES:
+                    raise ValueError(f"receipt larger than {OCR_MAX_BYTES} bytes")
+                digest.update(chunk)
+                f.write(chunk)
+        sha = digest.hexdigest()
+        path = receipt_path(sha)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(tmp)
+        else:
+            os.replace(tmp, path)
+        return sha, path, size
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def check_callback(url: str) -> str:
+    """Return `url` if results may be POSTed there, else raise ValueError. Blocks on DNS."""
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError("callback_url must be an http(s) URL")
+    host = parts.hostname.lower()
+    if OCR_CALLBACK_HOSTS:
+        if host not in OCR_CALLBACK_HOSTS:
+            raise ValueError(f"callback host {host} is not allowed")
+        return url
+    try:
+        infos = socket.getaddrinfo(host, parts.port or 443, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError):
+        raise ValueError(f"callback host {host} does not resolve")
+    for info in infos:
+        addr = ipaddress.ip_address(info[4][0].split("%")[0])
+        # no loopback, private, link-local (cloud metadata), reserved or multicast targets
+        if not addr.is_global or addr.is_multicast:
+            raise ValueError(f"callback host {host} is not a public address")
+    return url
+
+
+_uploads: Dict[int, Deque[float]] = {}
+_uploads_lock = threading.Lock()
+
+
+def upload_wait(user_id: int, now: Optional[float] = None) -> float:
+    """Record an upload by `user_id` and return 0, or the seconds until they may upload again."""
+    now = time.monotonic() if now is None else now
+    with _uploads_lock:
+        recent = _uploads.setdefault(user_id, deque())
+        while recent and recent[0] <= now - 60:
+            recent.popleft()
+        if len(recent) >= OCR_UPLOADS_PER_MINUTE:
+            return recent[0] + 60 - now if recent else 60.0
+        recent.append(now)
+        return 0.0
+
+
+def receipt_path(sha: str) -> str:
+    return os.path.join(RECEIPTS_DIR, sha[:2], sha)
+
+
+_executor: Optional[Executor] = None
+_executor_lock = threading.Lock()
+
+
+def _pool() -> Executor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(max_workers=OCR_WORKERS) if OCR_WORKERS > 0 else ThreadPoolExecutor(max_workers=1)
+    return _executor
+
+
+def job_view(job: ReceiptJob) -> dict:
+    out = {"job_id": job.id, "status": job.status, "sha256": job.sha256}
+    if job.status == "done" and job.result:
+        parsed = json.loads(job.result)
+        out["result"] = parsed
+        out["expense_draft"] = expense_draft(parsed)
+    if job.error:
+        out["error"] = job.error
+    return out
+
+
+def _finish(job_id: int, future):
+    try:
+        parsed, error = future.result(), None
+    except Exception as e:
+        parsed, error = None, f"{e.__class__.__name__}: {e}"
+    with get_session() as s:
+        job = s.get(ReceiptJob, job_id)
+        if not job:
+            return
+        job.status = "failed" if error else "done"
+        job.result = json.dumps(parsed) if parsed is not None else None
+        job.error = error
+        job.finished_at = datetime.utcnow()
+        s.add(job)
+        s.commit()
+        s.refresh(job)
+        view, callback = job_view(job), job.callback_url
+    if callback:
+        try:
+            from http_client import get_client
+            # checked again: the name may resolve elsewhere by now
+            get_client().post(check_callback(callback), json=view)
+        except Exception:
+            log.warning("receipt job %s: callback to %s failed", job_id, callback, exc_info=True)
+
+
+def enqueue(job_id: int, sha: str, engine: str = OCR_ENGINE):
+    future = _pool().submit(run_ocr, engine, receipt_path(sha))
+    future.add_done_callback(lambda f: _finish(job_id, f))
+
+
+def lease_until() -> datetime:
+    return datetime.utcnow() + timedelta(seconds=OCR_JOB_LEASE)
+
+
+def _claimable(now: datetime):
+    return or_(ReceiptJob.status == "queued", (ReceiptJob.status == "running") & (ReceiptJob.lease_until < now))
+
+
+def resume_pending():
+    """Claim and requeue jobs left queued, or running past their lease, by another process."""
+    now = datetime.utcnow()
+    with get_session() as s:
+        pending = s.exec(select(ReceiptJob.id, ReceiptJob.sha256).where(_claimable(now))).all()
+    for job_id, sha in pending:
+        with get_session() as s:
+            # conditional: of several workers starting together, one claims each job
+            claimed = s.execute(update(ReceiptJob).where(ReceiptJob.id == job_id).where(_claimable(now))
+                                .values(status="running", lease_until=lease_until())).rowcount
+            s.commit()
+        if claimed:
+            enqueue(job_id, sha)
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
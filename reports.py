@@ -0,0 +1,114 @@
+"""Company expense reports.
+
+ExpenseSummary holds running (count, total) per company for each reporting
+dimension. submit_expense, the bulk endpoint and make_decision apply deltas
+in the same transaction as the expense change, so a report is one indexed
+read of O(groups) rows. `python reports.py --rebuild [company_id]` recomputes
+the table from Expense for backfills or repairs.
+"""
+import sys
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import text
+from sqlmodel import select
+
+from models import ExpenseSummary
+
+DIMENSIONS = ("category", "month", "status", "submitter")
+
+
+def _month(d) -> str:
+    # raw SQL on SQLite hands back dates as 'YYYY-MM-DD' strings
+    return str(d)[:7] if d else ''
+
+
+def expense_deltas(company_id: int, submitter_id: int, category: Optional[str], d: Optional[date],
+                   status: str, amount: float, sign: int = 1) -> List[dict]:
+    keys = {"category": category or '', "month": _month(d), "status": status, "submitter": str(submitter_id)}
+    return [{"company_id": company_id, "dimension": dim, "key": keys[dim], "count": sign, "total": sign * amount}
+            for dim in DIMENSIONS]
+
+
+def status_deltas(company_id: int, old: str, new: str, amount: float) -> List[dict]:
+    if old == new:
+        return []
+    return [
+        {"company_id": company_id, "dimension": "status", "key": old, "count": -1, "total": -amount},
+        {"company_id": company_id, "dimension": "status", "key": new, "count": 1, "total": amount},
+    ]
+
+
+def merge(deltas: Iterable[dict]) -> List[dict]:
+    """Collapse deltas for the same group so a batch issues one upsert per group."""
+    acc: Dict[tuple, list] = defaultdict(lambda: [0, 0.0])
+    for d in deltas:
+        slot = acc[(d["company_id"], d["dimension"], d["key"])]
+        slot[0] += d["count"]
+        slot[1] += d["total"]
+    return [{"company_id": c, "dimension": dim, "key": k, "count": n, "total": t} for (c, dim, k), (n, t) in acc.items()]
+
+
+def _upsert(dialect: str):
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    table = ExpenseSummary.__table__
+    stmt = insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=["company_id", "dimension", "key"],
+        set_={"count": table.c.count + stmt.excluded.count, "total": table.c.total + stmt.excluded.total},
+    )
+
+
+def apply_deltas(session, deltas: List[dict]):
+    """Add deltas to the summary inside the caller's transaction (sync Session or Connection)."""
+    if not deltas:
+        return
+    bind = session.get_bind() if hasattr(session, "get_bind") else session
+    session.execute(_upsert(bind.dialect.name), deltas)
+
+
+def company_report(session, company_id: int) -> dict:
+    rows = session.exec(select(ExpenseSummary).where(ExpenseSummary.company_id == company_id)).all()
+    out = {f"by_{dim}": [] for dim in DIMENSIONS}
+    for r in rows:
+        if r.count:
+            out[f"by_{r.dimension}"].append({"key": r.key or None, "count": r.count, "total": r.total})
+    for groups in out.values():
+        groups.sort(key=lambda g: g["key"] or '')
+    return out
+
+
+def rebuild(conn, company_id: Optional[int] = None) -> int:
+    """Recompute the summary from Expense; returns the number of groups written."""
+    where = " WHERE company_id = :c" if company_id is not None else ""
+    params = {"c": company_id}
+    conn.execute(text("DELETE FROM expensesummary" + where), params)
+    deltas = []
+    for dim, col in (("category", "category"), ("status", "status"), ("submitter", "submitter_id"), ("month", "date")):
+        rows = conn.execute(text(
+            f"SELECT company_id, {col}, COUNT(*), COALESCE(SUM(amount_company_currency), 0) FROM expense{where} "
+            f"GROUP BY company_id, {col}"
+        ), params).fetchall()
+        for cid, value, count, total in rows:
+            key = _month(value) if dim == "month" else ('' if value is None else str(value))
+            deltas.append({"company_id": cid, "dimension": dim, "key": key, "count": count, "total": float(total)})
+    # days fold into months here, so merge before writing
+    deltas = merge(deltas)
+    apply_deltas(conn, deltas)
+    return len(deltas)
+
+
+if __name__ == "__main__":
+    if "--rebuild" not in sys.argv:
+        sys.exit("usage: python reports.py --rebuild [company_id]")
+    import models  # noqa: F401  registers the tables for create_all
+    from db import engine, init_db
+    init_db()
+    args = [a for a in sys.argv[1:] if a != "--rebuild"]
+    with engine.begin() as conn:
+        groups = rebuild(conn, int(args[0]) if args else None)
+    print(f"rebuilt {groups} summary groups")
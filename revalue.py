@@ -0,0 +1,193 @@
+"""Batch re-valuation of expenses into company currency.
+
+Re-prices stored expenses at new rates: after fixing a bad rate (--rate, which
+limits the run to the pairs given), for rows saved before rates were recorded
+(--missing), or to re-report a company in another currency (--company with
+--currency). Expenses are read by id in REVALUE_CHUNK-row columnar chunks
+(NumPy arrays), grouped by currency pair, converted with one vectorised
+multiply per pair and written back with one executemany UPDATE per chunk, each
+chunk in its own transaction. Rows already at the right amount, rate and as-of
+date are not rewritten. Report summaries of the companies touched are rebuilt
+at the end.
+
+    python revalue.py --rate EUR:INR=90.25 --as-of 2024-03-31 --from 2024-01-01 --to 2024-12-31
+    python revalue.py --missing
+    python revalue.py --company 3 --currency USD
+
+Rates not given with --rate come from the rate provider (live with USE_EXTERNAL=1).
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import repeat
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import and_, or_, select, update
+
+import money
+from models import Company, Expense
+from reports import rebuild
+
+log = logging.getLogger(__name__)
+
+REVALUE_CHUNK = int(os.environ.get("REVALUE_CHUNK", "50000"))
+
+# (rate as target per source, date of the rate)
+Quote = Tuple[Decimal, Optional[date]]
+
+
+def convert_many(minor, rate: Decimal, source: str, target: str):
+    """Vectorised money.convert over an int64 array, with the same rounding."""
+    scaled = minor.astype(np.float64) * float(rate.scaleb(money.exponent(target) - money.exponent(source)))
+    magnitude = np.abs(scaled)
+    out = (np.sign(scaled) * np.floor(magnitude + 0.5)).astype(np.int64)
+    # float64 only matters right at a rounding boundary; settle those rows in Decimal
+    edge = np.abs(magnitude - np.floor(magnitude) - 0.5) <= magnitude * 1e-12 + 1e-9
+    for i in np.flatnonzero(edge):
+        out[i] = money.convert(int(minor[i]), rate, source, target)
+    return out
+
+
+def provider_quotes(provider) -> Callable[[str, str], Optional[Quote]]:
+    """Adapt RateProvider.quote (float rate, epoch seconds) to exact Quotes."""
+    def quote(source: str, target: str) -> Optional[Quote]:
+        q = provider.quote(source, target)
+        return None if q is None else (money.rate_decimal(q[0]), date.fromtimestamp(q[1]))
+    return quote
+
+
+def revalue(engine, quote: Callable[[str, str], Optional[Quote]], company_id: Optional[int] = None,
+            date_from: Optional[date] = None, date_to: Optional[date] = None, pairs=None, missing: bool = False,
+            chunk: int = REVALUE_CHUNK) -> dict:
+    """Re-price matching expenses at `quote(source, target)`; `pairs` limits the run to those
+    (source, target) currency pairs. Returns row counts and timing."""
+    exp, comp = Expense.__table__, Company.__table__
+    base = (select(exp.c.id, exp.c.company_id, exp.c.amount_minor, exp.c.currency, comp.c.currency,
+                   exp.c.amount_company_minor, exp.c.fx_rate, exp.c.fx_as_of)
+            .join_from(exp, comp, comp.c.id == exp.c.company_id)
+            .where(exp.c.amount_minor.is_not(None)))
+    if company_id is not None:
+        base = base.where(exp.c.company_id == company_id)
+    if date_from is not None:
+        base = base.where(exp.c.date >= date_from)
+    if date_to is not None:
+        base = base.where(exp.c.date <= date_to)
+    if pairs:
+        base = base.where(or_(*[and_(exp.c.currency == s, comp.c.currency == t) for s, t in pairs]))
+    if missing:
+        base = base.where(exp.c.fx_rate.is_(None))
+    # straight to the driver: SQLAlchemy's per-row parameter processing costs several times the UPDATE itself
+    ph = "?" if engine.dialect.paramstyle == "qmark" else "%s"
+    stmt = (f"UPDATE expense SET amount_company_minor = {ph}, amount_company_currency = {ph}, fx_rate = {ph}, "
+            f"fx_as_of = {ph}, version = version + 1, updated_at = {ph} WHERE id = {ph}")
+
+    quotes: Dict[str, Optional[Quote]] = {}
+    stats = {"rows": 0, "changed": 0, "unpriced": 0}
+    touched = set()
+    started, after = time.perf_counter(), 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(base.where(exp.c.id > after).order_by(exp.c.id).limit(chunk)).all()
+            if not rows:
+                break
+            after = rows[-1][0]
+            ids, companies, amounts, sources, targets, old_minor, old_rate, old_as_of = zip(*rows)
+            n = len(rows)
+            amounts = np.fromiter(amounts, np.int64, n)
+            old_minor = np.array(old_minor, dtype=np.float64)  # NULL -> nan, never equal
+            old_rate, old_as_of = np.array(old_rate, dtype=object), np.array(old_as_of, dtype=object)
+            keys, inverse = np.unique(np.array([f"{s}>{t}" for s, t in zip(sources, targets)]), return_inverse=True)
+
+            new_minor, new_float = np.zeros(n, np.int64), np.zeros(n, np.float64)
+            new_rate, new_as_of = np.empty(n, dtype=object), np.empty(n, dtype=object)
+            # the same values as text, as the columns store them
+            rate_text, as_of_text = np.empty(n, dtype=object), np.empty(n, dtype=object)
+            priced = np.zeros(n, dtype=bool)
+            for k, key in enumerate(keys):
+                if key not in quotes:
+                    quotes[key] = quote(*key.split(">"))
+                mask = inverse == k
+                if quotes[key] is None:
+                    stats["unpriced"] += int(mask.sum())
+                    continue
+                source, target = key.split(">")
+                rate, as_of = quotes[key]
+                new_minor[mask] = convert_many(amounts[mask], rate, source, target)
+                # minor / 10**e rounds exactly like float(Decimal), so the mirror matches money.to_float
+                new_float[mask] = new_minor[mask] / 10 ** money.exponent(target)
+                new_rate[mask], new_as_of[mask], priced[mask] = rate, as_of, True
+                rate_text[mask], as_of_text[mask] = str(rate), as_of.isoformat() if as_of else None
+
+            changed = np.flatnonzero(priced & ((new_minor != old_minor) | (new_rate != old_rate) | (new_as_of != old_as_of)))
+            if changed.size:
+                now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")
+                conn.exec_driver_sql(stmt, list(zip(
+                    new_minor[changed].tolist(), new_float[changed].tolist(), rate_text[changed].tolist(),
+                    as_of_text[changed].tolist(), repeat(now), np.array(ids)[changed].tolist())))
+                touched.update(np.unique(np.array(companies)[changed]).tolist())
+            stats["rows"] += n
+            stats["changed"] += int(changed.size)
+        log.info("revalued through expense %s: %d rows, %d changed", after, stats["rows"], stats["changed"])
+    if touched:
+        with engine.begin() as conn:
+            for cid in sorted(touched):
+                rebuild(conn, cid)
+    stats["companies"] = len(touched)
+    stats["seconds"] = round(time.perf_counter() - started, 3)
+    return stats
+
+
+def set_company_currency(engine, company_id: int, currency: str):
+    """Switch a company's reporting currency; revalue() then re-prices its expenses into it."""
+    import bus
+    table = Company.__table__
+    with engine.begin() as conn:
+        if not conn.execute(update(table).where(table.c.id == company_id).values(currency=currency)).rowcount:
+            raise ValueError(f"company {company_id} not found")
+    bus.publish("company", company_id)
+
+
+def _parse_rate(spec: str) -> Tuple[Tuple[str, str], Decimal]:
+    pair, _, rate = spec.partition("=")
+    source, _, target = pair.partition(":")
+    if not (source and target and rate):
+        raise argparse.ArgumentTypeError(f"expected SRC:DST=RATE, got {spec!r}")
+    return (source.upper(), target.upper()), Decimal(rate)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--rate", action="append", type=_parse_rate, default=[], metavar="SRC:DST=RATE",
+                   help="re-price only these pairs at these rates (repeatable)")
+    p.add_argument("--as-of", type=date.fromisoformat, default=date.today(), help="date recorded with --rate rates")
+    p.add_argument("--company", type=int)
+    p.add_argument("--currency", help="re-report --company in this currency")
+    p.add_argument("--from", dest="date_from", type=date.fromisoformat)
+    p.add_argument("--to", dest="date_to", type=date.fromisoformat)
+    p.add_argument("--missing", action="store_true", help="only expenses saved without a rate")
+    args = p.parse_args()
+    if args.currency and args.company is None:
+        p.error("--currency needs --company")
+
+    from db import engine, init_db
+    init_db()
+    if args.rate:
+        overrides = dict(args.rate)
+
+        def quote(source, target):
+            return (overrides[(source, target)], args.as_of) if (source, target) in overrides else None
+    else:
+        from rates import RATES_SNAPSHOT, RateProvider, fetch_rates, mock_rates
+        external = os.environ.get("USE_EXTERNAL") == "1"
+        quote = provider_quotes(RateProvider(fetch=fetch_rates if external else mock_rates,
+                                             snapshot_path=RATES_SNAPSHOT if external else None))
+    if args.currency:
+        set_company_currency(engine, args.company, args.currency.upper())
+    stats = revalue(engine, quote, args.company, args.date_from, args.date_to, pairs=list(dict(args.rate)), missing=args.missing)
+    print(json.dumps(stats))
@@ -0,0 +1,313 @@
+"""Background jobs for the approval workflow.
+
+An asyncio loop in each worker process competes for a lease row in
+`schedulerlock`; only the holder runs jobs, so a multi-worker deployment
+runs each job once. Jobs run in a thread with sync sessions and walk their
+rows by keyset in SCHEDULER_CHUNK-sized, separately committed batches over
+indexed columns, so none of them holds a long transaction or scans a table.
+When each job is next due is kept in `schedulerlock` too ("job:<name>" rows),
+so a restart or a new leader does not run everything again at once. The
+leader renews its lease between chunks, and a job stops at the next chunk
+once the lease has passed to another worker, so two never run side by side.
+
+  escalate  steps whose turn came more than APPROVAL_SLA_HOURS ago and have
+            seen no activity are handed to the approver's manager (or a
+            company admin) not already on the expense, at most
+            ESCALATION_MAX_LEVELS times
+  remind    one digest per approver with open steps: how many, and the oldest;
+            logged, and POSTed to REMINDER_WEBHOOK_URL when set
+  rules     pending expenses are re-evaluated against their company's current
+            ApprovalRule, so rule changes settle in-flight expenses
+  housekeeping  expired idempotency keys and old cache-bus events are deleted
+"""
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import exists, func, insert, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+from sqlalchemy.orm.exc import StaleDataError
+from sqlmodel import select
+
+import bus
+import idempotency
+import orgchart
+from approvals import evaluate, get_rule
+from db import engine, get_session
+from models import ApprovalStep, Expense, SchedulerLock, User
+from pagination import keyset_after
+from reports import apply_deltas, merge, status_deltas
+
+log = logging.getLogger(__name__)
+
+SCHEDULER_ENABLED = os.environ.get("SCHEDULER_ENABLED", "1") == "1"
+# seconds between leader checks; the lease lasts three ticks so one missed renewal is harmless
+SCHEDULER_TICK = float(os.environ.get("SCHEDULER_TICK", "30"))
+SCHEDULER_CHUNK = int(os.environ.get("SCHEDULER_CHUNK", "500"))
+APPROVAL_SLA_HOURS = float(os.environ.get("APPROVAL_SLA_HOURS", "48"))
+ESCALATION_MAX_LEVELS = int(os.environ.get("ESCALATION_MAX_LEVELS", "2"))
+ESCALATE_EVERY = float(os.environ.get("ESCALATE_EVERY", "900"))
+REMIND_EVERY = float(os.environ.get("REMIND_EVERY", str(24 * 3600)))
+RULES_EVERY = float(os.environ.get("RULES_EVERY", "600"))
+HOUSEKEEPING_EVERY = float(os.environ.get("HOUSEKEEPING_EVERY", "3600"))
+REMINDER_WEBHOOK_URL = os.environ.get("REMINDER_WEBHOOK_URL")
+
+LOCK_NAME = "scheduler"
+JOB_PREFIX = "job:"
+
+
+def _always() -> bool:
+    return True
+
+
+def _active_open_steps():
+    """Open steps on pending expenses whose turn has come (no earlier step still open)."""
+    earlier = aliased(ApprovalStep)
+    waiting = exists().where(earlier.expense_id == ApprovalStep.expense_id).where(earlier.completed == False).where(earlier.sequence < ApprovalStep.sequence)
+    return (select(ApprovalStep, Expense.company_id)
+            .join(Expense, Expense.id == ApprovalStep.expense_id)
+            .where(ApprovalStep.completed == False)
+            .where(Expense.status == 'pending')
+            .where(~waiting))
+
+
+def escalate(now: Optional[datetime] = None, chunk: int = SCHEDULER_CHUNK, alive: Callable[[], bool] = _always) -> int:
+    """Reassign overdue steps one level up; returns how many were escalated."""
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(hours=APPROVAL_SLA_HOURS)
+    # any step of the expense touched since the cutoff (e.g. the previous approver deciding) restarts the clock
+    recent = aliased(ApprovalStep)
+    touched = exists().where(recent.expense_id == ApprovalStep.expense_id).where(recent.updated_at >= cutoff)
+    eligible = (_active_open_steps()
+                .where(ApprovalStep.escalation_level < ESCALATION_MAX_LEVELS)
+                .where(~touched))
+    # candidates are a range of ix_approvalstep_open_age, so a chunk reads `chunk` index
+    # entries however many expenses are pending; the joins then only see those steps
+    table = ApprovalStep.__table__
+    keys = (table.c.updated_at, table.c.id)
+    candidates = select(*keys).where(table.c.completed == False).where(table.c.updated_at < cutoff)
+    after, moved = None, 0
+    # `alive` is checked before every chunk: False means the scheduler lost its lease
+    while alive():
+        q = candidates if after is None else candidates.where(keyset_after(keys, after))
+        with get_session() as s:
+            page = s.execute(q.order_by(*keys).limit(chunk)).all()
+            if not page:
+                return moved
+            after = list(page[-1])
+            rows = s.exec(eligible.where(ApprovalStep.id.in_([r.id for r in page]))).all()
+            # everyone already on each expense, decided or not, so nobody gets a second step
+            taken: Dict[int, set] = {}
+            for expense_id, approver_id in s.exec(select(ApprovalStep.expense_id, ApprovalStep.approver_id)
+                                                  .where(ApprovalStep.expense_id.in_({st.expense_id for st, _ in rows}))):
+                taken.setdefault(expense_id, set()).add(approver_id)
+            for step, company_id in rows:
+                tree = orgchart.get_tree(s, company_id)
+                on_expense = taken.setdefault(step.expense_id, {step.approver_id})
+                target = next((m for m in tree.managers_above(step.approver_id, len(on_expense) + 1) if m not in on_expense), None)
+                if target is None:
+                    target = next((a for a in tree.admins if a not in on_expense), None)
+                if target is None:
+                    # nobody above: stop looking at this step
+                    step.escalation_level = ESCALATION_MAX_LEVELS
+                else:
+                    log.info("escalating step %s of expense %s from user %s to %s", step.id, step.expense_id, step.approver_id, target)
+                    step.approver_id = target
+                    step.escalation_level += 1
+                    on_expense.add(target)
+                    moved += 1
+                s.add(step)
+            s.commit()
+    return moved
+
+
+def notify(digest: dict):
+    log.info("reminder for %s: %d approvals waiting, oldest since %s", digest["email"], digest["pending"], digest["oldest"])
+    if REMINDER_WEBHOOK_URL:
+        from http_client import get_client
+        try:
+            get_client().post(REMINDER_WEBHOOK_URL, json=digest)
+        except Exception:
+            log.warning("reminder webhook failed for user %s", digest["user_id"], exc_info=True)
+
+
+def remind(chunk: int = SCHEDULER_CHUNK, send: Callable[[dict], None] = notify, alive: Callable[[], bool] = _always) -> int:
+    """Send one digest per approver with waiting steps; returns the number of digests."""
+    table = ApprovalStep.__table__
+    # the next approvers with open steps are a range of ix_approvalstep_open_approver;
+    # only their steps are joined and counted
+    after, sent = 0, 0
+    # `alive` is checked before every chunk: False means the scheduler lost its lease
+    while alive():
+        with get_session() as s:
+            ids = s.execute(select(table.c.approver_id).where(table.c.approver_id > after).where(table.c.completed == False)
+                            .group_by(table.c.approver_id).order_by(table.c.approver_id).limit(chunk)).scalars().all()
+            if not ids:
+                return sent
+            after = ids[-1]
+            active = _active_open_steps().where(ApprovalStep.approver_id.in_(ids)).subquery()
+            rows = s.exec(select(active.c.approver_id, func.count(), func.min(active.c.updated_at))
+                          .group_by(active.c.approver_id).order_by(active.c.approver_id)).all()
+            emails = dict(s.exec(select(User.id, User.email).where(User.id.in_([r[0] for r in rows]))).all())
+        for approver_id, count, oldest in rows:
+            send({"user_id": approver_id, "email": emails.get(approver_id), "pending": count,
+                  "oldest": oldest.isoformat() if oldest else None})
+            sent += 1
+    return sent
+
+
+def apply_rules(chunk: int = SCHEDULER_CHUNK, alive: Callable[[], bool] = _always) -> int:
+    """Settle pending expenses that their company's current rule already decides; returns how many changed."""
+    after, changed = 0, 0
+    # `alive` is checked before every chunk: False means the scheduler lost its lease
+    while alive():
+        with get_session() as s:
+            expenses = s.exec(select(Expense).where(Expense.status == 'pending').where(Expense.id > after)
+                              .order_by(Expense.id).limit(chunk)).all()
+            if not expenses:
+                return changed
+            deltas = []
+            for expense in expenses:
+                status, reason = evaluate(expense, get_rule(s, expense.company_id))
+                if status != 'pending':
+                    deltas.extend(status_deltas(expense.company_id, expense.status, status, expense.amount_company_currency))
+                    expense.status = status
+                    s.add(expense)
+                    changed += 1
+            after = expenses[-1].id
+            try:
+                apply_deltas(s, merge(deltas))
+                s.commit()
+            except StaleDataError:
+                # a decision landed mid-chunk; the next run re-reads these expenses
+                s.rollback()
+                log.info("rules job: chunk ending at expense %s changed concurrently, skipped", after)
+    return changed
+
+
+@dataclass
+class Job:
+    name: str
+    every: float
+    # called as run(alive=...); see escalate
+    run: Callable[..., int]
+
+
+def housekeeping(alive: Callable[[], bool] = _always) -> int:
+    """Drop expired idempotency keys and old cache bus events."""
+    return idempotency.prune() + bus.prune()
+
+
+def default_jobs() -> List[Job]:
+    return [Job("escalate", ESCALATE_EVERY, escalate), Job("remind", REMIND_EVERY, remind),
+            Job("rules", RULES_EVERY, apply_rules), Job("housekeeping", HOUSEKEEPING_EVERY, housekeeping)]
+
+
+@dataclass
+class Scheduler:
+    jobs: List[Job] = field(default_factory=default_jobs)
+    tick: float = SCHEDULER_TICK
+    owner: str = field(default_factory=lambda: f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}")
+    _task: Optional[asyncio.Task] = None
+    _stop: threading.Event = field(default_factory=threading.Event)
+    # monotonic time of the last successful acquire
+    _renewed: float = 0.0
+
+    def acquire(self, now: Optional[datetime] = None) -> bool:
+        """Take or renew the lease; True while this process is the leader."""
+        now = now or datetime.utcnow()
+        expires = now + timedelta(seconds=self.tick * 3)
+        table = SchedulerLock.__table__
+        with engine.begin() as conn:
+            taken = conn.execute(update(table).where(table.c.name == LOCK_NAME)
+                                 .where(or_(table.c.owner == self.owner, table.c.expires_at < now))
+                                 .values(owner=self.owner, expires_at=expires)).rowcount
+        if not taken:
+            try:
+                with engine.begin() as conn:
+                    conn.execute(insert(table).values(name=LOCK_NAME, owner=self.owner, expires_at=expires))
+            except IntegrityError:
+                return False
+        self._renewed = time.monotonic()
+        return True
+
+    def leading(self) -> bool:
+        """Between chunks of a job: renew the lease (at most once a tick); False once it is lost or on stop."""
+        if self._stop.is_set():
+            return False
+        if time.monotonic() - self._renewed < self.tick:
+            return True
+        if self.acquire():
+            return True
+        log.warning("scheduler lease lost to another worker; stopping the current job")
+        return False
+
+    def release(self):
+        table = SchedulerLock.__table__
+        with engine.begin() as conn:
+            conn.execute(update(table).where(table.c.name == LOCK_NAME).where(table.c.owner == self.owner)
+                         .values(expires_at=datetime.utcnow() - timedelta(seconds=1)))
+
+    def run_due(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Run every job whose interval has elapsed; returns {job: items processed}."""
+        now = now or datetime.utcnow()
+        table = SchedulerLock.__table__
+        with engine.connect() as conn:
+            due = dict(conn.execute(select(table.c.name, table.c.expires_at).where(table.c.name.like(JOB_PREFIX + "%"))).all())
+        done = {}
+        for job in self.jobs:
+            if not self.leading():
+                break
+            next_run = due.get(JOB_PREFIX + job.name)
+            if next_run and now < next_run:
+                continue
+            try:
+                done[job.name] = job.run(alive=self.leading)
+            except Exception:
+                log.exception("scheduled job %s failed", job.name)
+            if not self.leading():
+                # cut short: the new leader runs it again
+                break
+            # a failed run waits its interval too, rather than retrying every tick
+            self._ran(job, now)
+        return done
+
+    def _ran(self, job: Job, now: datetime):
+        table, name = SchedulerLock.__table__, JOB_PREFIX + job.name
+        values = {"owner": self.owner, "expires_at": now + timedelta(seconds=job.every)}
+        with engine.begin() as conn:
+            if conn.execute(update(table).where(table.c.name == name).values(**values)).rowcount:
+                return
+            conn.execute(insert(table).values(name=name, **values))
+
+    async def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if await asyncio.to_thread(self.acquire):
+                    await asyncio.to_thread(self.run_due)
+            except Exception:
+                log.exception("scheduler tick failed")
+            await asyncio.sleep(self.tick)
+
+    def start(self):
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            await asyncio.to_thread(self.release)
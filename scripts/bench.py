@@ -0,0 +1,357 @@
+"""Benchmark and load-test suite for the expense/approval API.
+
+Seeds a throwaway database (unless DATABASE_URL is set) with companies,
+manager chains and expenses, then runs
+
+  micro  timed sequential calls to /token, POST /expenses, the approval
+         decision, the pending inbox and the expense listing (TestClient)
+  load   a weighted mix of the same calls from N concurrent clients, either
+         in-process over ASGI or against a running server with --url
+  startup  boots the app in fresh interpreters and times import, startup
+         hooks and the first response, on an empty database (cold: schema
+         creation and seeding) and on an initialised one (warm)
+
+and writes latency percentiles and throughput as JSON. With --baseline the
+results are compared against a stored run and the script exits 1 when any
+latency grows (or throughput drops) by more than --tolerance.
+
+    python scripts/bench.py all --out bench.json --baseline scripts/bench_baseline.json
+    python scripts/bench.py load --url http://127.0.0.1:8000 --concurrency 32 --duration 30
+
+Against --url the server must share DATABASE_URL and SECRET_KEY with this
+script so it sees the seeded rows and accepts the generated tokens.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db"))
+
+import httpx  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from auth import create_access_token, get_password_hash  # noqa: E402
+from bulk import submit_batch  # noqa: E402
+from db import get_session, init_db  # noqa: E402
+from main import app, rate_provider  # noqa: E402
+from models import ApprovalRule, Company, User  # noqa: E402
+
+PASSWORD = "bench"
+CURRENCIES = ("USD", "EUR", "INR")
+CATEGORIES = ("travel", "meals", "office", "software", None)
+# latency metrics regress upwards, throughput downwards
+HIGHER_IS_WORSE = ("mean_ms", "p50_ms", "p95_ms", "p99_ms")
+LOWER_IS_WORSE = ("ops_per_s",)
+
+
+def seed(companies: int = 5, users: int = 50, expenses: int = 5000, depth: int = 3, rng=None) -> dict:
+    """Create companies with an admin, a `depth`-long manager chain and employees
+    reporting to random managers, then `expenses` pending expenses spread over
+    the employees. Returns the ids the benchmarks need."""
+    init_db()
+    rng = rng or random.Random(0)
+    tag = uuid.uuid4().hex[:6]
+    pwd_hash = get_password_hash(PASSWORD)  # one bcrypt for every seeded user
+    ctx = {"companies": [], "admins": [], "managers": [], "employees": [], "emails": []}
+    with get_session() as s:
+        for c in range(companies):
+            company = Company(name=f"Bench {tag} {c}", country="India", currency="INR")
+            s.add(company)
+            s.flush()
+            s.add(ApprovalRule(company_id=company.id, percentage_threshold=50, special_approver_ids=''))
+            admin = User(name="Admin", email=f"admin{c}-{tag}@bench.test", role="admin", company_id=company.id, password_hash=pwd_hash)
+            s.add(admin)
+            s.flush()
+            boss, managers = admin.id, []
+            for m in range(depth):
+                mgr = User(name=f"Manager {m}", email=f"mgr{c}-{m}-{tag}@bench.test", role="manager",
+                           company_id=company.id, manager_id=boss, password_hash=pwd_hash)
+                s.add(mgr)
+                s.flush()
+                boss = mgr.id
+                managers.append(mgr.id)
+            staff = [{"name": f"Employee {e}", "email": f"emp{c}-{e}-{tag}@bench.test", "role": "employee",
+                      "company_id": company.id, "manager_id": rng.choice(managers), "password_hash": pwd_hash}
+                     for e in range(users)]
+            s.bulk_insert_mappings(User, staff, return_defaults=True)
+            ctx["companies"].append(company.id)
+            ctx["admins"].append(admin.id)
+            ctx["managers"].extend(managers)
+            ctx["employees"].extend(u["id"] for u in staff)
+            ctx["emails"].extend(u["email"] for u in staff)
+        s.commit()
+    today = date.today()
+    rows = [{"submitter_id": rng.choice(ctx["employees"]), "amount": round(rng.uniform(1, 500), 2),
+             "currency": rng.choice(CURRENCIES), "category": rng.choice(CATEGORIES),
+             "date_": (today - timedelta(days=rng.randrange(365))).isoformat()} for _ in range(expenses)]
+    submit_batch(rows, rate_provider.quote)
+    ctx["admin_company"] = dict(zip(ctx["admins"], ctx["companies"]))
+    return ctx
+
+
+def summarize(samples: list, elapsed: float) -> dict:
+    """Latency percentiles (nearest rank) in ms and ops/s over `elapsed` seconds."""
+    xs = sorted(samples)
+    if not xs:
+        return {"n": 0}
+
+    def pct(p):
+        return round(xs[min(len(xs) - 1, max(0, int(round(p / 100 * len(xs))) - 1))] * 1000, 3)
+    return {"n": len(xs), "mean_ms": round(sum(xs) / len(xs) * 1000, 3), "p50_ms": pct(50), "p95_ms": pct(95),
+            "p99_ms": pct(99), "ops_per_s": round(len(xs) / elapsed, 1) if elapsed else None}
+
+
+def _headers(user_id: int, role: str = "admin") -> dict:
+    return {"Authorization": f"Bearer {create_access_token({'sub': str(user_id), 'user_id': user_id, 'role': role})}"}
+
+
+def _decision_queue(ctx: dict, n: int, rng) -> list:
+    """Expenses routed to a single admin so each decision call has work to do."""
+    picks = []
+    for _ in range(n):
+        i = rng.randrange(len(ctx["admins"]))
+        picks.append(ctx["admins"][i])
+    rows = [{"submitter_id": a, "amount": 10.0, "currency": "INR", "approver_ids": [a]} for a in picks]
+    return [(r["id"], a) for r, a in zip(submit_batch(rows, rate_provider.quote), picks)]
+
+
+def _requests(ctx: dict, rng) -> dict:
+    """name -> factory returning (method, url, kwargs) for one call."""
+    admin = ctx["admins"][0]
+    headers = _headers(admin)
+    return {
+        "token": lambda: ("POST", "/token", {"data": {"username": rng.choice(ctx["emails"]), "password": PASSWORD}}),
+        "submit_expense": lambda: ("POST", "/expenses", {"headers": headers, "json": {
+            "submitter_id": rng.choice(ctx["employees"]), "amount": round(rng.uniform(1, 500), 2),
+            "currency": rng.choice(CURRENCIES), "category": rng.choice(CATEGORIES)}}),
+        "pending_for_user": lambda: ("GET", f"/approvals/user/{rng.choice(ctx['managers'])}/pending", {"params": {"limit": 50}}),
+        "list_user_expenses": lambda: ("GET", f"/expenses/user/{rng.choice(ctx['employees'])}", {"params": {"limit": 50}}),
+    }
+
+
+def micro(ctx: dict, iterations: int = 200, token_iterations: int = 20, warmup: int = 5, seed_: int = 1) -> dict:
+    rng = random.Random(seed_)
+    factories = _requests(ctx, rng)
+    decisions = _decision_queue(ctx, iterations + warmup, rng)
+    results = {}
+    with TestClient(app) as client:
+        def timed(name, n, call):
+            for _ in range(warmup):
+                call()
+            samples = []
+            start = time.perf_counter()
+            for _ in range(n):
+                t = time.perf_counter()
+                resp = call()
+                samples.append(time.perf_counter() - t)
+                if resp.status_code >= 400:
+                    raise RuntimeError(f"{name}: HTTP {resp.status_code} {resp.text[:200]}")
+            results[name] = summarize(samples, time.perf_counter() - start)
+
+        for name, factory in factories.items():
+            def call(factory=factory):
+                method, url, kw = factory()
+                return client.request(method, url, **kw)
+            timed(name, token_iterations if name == "token" else iterations, call)
+
+        queue = iter(decisions)
+
+        def decide():
+            expense_id, admin = next(queue)
+            return client.post(f"/approvals/{expense_id}/decision", headers=_headers(admin),
+                               json={"approver_id": admin, "approved": True})
+        timed("make_decision", iterations, decide)
+    return results
+
+
+async def _load(ctx: dict, url: str, concurrency: int, duration: float, mix: dict, seed_: int) -> dict:
+    rng = random.Random(seed_)
+    factories = _requests(ctx, rng)
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    samples = {n: [] for n in names}
+    errors = {n: 0 for n in names}
+    transport = None if url else httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(base_url=url or "http://bench", transport=transport, timeout=30,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                name = rng.choices(names, weights)[0]
+                method, path, kw = factories[name]()
+                t = time.perf_counter()
+                try:
+                    resp = await client.request(method, path, **kw)
+                    ok = resp.status_code < 400
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    samples[name].append(time.perf_counter() - t)
+                else:
+                    errors[name] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    out = {n: {**summarize(samples[n], elapsed), "errors": errors[n]} for n in names}
+    out["total"] = {**summarize([x for n in names for x in samples[n]], elapsed), "errors": sum(errors.values())}
+    return out
+
+
+DEFAULT_MIX = {"list_user_expenses": 40, "pending_for_user": 30, "submit_expense": 25, "token": 5}
+
+
+def load(ctx: dict, url: str = None, concurrency: int = 16, duration: float = 10.0, mix: dict = None, seed_: int = 2) -> dict:
+    return asyncio.run(_load(ctx, url, concurrency, duration, mix or DEFAULT_MIX, seed_))
+
+
+# run in a fresh interpreter; speaks ASGI directly (as a server would) so the
+# harness imports nothing the app does not, and prints seconds from its first
+# line to each phase
+STARTUP_PROBE = """
+import asyncio, json, sys, time
+t = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import main
+out = {"import": time.perf_counter() - t}
+
+async def probe():
+    inbox, outbox = asyncio.Queue(), asyncio.Queue()
+    lifespan = asyncio.create_task(main.app({"type": "lifespan", "asgi": {"version": "3.0"}}, inbox.get, outbox.put))
+    await inbox.put({"type": "lifespan.startup"})
+    assert (await outbox.get())["type"] == "lifespan.startup.complete"
+    out["ready"] = time.perf_counter() - t
+    sent = []
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+    async def send(message):
+        sent.append(message)
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+             "path": "/", "raw_path": b"/", "root_path": "", "query_string": b"", "headers": [],
+             "server": ("probe", 80), "client": ("probe", 1)}
+    await main.app(scope, receive, send)
+    assert sent[0]["status"] == 200
+    out["first_request"] = time.perf_counter() - t
+    print(json.dumps(out), flush=True)
+    await inbox.put({"type": "lifespan.shutdown"})
+    await outbox.get()
+    await lifespan
+
+asyncio.run(probe())
+"""
+STARTUP_PHASES = ("import", "ready", "first_request", "process")
+
+
+def _boot_once(database_url: str) -> dict:
+    env = dict(os.environ, DATABASE_URL=database_url, SCHEDULER_ENABLED="0", CACHE_BUS="local")
+    env.pop("ASYNC_DATABASE_URL", None)
+    env.pop("DATABASE_READ_URL", None)
+    t = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-c", STARTUP_PROBE, str(ROOT)], env=env, stdout=subprocess.PIPE, text=True)
+    line = proc.stdout.readline()
+    # process: launch to first response, interpreter start-up included
+    launched = time.perf_counter() - t
+    proc.wait()
+    if proc.returncode or not line:
+        raise RuntimeError(f"startup probe failed with exit code {proc.returncode}")
+    return {**json.loads(line), "process": launched}
+
+
+def startup(runs: int = 5) -> dict:
+    """Cold and warm boot timings over `runs` fresh processes each."""
+    tmp = tempfile.mkdtemp()
+    warm_url = "sqlite:///" + os.path.join(tmp, "warm.db")
+    _boot_once(warm_url)  # initialise the warm database
+    samples = {f"{kind}_{phase}": [] for kind in ("cold", "warm") for phase in STARTUP_PHASES}
+    for i in range(runs):
+        for kind, url in (("cold", "sqlite:///" + os.path.join(tmp, f"cold{i}.db")), ("warm", warm_url)):
+            for phase, seconds in _boot_once(url).items():
+                samples[f"{kind}_{phase}"].append(seconds)
+    return {name: summarize(xs, 0) for name, xs in samples.items()}
+
+
+def compare(results: dict, baseline: dict, tolerance: float = 0.5) -> list:
+    """Return a line per metric that is more than `tolerance` (fraction) worse than the baseline."""
+    failures = []
+    for section in ("micro", "load", "startup"):
+        for name, base in baseline.get(section, {}).items():
+            cur = results.get(section, {}).get(name)
+            if not cur:
+                continue
+            for metric in HIGHER_IS_WORSE + LOWER_IS_WORSE:
+                b, c = base.get(metric), cur.get(metric)
+                if not b or c is None:
+                    continue
+                worse = c > b * (1 + tolerance) if metric in HIGHER_IS_WORSE else c < b / (1 + tolerance)
+                if worse:
+                    failures.append(f"{section}.{name}.{metric}: {c} vs baseline {b}")
+    return failures
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("mode", choices=("micro", "load", "startup", "all"), nargs="?", default="all")
+    p.add_argument("--companies", type=int, default=5)
+    p.add_argument("--users", type=int, default=50, help="employees per company")
+    p.add_argument("--expenses", type=int, default=5000)
+    p.add_argument("--depth", type=int, default=3, help="manager chain length")
+    p.add_argument("--iterations", type=int, default=200)
+    p.add_argument("--token-iterations", type=int, default=20)
+    p.add_argument("--url", help="drive a running server instead of the in-process app")
+    p.add_argument("--concurrency", type=int, default=16)
+    p.add_argument("--duration", type=float, default=10.0)
+    p.add_argument("--startup-runs", type=int, default=5, help="fresh processes per startup scenario")
+    p.add_argument("--out", help="write results JSON here")
+    p.add_argument("--baseline", help="compare against this results JSON")
+    p.add_argument("--tolerance", type=float, default=float(os.environ.get("BENCH_TOLERANCE", "0.5")))
+    p.add_argument("--update-baseline", action="store_true", help="overwrite --baseline with these results")
+    args = p.parse_args(argv)
+
+    results = {"meta": {"date": date.today().isoformat(), "python": platform.python_version(),
+                        "machine": platform.machine(), "bcrypt_rounds": int(os.environ.get("BCRYPT_ROUNDS", "12"))}}
+    if args.mode in ("micro", "load", "all"):
+        t = time.perf_counter()
+        ctx = seed(args.companies, args.users, args.expenses, args.depth)
+        results["meta"].update(companies=args.companies, users=args.users, expenses=args.expenses, depth=args.depth,
+                               seed_s=round(time.perf_counter() - t, 2))
+    if args.mode in ("micro", "all"):
+        results["micro"] = micro(ctx, args.iterations, args.token_iterations)
+    if args.mode in ("load", "all"):
+        results["load"] = load(ctx, args.url, args.concurrency, args.duration)
+        results["meta"].update(concurrency=args.concurrency, duration_s=args.duration, url=args.url)
+    if args.mode in ("startup", "all"):
+        results["startup"] = startup(args.startup_runs)
+        results["meta"].update(startup_runs=args.startup_runs)
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.out:
+        Path(args.out).write_text(text + "\n")
+    if args.baseline and args.update_baseline:
+        Path(args.baseline).write_text(text + "\n")
+    elif args.baseline:
+        failures = compare(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        if failures:
+            print(f"\nREGRESSIONS (> {args.tolerance:.0%} worse than {args.baseline}):", file=sys.stderr)
+            for f in failures:
+                print("  " + f, file=sys.stderr)
+            return 1
+        print(f"\nno regressions against {args.baseline}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""Company-wide expense search.
+
+Free text matches Expense.description and category through a full-text
+index the database keeps in step with the table: an external-content FTS5
+table maintained by triggers on SQLite, a generated tsvector column with a
+GIN index on Postgres (both created by migration 7, so every write path,
+bulk inserts included, stays indexed). Text results are ranked by relevance
+(bm25 / ts_rank); without text they come newest first. Structured filters
+narrow either case, facet counts summarise the whole match set, and pages
+are keyset-paginated on (rank, id) or id.
+"""
+import re
+from datetime import date
+from typing import Optional
+
+from sqlalchemy import Float, column, func, literal_column, table, text
+from sqlmodel import select
+
+from models import Expense
+from pagination import cursor_values, keyset_after
+
+FACETS = ("status", "currency", "category")
+FACET_LIMIT = 20
+# fields returned per hit
+RESULT_FIELDS = ("id", "submitter_id", "amount", "currency", "amount_company_currency", "category",
+                 "description", "date", "status")
+
+fts = table("expense_fts", column("rowid"))
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def fts_query(q: str, dialect: str) -> Optional[str]:
+    """User text -> a safe match expression: every word must match, the last as a prefix."""
+    tokens = _TOKEN_RE.findall(q or '')
+    if not tokens:
+        return None
+    if dialect == "postgresql":
+        return " & ".join(tokens[:-1] + [tokens[-1] + ":*"])
+    return " ".join([f'"{t}"' for t in tokens[:-1]] + [f'"{tokens[-1]}"*'])
+
+
+def _filtered(q, company_id: int, status: Optional[str], currency: Optional[str], category: Optional[str],
+              min_amount: Optional[float], max_amount: Optional[float], date_from: Optional[date], date_to: Optional[date]):
+    q = q.where(Expense.company_id == company_id)
+    if status is not None:
+        q = q.where(Expense.status == status)
+    if currency is not None:
+        q = q.where(Expense.currency == currency)
+    if category is not None:
+        q = q.where(Expense.category == category)
+    # amounts compare in company currency so mixed-currency expenses rank together
+    if min_amount is not None:
+        q = q.where(Expense.amount_company_currency >= min_amount)
+    if max_amount is not None:
+        q = q.where(Expense.amount_company_currency <= max_amount)
+    if date_from is not None:
+        q = q.where(Expense.date >= date_from)
+    if date_to is not None:
+        q = q.where(Expense.date <= date_to)
+    return q
+
+
+def _match(q, match: str, dialect: str):
+    """Restrict `q` to the text match; returns (query, rank expression where lower is more relevant)."""
+    if dialect == "postgresql":
+        tsq = func.to_tsquery("simple", match)
+        vector = literal_column("expense.search_vector")
+        return q.where(vector.op("@@")(tsq)), -func.ts_rank(vector, tsq, type_=Float)
+    q = q.join(fts, fts.c.rowid == Expense.id).where(text("expense_fts MATCH :match").bindparams(match=match))
+    return q, literal_column("bm25(expense_fts)", Float)
+
+
+def search_expenses(session, company_id: int, q: Optional[str] = None, limit: int = 50, after: Optional[list] = None,
+                    facets: bool = True, **filters) -> dict:
+    """Return {"results", "facets", "next"}; `next` is the sort key to pass back as `after`."""
+    dialect = session.get_bind().dialect.name
+    match = fts_query(q, dialect)
+    base = _filtered(select(Expense.id), company_id, **filters)
+    if match:
+        base, rank = _match(base, match, dialect)
+        keys, descending = (rank, Expense.id), False
+    else:
+        rank = None
+        keys, descending = (Expense.id,), True
+
+    page_q = base.with_only_columns(*[getattr(Expense, f) for f in RESULT_FIELDS], *([rank.label("rank")] if rank is not None else []))
+    if after:
+        # a float rank and an int id, else 400: `after` is a client cursor
+        page_q = page_q.where(keyset_after(keys, cursor_values(keys, after), descending))
+    page_q = page_q.order_by(*[k.desc() if descending else k.asc() for k in keys]).limit(limit + 1)
+    rows = session.execute(page_q).all()
+
+    results = []
+    for row in rows[:limit]:
+        m = row._mapping
+        hit = {f: m[f] for f in RESULT_FIELDS}
+        if rank is not None:
+            hit["rank"] = m["rank"]
+        results.append(hit)
+    nxt = None
+    if len(rows) > limit:
+        last = results[-1]
+        nxt = [last["rank"], last["id"]] if rank is not None else [last["id"]]
+
+    out = {"results": results, "next": nxt}
+    if facets:
+        out["facets"] = {}
+        for name in FACETS:
+            col = getattr(Expense, name)
+            counts = session.execute(base.with_only_columns(col, func.count()).group_by(col)
+                                     .order_by(func.count().desc(), col).limit(FACET_LIMIT)).all()
+            out["facets"][name] = [{"value": v, "count": n} for v, n in counts]
+    return out
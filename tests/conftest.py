@@ -0,0 +1,47 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# point the app at a throwaway database before `db` is imported, so test runs
+# never touch the checked-in expenses.db and always start from an empty schema
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db"))
+os.environ.setdefault("RECEIPTS_DIR", tempfile.mkdtemp())
+os.environ.setdefault("OCR_WORKERS", "0")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    # the app creates its schema in a startup hook; most tests use TestClient without running it
+    from db import init_db
+    init_db()
+
+
+class Tenant:
+    """A signed-up company with its admin logged in."""
+
+    def __init__(self, client, slug):
+        resp = client.post('/signup', json={"company_name": slug, "country": "India", "admin_name": "Admin", "admin_email": f"admin@{slug}"})
+        assert resp.status_code == 200
+        self.client, self.slug = client, slug
+        self.company_id, self.admin_id = resp.json()['company_id'], resp.json()['admin_id']
+        token = client.post('/token', data={"username": f"admin@{slug}", "password": "admin"}).json()['access_token']
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    def user(self, name, **fields):
+        """Create `name@slug` in the company (extra /users fields as keywords) and return its id."""
+        resp = self.client.post('/users', json={"name": name, "email": f"{name}@{self.slug}", "company_id": self.company_id, **fields}, headers=self.headers)
+        assert resp.status_code == 200
+        return resp.json()['id']
+
+
+@pytest.fixture
+def tenant():
+    """tenant(slug) signs up a company whose admin is admin@slug."""
+    from fastapi.testclient import TestClient
+    from main import app
+    client = TestClient(app)
+    return lambda slug: Tenant(client, slug)
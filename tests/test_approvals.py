@@ -0,0 +1,119 @@
+from fastapi.testclient import TestClient
+from main import app
+from pagination import encode_cursor
+
+client = TestClient(app)
+
+
+def _company(tenant, slug):
+    t = tenant(slug)
+    return t.headers, {name: t.user(name, role="manager", password="pw") for name in ('mgr', 'fin', 'emp')}
+
+
+def test_pending_inbox_honours_sequence_and_paginates(tenant):
+    headers, users = _company(tenant, 'inbox.test')
+    ids = []
+    for amount in (10.0, 30.0, 20.0):
+        resp = client.post('/expenses', json={"submitter_id": users['emp'], "amount": amount, "currency": "INR", "approver_ids": [users['mgr'], users['fin']]}, headers=headers)
+        ids.append(resp.json()['id'])
+
+    # finance is second in line, so nothing is theirs yet
+    assert client.get(f"/approvals/user/{users['fin']}/pending").json() == []
+
+    resp = client.get(f"/approvals/user/{users['mgr']}/pending", params={"limit": 2, "sort": "amount", "order": "desc"})
+    assert [p['expense']['amount'] for p in resp.json()] == [30.0, 20.0]
+    cursor = resp.headers['X-Next-Cursor']
+    resp = client.get(f"/approvals/user/{users['mgr']}/pending", params={"limit": 2, "sort": "amount", "order": "desc", "cursor": cursor})
+    assert [p['expense']['amount'] for p in resp.json()] == [10.0]
+    assert 'X-Next-Cursor' not in resp.headers
+    # well-formed cursors holding the wrong types are a 400, not a SQL error
+    for sort, tampered in (("queue", [{"a": 1}]), ("queue", [[1]]), ("queue", ["1"]),
+                           ("amount", [{"a": 1}, 1]), ("amount", [[1], 1]), ("amount", ["30", 1]), ("amount", [30.0, 1.5])):
+        params = {"sort": sort, "cursor": encode_cursor(tampered)}
+        assert client.get(f"/approvals/user/{users['mgr']}/pending", params=params).status_code == 400, tampered
+
+    # a rejection with steps still open leaves the expense pending and hands it on
+    resp = client.post(f"/approvals/{ids[0]}/decision", json={"approver_id": users['mgr'], "approved": False}, headers=headers)
+    assert resp.status_code == 200
+    pending = client.get(f"/approvals/user/{users['fin']}/pending").json()
+    assert [p['expense']['id'] for p in pending] == [ids[0]]
+
+    assert client.get(f"/approvals/user/{users['mgr']}/pending", params={"cursor": "garbage"}).status_code == 400
+
+
+def test_rule_evaluation_from_counters():
+    from approvals import compile_rule, evaluate, record_decision
+    from models import ApprovalRule, Expense
+
+    rule = compile_rule(ApprovalRule(company_id=1, percentage_threshold=60, special_approver_ids='7, 9', mode='AND'))
+    assert rule.special_approver_ids == frozenset({7, 9}) and rule.mode == 'and'
+
+    exp = Expense(submitter_id=1, company_id=1, amount=1, currency='USD', amount_company_currency=1, steps_total=3, steps_pending=3)
+    record_decision(exp, rule, 7, True)
+    # special approver alone is not enough in 'and' mode: 33% < 60%
+    assert evaluate(exp, rule) == ('pending', 'moved to next approver')
+    record_decision(exp, rule, 2, True)
+    assert evaluate(exp, rule)[0] == 'approved'
+
+    or_rule = compile_rule(ApprovalRule(company_id=1, percentage_threshold=None, special_approver_ids='', mode=None))
+    exp = Expense(submitter_id=1, company_id=1, amount=1, currency='USD', amount_company_currency=1, steps_total=1, steps_pending=1)
+    record_decision(exp, or_rule, 2, False)
+    assert evaluate(exp, or_rule) == ('rejected', 'finalized')
+
+
+def test_rule_simulation_reports_changed_outcomes(tenant):
+    headers, users = _company(tenant, 'simulate.test')
+    ids = []
+    for amount in (10.0, 20.0, 30.0):
+        resp = client.post('/expenses', json={"submitter_id": users['emp'], "amount": amount, "currency": "INR", "approver_ids": [users['mgr'], users['fin']]}, headers=headers)
+        ids.append(resp.json()['id'])
+    company_id = resp.json()['company_id']
+    # default rule (50%): one approval of two settles the first; the second is approved by finance after a rejection
+    assert client.post(f"/approvals/{ids[0]}/decision", json={"approver_id": users['mgr'], "approved": True}, headers=headers).json()['status'] == 'approved'
+    client.post(f"/approvals/{ids[1]}/decision", json={"approver_id": users['mgr'], "approved": False}, headers=headers)
+    assert client.post(f"/approvals/{ids[1]}/decision", json={"approver_id": users['fin'], "approved": True}, headers=headers).json()['status'] == 'approved'
+
+    url = f"/companies/{company_id}/rules/simulate"
+    same = client.post(url, json={"percentage_threshold": 50}, headers=headers).json()
+    assert same['expenses'] == 3 and same['decisions'] == 3 and same['changed'] == 0
+    assert same['current'] == same['candidate'] == {"approved": 2, "pending": 1}
+
+    # unanimity, or finance as special approver: the first expense would still be waiting on finance
+    resp = client.post(url, json={"percentage_threshold": 100, "special_approver_ids": [users['fin']], "mode": "OR"}, headers=headers)
+    body = resp.json()
+    assert body['changed'] == 1 and body['transitions'] == {"approved->pending": 1}
+    assert [(x['expense_id'], x['status'], x['candidate']) for x in body['samples']] == [(ids[0], 'approved', 'pending')]
+    assert body['rule'] == {"percentage_threshold": 100, "special_approver_ids": [users['fin']], "mode": "or"}
+
+    # nothing was written, and the window narrows the replay
+    assert client.get(f"/expenses/user/{users['emp']}", headers=headers).json()[-1]['status'] == 'approved'
+    assert client.post(url, json={"percentage_threshold": 100, "date_from": "2999-01-01"}, headers=headers).json()['expenses'] == 0
+    assert client.post(url, json={"mode": "xor"}, headers=headers).status_code == 422
+    token = client.post('/token', data={"username": "mgr@simulate.test", "password": "pw"}).json()['access_token']
+    assert client.post(url, json={}, headers={"Authorization": f"Bearer {token}"}).status_code == 403
+
+
+def test_rule_update_recounts_special_approvals(tenant):
+    import approvals
+    import scheduler
+    from db import get_session
+    from models import Expense
+
+    t = tenant('rule.test')
+    headers, users = t.headers, {name: t.user(name, role="manager") for name in ('mgr', 'fin', 'emp')}
+    eid = client.post('/expenses', json={"submitter_id": users['emp'], "amount": 10.0, "currency": "INR", "approver_ids": [users['mgr'], users['fin'], t.admin_id]}, headers=headers).json()['id']
+    # 1/3 misses the default 50%
+    assert client.post(f"/approvals/{eid}/decision", json={"approver_id": users['fin'], "approved": True}, headers=headers).json()['status'] == 'pending'
+    with get_session() as s:
+        assert approvals.get_rule(s, t.company_id).special_approver_ids == frozenset()
+
+    resp = client.put(f"/companies/{t.company_id}/rule", json={"percentage_threshold": 50, "special_approver_ids": [users['fin']]}, headers=headers)
+    assert resp.json() == {"company_id": t.company_id, "percentage_threshold": 50, "special_approver_ids": [users['fin']], "mode": "or"}
+    with get_session() as s:
+        assert approvals.get_rule(s, t.company_id).special_approver_ids == {users['fin']}
+        # finance approved before becoming a special approver, and that approval now counts
+        assert s.get(Expense, eid).special_approvals == 1
+    scheduler.apply_rules()
+    with get_session() as s:
+        assert s.get(Expense, eid).status == 'approved'
+    assert client.put(f"/companies/{t.company_id + 1000}/rule", json={}, headers=headers).status_code == 403
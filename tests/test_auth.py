@@ -0,0 +1,28 @@
+import auth
+from cache import TTLCache
+
+
+def test_decoded_tokens_are_cached_until_expiry(monkeypatch):
+    token = auth.create_access_token({"sub": "a@x", "user_id": 1, "role": "admin"})
+    assert auth.decode_token(token)['user_id'] == 1
+
+    def fail(*args, **kwargs):
+        raise AssertionError('signature re-verified')
+
+    monkeypatch.setattr(auth.jwt, 'decode', fail)
+    assert auth.decode_token(token)['role'] == 'admin'
+
+    expired = auth.create_access_token({"sub": "a@x"}, expires_delta=-1)
+    monkeypatch.undo()
+    assert auth.decode_token(expired) is None
+
+
+def test_ttl_cache_is_bounded_lru():
+    c = TTLCache(maxsize=2, ttl=60)
+    c.put('a', 1)
+    c.put('b', 2)
+    c.get('a')
+    c.put('c', 3)
+    assert (c.get('a'), c.get('b'), c.get('c')) == (1, None, 3)
+    c.put('d', 4, expires_at=0)
+    assert c.get('d') is None
@@ -0,0 +1,22 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+
+import bench  # noqa: E402
+
+
+def test_compare_flags_regressions_beyond_tolerance():
+    baseline = {"micro": {"submit_expense": {"p95_ms": 10.0, "ops_per_s": 100.0}}}
+    assert bench.compare({"micro": {"submit_expense": {"p95_ms": 14.0, "ops_per_s": 80.0}}}, baseline, 0.5) == []
+    failures = bench.compare({"micro": {"submit_expense": {"p95_ms": 16.0, "ops_per_s": 60.0}}}, baseline, 0.5)
+    assert failures == ["micro.submit_expense.p95_ms: 16.0 vs baseline 10.0",
+                        "micro.submit_expense.ops_per_s: 60.0 vs baseline 100.0"]
+
+
+def test_seed_and_micro_run():
+    ctx = bench.seed(companies=1, users=3, expenses=20, depth=2)
+    assert len(ctx["managers"]) == 2 and len(ctx["employees"]) == 3
+    results = bench.micro(ctx, iterations=3, token_iterations=1, warmup=1)
+    assert set(results) == {"token", "submit_expense", "pending_for_user", "list_user_expenses", "make_decision"}
+    assert all(r["n"] >= 1 for r in results.values())
@@ -0,0 +1,59 @@
+import json
+
+from fastapi.testclient import TestClient
+from main import app
+
+client = TestClient(app)
+
+
+def test_bulk_submit_json_and_ndjson(tenant):
+    t = tenant('bulk.test')
+    admin_id, headers = t.admin_id, t.headers
+    emp = t.user("emp", manager_id=admin_id)
+
+    rows = [
+        {"submitter_id": emp, "amount": 10.0, "currency": "INR", "category": "travel"},
+        {"submitter_id": 999999, "amount": 5.0, "currency": "INR"},
+        {"submitter_id": emp, "amount": 1.0, "currency": "USD", "date_": "not-a-date"},
+        {"submitter_id": emp, "amount": 2.0, "currency": "USD", "approver_ids": [admin_id]},
+    ]
+    resp = client.post('/expenses/bulk', json=rows, headers=headers)
+    assert resp.status_code == 200
+    body = resp.json()
+    assert (body['submitted'], body['failed']) == (2, 2)
+    ok, missing, bad_date, converted = body['results']
+    assert missing['error'] == 'submitter not found'
+    assert 'error' in bad_date
+    assert converted['amount_company_currency'] == 2.0 * 82.0
+
+    # default chain is manager then admins; both are the same admin here
+    pending = client.get(f"/approvals/user/{admin_id}/pending").json()
+    assert {p['expense']['id'] for p in pending} == {ok['id'], converted['id']}
+
+    ndjson = "\n".join(json.dumps(r) for r in rows[:1] * 3)
+    resp = client.post('/expenses/bulk', content=ndjson, headers=dict(headers, **{"Content-Type": "application/x-ndjson"}))
+    assert resp.json()['submitted'] == 3
+
+    assert client.post('/expenses/bulk', content="{oops", headers=headers).status_code == 400
+
+
+def test_failed_chunk_only_fails_the_bad_row(tenant):
+    t = tenant('bulkchunk.test')
+    rows = [{"submitter_id": t.admin_id, "amount": 1.0 + i, "currency": "INR"} for i in range(4)]
+    # passes validation but is out of range for the integer minor-unit column
+    rows[2]["amount"] = 1e20
+    body = client.post('/expenses/bulk', json=rows, headers=t.headers).json()
+    assert (body['submitted'], body['failed']) == (3, 1)
+    assert body['results'][2]['error'].startswith('insert failed')
+    assert [r['amount'] for r in client.get(f'/expenses/user/{t.admin_id}').json()] == [4.0, 2.0, 1.0]
+
+
+def test_non_finite_and_oversized_amounts_are_rejected(tenant):
+    t = tenant('bulkinf.test')
+    rows = [{"submitter_id": t.admin_id, "amount": a, "currency": "INR"} for a in (1.0, "inf", "nan", 1e300)]
+    body = client.post('/expenses/bulk', json=rows, headers=t.headers).json()
+    assert (body['submitted'], body['failed']) == (1, 3)
+    assert [r.get('error') for r in body['results']] == [None, 'amount must be a finite number', 'amount must be a finite number', 'amount out of range']
+    for amount in ("inf", 1e300):
+        resp = client.post('/expenses', json={"submitter_id": t.admin_id, "amount": amount, "currency": "INR"}, headers=t.headers)
+        assert resp.status_code == 422
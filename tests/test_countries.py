@@ -0,0 +1,31 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from countries import CountryRegistry
+
+SAMPLE = [
+    {"name": {"common": "India", "official": "Republic of India"}, "cca2": "IN", "cca3": "IND",
+     "altSpellings": ["IN", "Bhārat"], "currencies": {"INR": {}}},
+    {"name": {"common": "United States", "official": "United States of America"}, "cca2": "US", "cca3": "USA",
+     "altSpellings": ["US", "USA"], "currencies": {"USD": {}}},
+]
+
+
+def test_registry_loads_once_and_indexes_aliases(tmp_path):
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return SAMPLE
+
+    snap = str(tmp_path / 'countries.json')
+    reg = CountryRegistry(fetch=fetch, snapshot_path=snap)
+    assert reg.currency_for('india') == 'INR'
+    assert reg.currency_for('USA') == 'USD'
+    assert reg.currency_for('Republic of India') == 'INR'
+    assert reg.currency_for('Atlantis', default='EUR') == 'EUR'
+    assert len(calls) == 1
+    # a fresh process starts from the snapshot without downloading
+    cold = CountryRegistry(fetch=lambda: [], snapshot_path=snap)
+    assert cold.currency_for('IN') == 'INR'
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import func, insert, select, update
+
+import bus
+import main
+import principals
+from db import engine, get_session
+from models import CacheEvent, Expense, IdempotencyKey
+
+client = TestClient(main.app)
+
+
+def test_retried_submission_is_replayed_not_duplicated(tenant):
+    t = tenant('idem.test')
+    admin_id, headers = t.admin_id, t.headers
+    body = {"submitter_id": admin_id, "amount": 7.0, "currency": "INR"}
+    keyed = {**headers, "Idempotency-Key": "submit-1"}
+    first = client.post('/expenses', json=body, headers=keyed)
+    again = client.post('/expenses', json=body, headers=keyed)
+    assert again.json() == first.json() and again.headers['Idempotent-Replayed'] == 'true'
+    assert len(client.get(f'/expenses/user/{admin_id}').json()) == 1
+    assert client.post('/expenses', json={**body, "amount": 8.0}, headers=keyed).status_code == 422
+    # without a key, or with another one, it is a new write
+    client.post('/expenses', json=body, headers={**headers, "Idempotency-Key": "submit-2"})
+    assert len(client.get(f'/expenses/user/{admin_id}').json()) == 2
+
+
+def test_in_progress_key_of_a_dead_worker_expires(tenant):
+    t = tenant('lease.test')
+    body = {"submitter_id": t.admin_id, "amount": 7.0, "currency": "INR"}
+    keyed = {**t.headers, "Idempotency-Key": "lease-1"}
+    first = client.post('/expenses', json=body, headers=keyed)
+    table = IdempotencyKey.__table__
+    with engine.begin() as conn:
+        conn.execute(insert(table).values(key=f"user:{t.admin_id}:lease-2", fingerprint="x", created_at=datetime.utcnow(),
+                                          expires_at=datetime.utcnow() - timedelta(seconds=1)))
+        stored = conn.execute(table.select().where(table.c.key == f"user:{t.admin_id}:lease-1")).first()
+    # a completed key keeps the full TTL, not the lease
+    assert stored.expires_at > datetime.utcnow() + timedelta(hours=1) and first.status_code == 200
+    # the lapsed in-progress claim is taken over instead of answering 409
+    resp = client.post('/expenses', json=body, headers={**t.headers, "Idempotency-Key": "lease-2"})
+    assert resp.status_code == 200 and 'Idempotent-Replayed' not in resp.headers
+
+
+def test_stale_expense_version_is_a_conflict(monkeypatch, tenant):
+    t = tenant('version.test')
+    admin_id, headers = t.admin_id, t.headers
+    eid = client.post('/expenses', json={"submitter_id": admin_id, "amount": 7.0, "currency": "INR", "approver_ids": [admin_id]}, headers=headers).json()['id']
+
+    # another writer bumps the row between our read and our commit
+    real_get_rule = main.get_rule
+
+    def racing_get_rule(session, company_id):
+        monkeypatch.setattr(main, "get_rule", real_get_rule)
+        with get_session() as other:
+            other.execute(update(Expense).where(Expense.id == eid).values(version=Expense.version + 1))
+            other.commit()
+        return real_get_rule(session, company_id)
+    monkeypatch.setattr(main, "get_rule", racing_get_rule)
+    keyed = {**headers, "Idempotency-Key": "decide-1"}
+    resp = client.post(f'/approvals/{eid}/decision', json={"approver_id": admin_id, "approved": True}, headers=keyed)
+    assert resp.status_code == 409
+    with get_session() as s:
+        assert s.get(Expense, eid).status == 'pending'
+    # a retry with the same key is not handed the stored 409: it sees the new version and goes through
+    resp = client.post(f'/approvals/{eid}/decision', json={"approver_id": admin_id, "approved": True}, headers=keyed)
+    assert resp.json()['status'] == 'approved' and 'Idempotent-Replayed' not in resp.headers
+
+
+def test_bus_applies_events_from_other_workers(monkeypatch):
+    monkeypatch.setattr(bus, "CACHE_BUS", "db")
+    bus.poll()  # first poll starts from the current tail
+    principals.users.put(424242, "cached")
+    monkeypatch.setattr(bus, "ORIGIN", "other-worker")
+    bus.publish("user", 424242)
+    principals.users.put(424242, "cached")
+    monkeypatch.undo()
+    monkeypatch.setattr(bus, "CACHE_BUS", "db")
+    assert bus.poll() == 1
+    assert principals.users.get(424242) is None
+
+
+def test_bus_applies_events_that_commit_out_of_order(monkeypatch):
+    monkeypatch.setattr(bus, "CACHE_BUS", "db")
+    bus.poll()
+    table = CacheEvent.__table__
+    with engine.begin() as conn:
+        top = conn.execute(select(func.max(table.c.id))).scalar() or 0
+        # id top+2 commits first; top+1 was allocated earlier but commits after the next poll
+        conn.execute(insert(table).values(id=top + 2, topic="user", key="434343", origin="other-worker", created_at=datetime.utcnow()))
+    assert bus.poll() == 1
+    principals.users.put(434343, "cached")
+    with engine.begin() as conn:
+        conn.execute(insert(table).values(id=top + 1, topic="user", key="434343", origin="other-worker", created_at=datetime.utcnow()))
+    assert bus.poll() == 1
+    assert principals.users.get(434343) is None
+    # applied once only, however often the window is re-read
+    assert bus.poll() == 0
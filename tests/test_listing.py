@@ -0,0 +1,53 @@
+import csv
+import io
+import json
+
+from fastapi.testclient import TestClient
+from main import app
+from pagination import encode_cursor
+
+client = TestClient(app)
+
+
+def test_paginated_listing_filters_projection_and_export(tenant):
+    t = tenant('list.test')
+    admin_id, headers = t.admin_id, t.headers
+    rows = [{"submitter_id": admin_id, "amount": float(i), "currency": "INR", "category": "travel" if i % 2 else "meals",
+             "date_": f"2024-01-{i + 1:02d}"} for i in range(5)]
+    assert client.post('/expenses/bulk', json=rows, headers=headers).json()['submitted'] == 5
+
+    url = f'/expenses/user/{admin_id}'
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 2, "fields": "id,amount,date"}
+        if cursor:
+            params["cursor"] = cursor
+        resp = client.get(url, params=params)
+        assert all(set(r) == {"id", "amount", "date"} for r in resp.json())
+        seen.extend(r['amount'] for r in resp.json())
+        cursor = resp.headers.get('X-Next-Cursor')
+        if not cursor:
+            break
+    assert seen == [4.0, 3.0, 2.0, 1.0, 0.0]
+
+    resp = client.get(url, params={"category": "travel", "date_from": "2024-01-03"})
+    assert [r['amount'] for r in resp.json()] == [3.0]
+    assert client.get(url, params={"fields": "nope"}).status_code == 400
+    # well-formed cursors with tampered values are rejected too
+    for tampered in (["nope", 1], ["2024-01-01", "1"], [[], 1]):
+        assert client.get(url, params={"cursor": encode_cursor(tampered)}).status_code == 400
+
+    assert client.get(url + '/export').status_code == 401
+    # neither a colleague nor another company's admin may export this history
+    t.user("peer", role="employee", password="pw")
+    peer = client.post('/token', data={"username": "peer@list.test", "password": "pw"}).json()['access_token']
+    assert client.get(url + '/export', headers={"Authorization": f"Bearer {peer}"}).status_code == 403
+    assert client.get(url + '/export', headers=tenant('list-other.test').headers).status_code == 403
+
+    resp = client.get(url + '/export', params={"status": "pending"}, headers=headers)
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+    assert len(lines) == 5 and lines[0]['date'] == '2024-01-05'
+    resp = client.get(url + '/export', params={"format": "csv", "fields": "id,category"}, headers=headers)
+    table = list(csv.reader(io.StringIO(resp.text)))
+    assert table[0] == ['id', 'category'] and len(table) == 6
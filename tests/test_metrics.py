@@ -0,0 +1,45 @@
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+import metrics
+from db import engine
+from main import app
+
+client = TestClient(app)
+
+
+def test_metrics_count_requests_and_queries(caplog, tenant):
+    tenant('metrics.test')
+    assert client.get('/expenses/user/1', params={"limit": 5}).status_code == 200
+
+    body = client.get('/metrics').text
+    assert '# TYPE http_request_duration_seconds histogram' in body
+    assert 'http_request_duration_seconds_count{method="GET",route="/expenses/user/{user_id}",status="200"}' in body
+    assert 'http_request_db_queries_count{route="/signup"}' in body
+    # signup writes a company, an admin and a rule
+    signup = [l for l in body.splitlines() if l.startswith('http_request_db_queries_sum{route="/signup"}')]
+    assert float(signup[0].split()[-1]) >= 3
+
+
+def test_query_budget_warning(monkeypatch, caplog):
+    monkeypatch.setattr(metrics, "METRICS_QUERY_BUDGET", 0)
+    client.get('/expenses/user/1')
+    assert 'db_query_budget_exceeded_total{route="/expenses/user/{user_id}"}' in metrics.render()
+    assert any("queries (budget 0" in r.getMessage() for r in caplog.records)
+
+
+def test_worker_label(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_WORKER_LABEL", True)
+    assert f'worker="{os.getpid()}"' in metrics.render()
+
+
+def test_failed_statement_does_not_leak_start_times():
+    with engine.connect() as conn:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                conn.execute(text("SELECT * FROM no_such_table"))
+        assert conn.info.get("query_start") == []
@@ -0,0 +1,75 @@
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlmodel import Session, SQLModel, create_engine, select
+
+import models  # noqa: F401  registers the tables
+from migrations import HOT_QUERIES, MIGRATIONS, check_query_plans, current_version, ensure_schema, migrate
+
+
+def test_migrate_adds_indexes_to_existing_database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    SQLModel.metadata.create_all(engine)
+    # simulate a database created before the indexes existed, with a duplicate email
+    with engine.begin() as conn:
+        for (name,) in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'ix_%'")).fetchall():
+            conn.execute(text(f"DROP INDEX {name}"))
+        conn.execute(text("INSERT INTO user (name, email, role) VALUES ('a', 'a@x', 'employee'), ('b', 'a@x', 'employee')"))
+    assert len(check_query_plans(engine)) == len(HOT_QUERIES)
+
+    assert migrate(engine) == MIGRATIONS[-1][0]
+    assert check_query_plans(engine) == []
+    # re-running is a no-op
+    assert migrate(engine) == MIGRATIONS[-1][0]
+    with engine.connect() as conn:
+        assert current_version(conn) == MIGRATIONS[-1][0]
+
+
+def test_ensure_schema_skips_work_while_stamp_is_current(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'stamped.db'}")
+    assert ensure_schema(engine, SQLModel.metadata) is True
+    with engine.connect() as conn:
+        assert current_version(conn) == MIGRATIONS[-1][0]
+    assert ensure_schema(engine, SQLModel.metadata) is False
+    # a stale stamp (models or steps changed since) runs the full check again
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE schemastamp SET stamp = 'old'"))
+    assert ensure_schema(engine, SQLModel.metadata) is True
+    assert ensure_schema(engine, SQLModel.metadata, force=True) is True
+
+
+def test_backfills_missing_updated_at(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'v9.db'}")
+    SQLModel.metadata.create_all(engine)
+    with engine.begin() as conn:
+        current_version(conn)
+        conn.execute(text("INSERT INTO schemaversion (version) VALUES (9)"))
+        conn.execute(text("INSERT INTO expense (id, submitter_id, company_id, amount, currency, amount_company_currency, status, date, "
+                          "steps_total, steps_pending, approvals_count, rejections_count, special_approvals, version) "
+                          "VALUES (1, 1, 1, 1.0, 'INR', 1.0, 'pending', '2024-01-05', 1, 1, 0, 0, 0, 1)"))
+        conn.execute(text("INSERT INTO approvalstep (expense_id, approver_id, sequence, completed, escalation_level) VALUES (1, 2, 1, 0, 0)"))
+    migrate(engine)
+    with Session(engine) as s:
+        assert s.get(models.Expense, 1).updated_at is not None
+        # an untouched step dates from its expense, so the escalation SLA has long passed
+        assert s.exec(select(models.ApprovalStep)).one().updated_at == datetime(2024, 1, 5)
+
+
+def test_summary_backfill_matches_rebuild(tmp_path):
+    from reports import rebuild
+    engine = create_engine(f"sqlite:///{tmp_path / 'v3.db'}")
+    SQLModel.metadata.create_all(engine)
+    summary = "SELECT company_id, dimension, key, count, total FROM expensesummary ORDER BY 1, 2, 3"
+    with engine.begin() as conn:
+        current_version(conn)
+        conn.execute(text("INSERT INTO schemaversion (version) VALUES (3)"))
+        for i, (category, day) in enumerate([("travel", "2024-01-05"), (None, "2024-01-20"), ("travel", None), ("meals", "2024-02-01")]):
+            conn.execute(text("INSERT INTO expense (submitter_id, company_id, amount, currency, amount_company_currency, status, date, category, "
+                              "steps_total, steps_pending, approvals_count, rejections_count, special_approvals, version) "
+                              "VALUES (:s, 1, :a, 'INR', :a, 'pending', :d, :c, 0, 0, 0, 0, 0, 1)"),
+                         {"s": 1 + i % 2, "a": 10.0 + i, "d": day, "c": category})
+    migrate(engine)
+    with engine.begin() as conn:
+        backfilled = conn.execute(text(summary)).fetchall()
+        rebuild(conn)
+        assert backfilled and backfilled == conn.execute(text(summary)).fetchall()
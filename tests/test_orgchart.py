@@ -0,0 +1,37 @@
+from fastapi.testclient import TestClient
+
+import orgchart
+from main import app
+from orgchart import OrgTree, parse_escalation
+
+client = TestClient(app)
+
+
+def test_chain_walks_levels_by_amount(monkeypatch):
+    # 4 reports to 3, 3 to 2; 1 and 5 are admins
+    tree = OrgTree(1, {1: None, 2: 1, 3: 2, 4: 3, 5: None}, (1, 5))
+    monkeypatch.setattr(orgchart, "ORG_ESCALATION", parse_escalation("1000:2,5000:3"))
+    assert tree.approvers(4, 10) == [3, 1, 5]
+    assert tree.approvers(4, 1000) == [3, 2, 1, 5]
+    assert tree.approvers(4, 9000) == [3, 2, 1, 5]
+    assert tree.approvers(4, 9000, approver_ids=[2]) == [2]
+    # unknown to the cached tree: falls back to the submitter's own manager
+    assert tree.approvers(9, 10, manager_id=2) == [2, 1, 5]
+    # reporting cycles end the walk
+    assert OrgTree(1, {2: 3, 3: 2}, ()).managers_above(2, 5) == [3]
+
+
+def test_tree_invalidated_when_manager_changes(tenant):
+    t = tenant('org.test')
+    company_id, admin_id, headers = t.company_id, t.admin_id, t.headers
+    mgr = t.user("m", role="manager")
+    emp = t.user("e")
+
+    resp = client.post('/expenses', json={"submitter_id": emp, "amount": 5.0, "currency": "INR"}, headers=headers)
+    assert resp.status_code == 200
+    assert client.get(f'/approvals/user/{admin_id}/pending').json()[0]['expense']['id'] == resp.json()['id']
+
+    t.user("e", manager_id=mgr)
+    assert orgchart.trees.get(company_id) is None
+    eid = client.post('/expenses', json={"submitter_id": emp, "amount": 5.0, "currency": "INR"}, headers=headers).json()['id']
+    assert [p['expense']['id'] for p in client.get(f'/approvals/user/{mgr}/pending').json()] == [eid]
@@ -0,0 +1,19 @@
+import asyncio
+
+from passlib.context import CryptContext
+
+import passwords
+
+
+def test_hash_verify_and_rehash_on_cost_change():
+    hashed = passwords.hash_password('s3cret')
+    assert passwords.verify_password('s3cret', hashed)
+    assert not passwords.verify_password('wrong', hashed)
+
+    # a hash made at another cost verifies and comes back upgraded
+    old = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash('s3cret')
+    valid, new_hash = asyncio.run(passwords.averify_password('s3cret', old))
+    assert valid and new_hash and new_hash != old
+    assert not passwords.pwd_context.needs_update(new_hash)
+    valid, new_hash = asyncio.run(passwords.averify_password('s3cret', hashed))
+    assert valid and new_hash is None
@@ -0,0 +1,84 @@
+import threading
+import time
+
+import pytest
+from rates import RateProvider, MOCK_RATES
+
+
+def test_single_flight_and_cross_rate():
+    calls = []
+
+    def slow_fetch(base):
+        calls.append(base)
+        time.sleep(0.05)
+        return dict(MOCK_RATES)
+
+    provider = RateProvider(fetch=slow_fetch, ttl=60)
+    threads = [threading.Thread(target=provider.table, args=('USD',)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert calls == ['USD']
+    # any pair is derived from the one USD table without another fetch
+    assert provider.get_rate('INR', 'EUR') == pytest.approx(0.9 / 82.0)
+    assert provider.get_rate('EUR', 'EUR') == 1.0
+    assert calls == ['USD']
+
+
+def test_snapshot_serves_outage(tmp_path):
+    snap = str(tmp_path / 'rates.json')
+    RateProvider(fetch=lambda base: dict(MOCK_RATES), ttl=0, snapshot_path=snap).table('USD')
+
+    def down(base):
+        raise ConnectionError('upstream unavailable')
+
+    cold = RateProvider(fetch=down, ttl=0, snapshot_path=snap)
+    assert cold.get_rate('USD', 'INR') == 82.0
+    assert cold.as_of('USD') is not None
+
+
+def test_outage_is_not_retried_by_every_caller():
+    calls = []
+
+    def down(base):
+        calls.append(base)
+        time.sleep(0.05)
+        raise ConnectionError('upstream unavailable')
+
+    provider = RateProvider(fetch=down, ttl=60, retry=60)
+    provider._tables['USD'] = {"as_of": time.time() - 3600, "rates": dict(MOCK_RATES)}
+    got = []
+    threads = [threading.Thread(target=lambda: got.append(provider.get_rate('USD', 'INR'))) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # one failed fetch; the queued callers and later ones get the stale table
+    assert got == [82.0] * 10 and calls == ['USD']
+    assert provider.get_rate('USD', 'EUR') == 0.9 and calls == ['USD']
+
+    # without a table to fall back on, the error is repeated rather than refetched
+    empty = RateProvider(fetch=down, ttl=60, retry=60)
+    for _ in range(3):
+        with pytest.raises(ConnectionError):
+            empty.table('EUR')
+    assert calls == ['USD', 'EUR']
+
+
+def test_async_misses_share_one_fetch():
+    import asyncio
+    calls = []
+
+    async def afetch(base):
+        calls.append(base)
+        await asyncio.sleep(0.05)
+        return dict(MOCK_RATES)
+
+    provider = RateProvider(fetch=None, afetch=afetch, ttl=60)
+
+    async def run():
+        return await asyncio.gather(*[provider.aget_rate('USD', 'INR') for _ in range(8)])
+
+    assert asyncio.run(run()) == [82.0] * 8
+    assert calls == ['USD']
@@ -0,0 +1,101 @@
+import time
+from datetime import date, datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+import receipts
+from db import get_session
+from main import app
+from models import ReceiptJob
+from receipts import parse_receipt_text
+
+client = TestClient(app)
+
+
+def test_parse_receipt_text():
+    parsed = parse_receipt_text("Cafe Roma\n12/03/2024\nPasta  € 14,50\nWine 6,00\nTOTAL 20,50\n")
+    assert parsed == {"amount": 20.5, "currency": "EUR", "date": "2024-03-12",
+                      "lines": [{"label": "Pasta", "amount": 14.5}, {"label": "Wine", "amount": 6.0}]}
+
+
+def _wait(job_id, headers):
+    for _ in range(50):
+        job = client.get(f'/ocr/jobs/{job_id}', headers=headers).json()
+        if job['status'] not in ('queued', 'running'):
+            return job
+        time.sleep(0.05)
+    return job
+
+
+def test_ocr_job_is_cached_by_content(tenant):
+    headers = tenant('ocr.test').headers
+    assert client.post('/ocr/receipt', files={"file": ("r.png", b"receipt-bytes", "image/png")}).status_code == 401
+    resp = client.post('/ocr/receipt', files={"file": ("r.png", b"receipt-bytes", "image/png")}, headers=headers)
+    assert resp.status_code == 202
+    job_id = resp.json()['job_id']
+    job = _wait(job_id, headers)
+    assert job['status'] == 'done'
+    assert job['expense_draft'] == {"amount": 42.5, "currency": "USD", "date_": date.today().isoformat(), "description": "Lunch"}
+
+    again = client.post('/ocr/receipt', files={"file": ("copy.png", b"receipt-bytes", "image/png")}, headers=headers).json()
+    assert again['job_id'] == job_id and again['result'] == job['result']
+    assert client.get('/ocr/jobs/999999', headers=headers).status_code == 404
+
+    # another company neither reads the job nor shares it by uploading the same bytes
+    other = tenant('ocr-other.test').headers
+    assert client.get(f'/ocr/jobs/{job_id}', headers=other).status_code == 404
+    theirs = client.post('/ocr/receipt', files={"file": ("r.png", b"receipt-bytes", "image/png")}, headers=other).json()
+    assert theirs['job_id'] != job_id
+    assert _wait(theirs['job_id'], other)['status'] == 'done'
+
+
+def test_failed_job_is_retried_on_reupload(tenant, monkeypatch):
+    headers = tenant('ocrfail.test').headers
+
+    class Broken(receipts.MockEngine):
+        def extract_text(self, path):
+            raise RuntimeError("engine crashed")
+    monkeypatch.setitem(receipts.ENGINES, "mock", Broken)
+    job_id = client.post('/ocr/receipt', files={"file": ("f.png", b"flaky-bytes", "image/png")}, headers=headers).json()['job_id']
+    assert _wait(job_id, headers)['status'] == 'failed'
+
+    monkeypatch.undo()
+    again = client.post('/ocr/receipt', files={"file": ("f.png", b"flaky-bytes", "image/png")}, headers=headers).json()
+    assert again['job_id'] == job_id
+    assert _wait(job_id, headers)['status'] == 'done'
+
+
+def test_callbacks_and_upload_rate_are_limited(tenant, monkeypatch):
+    headers = tenant('ocrlimit.test').headers
+    for url in ("http://127.0.0.1:8000/hook", "http://169.254.169.254/latest", "http://10.1.2.3/", "file:///etc/passwd"):
+        resp = client.post('/ocr/receipt', files={"file": ("c.png", b"cb", "image/png")}, data={"callback_url": url}, headers=headers)
+        assert resp.status_code == 422, url
+    monkeypatch.setattr(receipts, "OCR_CALLBACK_HOSTS", {"hooks.example.com"})
+    assert receipts.check_callback("https://hooks.example.com/ocr")
+
+    monkeypatch.setattr(receipts, "OCR_UPLOADS_PER_MINUTE", 2)
+    assert receipts.upload_wait(-1, now=0) == 0 and receipts.upload_wait(-1, now=1) == 0
+    assert receipts.upload_wait(-1, now=30) == 30
+    assert receipts.upload_wait(-1, now=61) == 0
+    monkeypatch.setattr(receipts, "OCR_UPLOADS_PER_MINUTE", 0)
+    resp = client.post('/ocr/receipt', files={"file": ("c.png", b"cb", "image/png")}, headers=headers)
+    assert resp.status_code == 429 and 0 < int(resp.headers['Retry-After']) <= 61
+
+
+
+def test_each_leftover_job_is_resumed_by_one_worker(monkeypatch):
+    started = []
+    monkeypatch.setattr(receipts, "enqueue", lambda job_id, sha: started.append(job_id))
+    with get_session() as s:
+        queued = ReceiptJob(sha256="resume-queued", status="queued")
+        expired = ReceiptJob(sha256="resume-expired", status="running", lease_until=datetime.utcnow() - timedelta(seconds=1))
+        live = ReceiptJob(sha256="resume-live", status="running", lease_until=datetime.utcnow() + timedelta(minutes=5))
+        s.add_all([queued, expired, live])
+        s.commit()
+        ids = [queued.id, expired.id, live.id]
+    # two workers starting together: the second finds nothing left to claim
+    receipts.resume_pending()
+    receipts.resume_pending()
+    assert sorted(j for j in started if j in ids) == sorted(ids[:2])
+    with get_session() as s:
+        assert {s.get(ReceiptJob, i).status for i in ids} == {"running"}
@@ -0,0 +1,34 @@
+from fastapi.testclient import TestClient
+
+from db import engine
+from main import app
+from reports import rebuild
+
+client = TestClient(app)
+
+
+def test_reports_track_submissions_and_decisions(tenant):
+    t = tenant('report.test')
+    company_id, admin_id, headers = t.company_id, t.admin_id, t.headers
+
+    rows = [{"submitter_id": admin_id, "amount": 10.0, "currency": "INR", "category": "travel", "date_": "2024-02-10"},
+            {"submitter_id": admin_id, "amount": 5.0, "currency": "INR", "date_": "2024-03-01"}]
+    client.post('/expenses/bulk', json=rows, headers=headers)
+    resp = client.post('/expenses', json={"submitter_id": admin_id, "amount": 1.0, "currency": "USD", "category": "travel", "date_": "2024-02-11", "approver_ids": [admin_id]}, headers=headers)
+    eid = resp.json()['id']
+    assert client.post(f'/approvals/{eid}/decision', json={"approver_id": admin_id, "approved": True}, headers=headers).json()['status'] == 'approved'
+
+    report = client.get(f'/companies/{company_id}/reports', headers=headers).json()
+    assert report['currency'] == 'INR'
+    assert report['by_category'] == [{"key": None, "count": 1, "total": 5.0}, {"key": "travel", "count": 2, "total": 92.0}]
+    assert report['by_month'] == [{"key": "2024-02", "count": 2, "total": 92.0}, {"key": "2024-03", "count": 1, "total": 5.0}]
+    assert {g['key']: g['count'] for g in report['by_status']} == {"approved": 1, "pending": 2}
+    assert report['by_submitter'] == [{"key": str(admin_id), "count": 3, "total": 97.0}]
+
+    # a rebuild from the expense table lands on the same numbers
+    with engine.begin() as conn:
+        rebuild(conn, company_id)
+    assert client.get(f'/companies/{company_id}/reports', headers=headers).json() == report
+
+    other = tenant('other.report.test')
+    assert client.get(f"/companies/{other.company_id}/reports", headers=headers).status_code == 403
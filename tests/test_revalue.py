@@ -0,0 +1,48 @@
+import random
+from datetime import date
+from decimal import Decimal
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import money
+import revalue
+from db import engine, get_session
+from main import app
+from models import Expense
+
+client = TestClient(app)
+
+
+def test_convert_many_matches_decimal_convert():
+    rng = random.Random(7)
+    minor = [rng.randrange(-10 ** 9, 10 ** 9) for _ in range(2000)] + [5, -5, 15, 25, 1, 0]
+    for rate, source, target in ((Decimal("0.5"), "USD", "USD"), (Decimal("82.123456789"), "USD", "INR"),
+                                 (Decimal("0.0061"), "JPY", "USD"), (Decimal("163.5"), "USD", "JPY"),
+                                 (Decimal("0.30591"), "KWD", "EUR")):
+        got = revalue.convert_many(np.array(minor, dtype=np.int64), rate, source, target)
+        assert got.tolist() == [money.convert(m, rate, source, target) for m in minor]
+
+
+def test_revalue_reprices_one_pair_and_rebuilds_reports(tenant):
+    t = tenant('reval.test')
+    company_id, admin_id, headers = t.company_id, t.admin_id, t.headers
+    eur = client.post('/expenses', json={"submitter_id": admin_id, "amount": 10.01, "currency": "EUR"}, headers=headers).json()
+    inr = client.post('/expenses', json={"submitter_id": admin_id, "amount": 5.0, "currency": "INR"}, headers=headers).json()
+    assert eur['amount_company_currency'] == 912.02 and Decimal(inr['fx_rate']) == 1
+
+    fixed = {("EUR", "INR"): (Decimal("90.25"), date(2024, 3, 31))}
+    stats = revalue.revalue(engine, lambda s, t: fixed.get((s, t)), company_id=company_id, pairs=list(fixed))
+    assert stats["rows"] == 1 and stats["changed"] == 1
+    with get_session() as s:
+        row = s.get(Expense, eur['id'])
+        # 1001 cents * 90.25 = 90340.25 paise -> 90340
+        assert (row.amount_company_minor, row.amount_company_currency) == (90340, 903.40)
+        assert row.fx_rate == Decimal("90.25") and row.fx_as_of == date(2024, 3, 31)
+        # written once more than the untouched INR expense
+        assert row.version == s.get(Expense, inr['id']).version + 1
+    report = client.get(f'/companies/{company_id}/reports', headers=headers).json()
+    assert sum(g["total"] for g in report["by_status"]) == pytest.approx(903.40 + 5.0)
+    # already priced at that rate: nothing to write
+    assert revalue.revalue(engine, lambda s, t: fixed.get((s, t)), company_id=company_id, pairs=list(fixed))["changed"] == 0
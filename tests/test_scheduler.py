@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import update
+from sqlmodel import select
+
+import scheduler
+from db import engine, get_session
+from main import app
+from migrations import check_query_plans
+from models import ApprovalStep, Expense, SchedulerLock
+
+client = TestClient(app)
+
+
+def _setup(tenant, slug):
+    t = tenant(slug)
+    mgr = t.user("m", role="manager", manager_id=t.admin_id)
+    emp = t.user("e", manager_id=mgr)
+    return t.company_id, t.admin_id, mgr, emp, t.headers
+
+
+def test_escalates_stale_steps_and_sends_digests(tenant):
+    company_id, admin_id, mgr, emp, headers = _setup(tenant, 'sched.test')
+    eid = client.post('/expenses', json={"submitter_id": emp, "amount": 5.0, "currency": "INR", "approver_ids": [mgr]}, headers=headers).json()['id']
+    # the default chain is manager then admin, so the admin is already on it
+    chained = client.post('/expenses', json={"submitter_id": emp, "amount": 5.0, "currency": "INR"}, headers=headers).json()['id']
+    now = datetime.utcnow()
+    # nothing is overdue yet
+    assert scheduler.escalate(now) == 0
+    with get_session() as s:
+        s.execute(update(ApprovalStep).where(ApprovalStep.expense_id.in_([eid, chained])).values(updated_at=now - timedelta(days=5)))
+        s.commit()
+    digests = []
+    scheduler.remind(send=digests.append)
+    assert {"user_id": mgr, "email": "m@sched.test", "pending": 2} == {k: v for d in digests if d["user_id"] == mgr for k, v in d.items() if k != "oldest"}
+
+    assert scheduler.escalate(now, chunk=1) == 1
+    with get_session() as s:
+        first = s.exec(select(ApprovalStep).where(ApprovalStep.expense_id == eid).order_by(ApprovalStep.sequence)).first()
+        assert (first.approver_id, first.escalation_level) == (admin_id, 1)
+        # nobody above the manager is off the chain, so that step stays put
+        steps = s.exec(select(ApprovalStep).where(ApprovalStep.expense_id == chained).order_by(ApprovalStep.sequence)).all()
+        assert [st.approver_id for st in steps] == [mgr, admin_id]
+    # the reassignment restarts the clock
+    assert scheduler.escalate(now) == 0
+    assert check_query_plans(engine) == []
+
+
+def test_due_times_survive_restart():
+    runs = []
+    # the same owner each time, so every instance holds the lease
+    job = lambda: scheduler.Scheduler(jobs=[scheduler.Job("due-test", 60, lambda alive: runs.append(1) or 1)], owner="due-test")
+    now = datetime.utcnow()
+    assert job().run_due(now) == {"due-test": 1}
+    # a restarted worker or new leader picks up the stored due time
+    assert job().run_due(now + timedelta(seconds=30)) == {}
+    assert job().run_due(now + timedelta(seconds=61)) == {"due-test": 1}
+    assert len(runs) == 2
+    job().release()
+
+
+def test_job_stops_when_the_lease_is_lost():
+    chunks = []
+
+    def long_job(alive):
+        while alive() and len(chunks) < 5:
+            chunks.append(1)
+            if len(chunks) == 2:
+                # this worker stalls past its lease and another one takes over
+                with engine.begin() as conn:
+                    conn.execute(update(SchedulerLock).where(SchedulerLock.name == scheduler.LOCK_NAME)
+                                 .values(owner="other", expires_at=datetime.utcnow() + timedelta(minutes=5)))
+                a._renewed = 0.0
+        return len(chunks)
+    a = scheduler.Scheduler(jobs=[scheduler.Job("lease-test", 60, long_job)], tick=1)
+    assert a.acquire()
+    assert a.run_due() == {"lease-test": 2}
+    assert chunks == [1, 1] and not a.leading()
+    with engine.begin() as conn:
+        conn.execute(update(SchedulerLock).where(SchedulerLock.name == scheduler.LOCK_NAME)
+                     .values(expires_at=datetime.utcnow() - timedelta(seconds=1)))
+    # cut short, so not marked as run: the new leader runs it again
+    assert scheduler.Scheduler(jobs=[scheduler.Job("lease-test", 60, long_job)], owner="b").run_due() == {"lease-test": 5}
+    scheduler.Scheduler(owner="b").release()
+
+
+def test_rules_job_settles_pending_expenses_and_single_leader(tenant):
+    company_id, admin_id, mgr, emp, headers = _setup(tenant, 'rules.test')
+    eid = client.post('/expenses', json={"submitter_id": emp, "amount": 5.0, "currency": "INR", "approver_ids": [mgr, admin_id]}, headers=headers).json()['id']
+    assert client.post(f'/approvals/{eid}/decision', json={"approver_id": mgr, "approved": True}, headers=headers).json()['status'] == 'approved'
+    eid = client.post('/expenses', json={"submitter_id": emp, "amount": 5.0, "currency": "INR", "approver_ids": [mgr, admin_id, emp]}, headers=headers).json()['id']
+    client.post(f'/approvals/{eid}/decision', json={"approver_id": mgr, "approved": True}, headers=headers)
+    # 1/3 approvals misses 50%; lowering the rule settles it on the next run
+    assert client.put(f'/companies/{company_id}/rule', json={"percentage_threshold": 30}, headers=headers).status_code == 200
+    assert scheduler.apply_rules(chunk=1) >= 1
+    with get_session() as s:
+        assert s.get(Expense, eid).status == 'approved'
+
+    a, b = scheduler.Scheduler(jobs=[], tick=1), scheduler.Scheduler(jobs=[], tick=1)
+    assert a.acquire() and not b.acquire()
+    a.release()
+    assert b.acquire()
+    b.release()
@@ -0,0 +1,42 @@
+from fastapi.testclient import TestClient
+
+from main import app
+from pagination import encode_cursor
+
+client = TestClient(app)
+
+
+def test_search_ranks_filters_facets_and_paginates(tenant):
+    t = tenant('search.test')
+    company_id, admin_id, headers = t.company_id, t.admin_id, t.headers
+    rows = [{"submitter_id": admin_id, "amount": 12.0, "currency": "INR", "category": "travel", "description": "Taxi to airport"},
+            {"submitter_id": admin_id, "amount": 30.0, "currency": "USD", "category": "travel", "description": "Taxi taxi home, late night"},
+            {"submitter_id": admin_id, "amount": 8.0, "currency": "INR", "category": "meals", "description": "Café lunch"},
+            {"submitter_id": admin_id, "amount": 5.0, "currency": "INR", "category": "office", "description": "Pens"}]
+    client.post('/expenses/bulk', json=rows, headers=headers)
+    url = f'/companies/{company_id}/expenses/search'
+
+    found = client.get(url, params={"q": "taxi"}, headers=headers).json()
+    assert [r['description'] for r in found['results']] == ["Taxi taxi home, late night", "Taxi to airport"]
+    assert found['facets']['currency'] == [{"value": "INR", "count": 1}, {"value": "USD", "count": 1}]
+    # prefix match on the last word, diacritics folded, filters applied
+    assert [r['description'] for r in client.get(url, params={"q": "cafe lun"}, headers=headers).json()['results']] == ["Café lunch"]
+    assert client.get(url, params={"q": "taxi", "currency": "INR"}, headers=headers).json()['results'][0]['amount'] == 12.0
+    # stray FTS syntax is treated as plain words
+    assert client.get(url, params={"q": 'taxi" OR ('}, headers=headers).status_code == 200
+
+    resp = client.get(url, params={"limit": 3}, headers=headers)
+    assert [r['amount'] for r in resp.json()['results']] == [5.0, 8.0, 30.0]
+    resp = client.get(url, params={"limit": 3, "cursor": resp.headers['X-Next-Cursor']}, headers=headers)
+    assert [r['amount'] for r in resp.json()['results']] == [12.0] and resp.json()['next_cursor'] is None
+
+    resp = client.get(url, params={"q": "taxi", "limit": 1}, headers=headers)
+    resp = client.get(url, params={"q": "taxi", "limit": 1, "cursor": resp.json()['next_cursor']}, headers=headers)
+    assert [r['description'] for r in resp.json()['results']] == ["Taxi to airport"]
+    # tampered cursors are a 400, with text and without
+    for params in ({"cursor": encode_cursor([{"a": 1}])}, {"cursor": encode_cursor(["1"])},
+                   {"q": "taxi", "cursor": encode_cursor([[1], 1])}, {"q": "taxi", "cursor": encode_cursor(["x", 1])},
+                   {"q": "taxi", "cursor": encode_cursor([-1.5, "1"])}):
+        assert client.get(url, params=params, headers=headers).status_code == 400, params
+
+    assert client.get('/companies/999/expenses/search', headers=headers).status_code == 403